@@ -0,0 +1,273 @@
+'''
+load path benchmarks on synthetic models
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run -o new.json --compare results.json
+
+each stage runs repeat times on a fresh input and keeps the min and the
+median. peak memory is measured by tracemalloc in one more run, apart from
+the timing. numpy allocations are traced too.
+
+the cache stages run load_drawer with the viewer shader, so they need
+the renderer imports (PyOpenGL, PIL) but no GL context.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import argparse
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+
+import pyvbo
+from pyvbo import cache, coordinate
+from pyvbo.metadata import Coordinate
+
+from . import synthetic
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+DEFAULT_STAGES = ('load', 'convert', 'bounds', 'weld', 'optimize', 'repack',
+                  'cache_cold', 'cache_warm')
+
+# the results of these stages are compared
+KEY_FIELDS = ('format', 'vertices', 'triangles', 'materials', 'textures', 'stage')
+
+
+def _loaded(path: pathlib.Path):
+    return pyvbo.load(path, use_mmap=True)
+
+
+def _converted(path: pathlib.Path):
+    m = _loaded(path)
+    coordinate.convert(m, Coordinate.YUP_ZBACKWARD)
+    return m
+
+
+def _weld(m):
+    from pyvbo.weld import weld
+    weld(m)
+
+
+def _optimize(m):
+    from pyvbo.optimize import optimize
+    optimize(m)
+
+
+def _lods(m):
+    from pyvbo.simplify import build_lods
+    build_lods(m)
+
+
+def _meshlets(m):
+    from pyvbo.meshlet import build_meshlets
+    build_meshlets(m)
+
+
+def _repack(m):
+    import shaders
+    from renderer.repack import Quantization, repack
+    repack(m.vertices, shaders.MmdShader.vertex_layout, Quantization())
+
+
+def _cache_store(path: pathlib.Path, warm: bool)->Tuple[pathlib.Path, cache.CacheStore]:
+    store = cache.CacheStore(path.parent / 'cache')
+    if not warm and store.directory.exists():
+        shutil.rmtree(store.directory)
+    if warm and not store.directory.exists():
+        _load_drawer((path, store))
+    return path, store
+
+
+def _load_drawer(state):
+    import shaders
+    from renderer import load_drawer
+    path, store = state
+    load_drawer(path, shaders.MmdShader, store)
+
+
+# name: (setup(path) -> state, run(state)). only run is measured
+STAGES: Dict[str, Tuple[Callable[[pathlib.Path], Any], Callable[[Any], Any]]] = {
+    'load': (lambda path: path, _loaded),
+    'convert': (_loaded, lambda m: coordinate.convert(m, Coordinate.YUP_ZBACKWARD)),
+    'bounds': (_converted, lambda m: m.update_bounds()),
+    'weld': (_converted, _weld),
+    'optimize': (_converted, _optimize),
+    'lods': (_converted, _lods),
+    'meshlets': (_converted, _meshlets),
+    'repack': (_converted, _repack),
+    'cache_cold': (lambda path: _cache_store(path, False), _load_drawer),
+    'cache_warm': (lambda path: _cache_store(path, True), _load_drawer),
+}
+
+
+def measure(setup: Callable[[pathlib.Path], Any], run: Callable[[Any], Any],
+            path: pathlib.Path, repeat: int)->Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        state = setup(path)
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+        del state
+
+    state = setup(path)
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'peak_bytes': peak,
+    }
+
+
+def metadata()->Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def run_all(directory: pathlib.Path, formats: Sequence[str], vertex_counts: Sequence[int],
+            triangle_count: Optional[int], material_count: int, texture_count: int,
+            texture_size: int, stages: Sequence[str], repeat: int)->List[Dict[str, Any]]:
+    results = []
+    for fmt in formats:
+        for vertex_count in vertex_counts:
+            if fmt == 'pmd' and vertex_count > 65535:
+                logger.warning('skip pmd %d vertices. uint16 indices', vertex_count)
+                continue
+            path, mesh = synthetic.generate(
+                directory / f'{fmt}_{vertex_count}', fmt, vertex_count, triangle_count,
+                material_count, texture_count, texture_size)
+            for stage in stages:
+                setup, run = STAGES[stage]
+                result = {
+                    'format': fmt,
+                    'vertices': mesh.vertex_count,
+                    'triangles': len(mesh.triangles),
+                    'materials': material_count,
+                    'textures': texture_count,
+                    'file_bytes': path.stat().st_size,
+                    'stage': stage,
+                    'repeat': repeat,
+                }
+                result.update(measure(setup, run, path, repeat))
+                print(f'{fmt:<5} {mesh.vertex_count:>9} {stage:<11} '
+                      f'{result["min"] * 1000:10.2f}ms {result["peak_bytes"] / 2**20:9.1f}MiB')
+                results.append(result)
+    return results
+
+
+def compare(baseline: List[Dict[str, Any]], results: List[Dict[str, Any]],
+            threshold: float)->List[str]:
+    '''
+    returns the regressions. min time slower than 1 + threshold
+    '''
+    def key(x):
+        return tuple(x[k] for k in KEY_FIELDS)
+
+    base = {key(x): x for x in baseline}
+    regressions = []
+    for result in results:
+        old = base.get(key(result))
+        if not old or old['min'] <= 0:
+            continue
+        ratio = result['min'] / old['min']
+        memory = result['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 1.0
+        line = (f'{result["format"]:<5} {result["vertices"]:>9} {result["stage"]:<11} '
+                f'time x{ratio:.2f} memory x{memory:.2f}')
+        print(line)
+        if ratio > 1.0 + threshold:
+            regressions.append(line)
+    return regressions
+
+
+def _ints(value: str)->List[int]:
+    return [int(x) for x in value.split(',') if x]
+
+
+def _names(value: str)->List[str]:
+    return [x for x in value.split(',') if x]
+
+
+def main(argv: Optional[Sequence[str]]=None)->int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='benchmark the load path')
+    parser.add_argument('--formats', type=_names, default=list(synthetic.FORMATS))
+    parser.add_argument('--vertices', type=_ints, default=[10000, 60000])
+    parser.add_argument('--triangles', type=int,
+                        help='triangle count. default: the grid of the vertices')
+    parser.add_argument('--materials', type=int, default=8)
+    parser.add_argument('--textures', type=int, default=4)
+    parser.add_argument('--texture-size', type=int, default=256)
+    parser.add_argument('--stages', type=_names, default=list(DEFAULT_STAGES),
+                        help=f'from {",".join(STAGES)}')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', type=pathlib.Path,
+                        help='keep the generated models here. default: a temporary directory')
+    parser.add_argument('-o', '--output', type=pathlib.Path, help='results json')
+    parser.add_argument('--compare', type=pathlib.Path, metavar='BASELINE',
+                        help='results json to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression. default 0.1')
+    args = parser.parse_args(argv)
+
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error(f'unknown stage: {stage}')
+    for fmt in args.formats:
+        if fmt not in synthetic.FORMATS:
+            parser.error(f'unknown format: {fmt}')
+
+    def run(directory: pathlib.Path):
+        return run_all(directory, args.formats, args.vertices, args.triangles,
+                       args.materials, args.textures, args.texture_size,
+                       args.stages, args.repeat)
+
+    if args.workdir:
+        results = run(args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='pyvbo_benchmark_') as directory:
+            results = run(pathlib.Path(directory))
+
+    if args.output:
+        args.output.write_text(json.dumps(
+            {'meta': metadata(), 'results': results}, indent=2))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())['results']
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions:')
+            for line in regressions:
+                print('  ' + line)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+'''
+synthetic models for the benchmarks
+
+a wavy grid of about vertex_count vertices. triangles are split into
+material_count contiguous ranges, and the materials use texture_count
+png textures round robin.
+'''
+import io
+import json
+import math
+import pathlib
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy
+
+FORMATS = ('pmd', 'obj', 'gltf')
+
+
+class Mesh:
+    def __init__(self, positions: numpy.ndarray, normals: numpy.ndarray,
+                 uvs: numpy.ndarray, triangles: numpy.ndarray)->None:
+        self.positions = positions
+        self.normals = normals
+        self.uvs = uvs
+        self.triangles = triangles
+
+    @property
+    def vertex_count(self)->int:
+        return len(self.positions)
+
+    @property
+    def index_count(self)->int:
+        return self.triangles.size
+
+
+def grid(vertex_count: int, triangle_count: Optional[int]=None)->Mesh:
+    '''
+    triangle_count: repeat or cut the grid triangles. default: the grid
+    '''
+    w = max(2, math.ceil(math.sqrt(vertex_count)))
+    h = max(2, vertex_count // w)
+    u, v = numpy.meshgrid(numpy.linspace(0, 1, w, dtype=numpy.float32),
+                          numpy.linspace(0, 1, h, dtype=numpy.float32))
+    height = numpy.sin(u * 12.0) * numpy.cos(v * 12.0) * 0.05
+    positions = numpy.stack([u - 0.5, v - 0.5, height], axis=-1).reshape(-1, 3)
+    # d(height)/du, d(height)/dv
+    du = numpy.cos(u * 12.0) * numpy.cos(v * 12.0) * 0.6
+    dv = -numpy.sin(u * 12.0) * numpy.sin(v * 12.0) * 0.6
+    normals = numpy.stack([-du, -dv, numpy.ones_like(u)], axis=-1).reshape(-1, 3)
+    normals /= numpy.linalg.norm(normals, axis=1)[:, None]
+    uvs = numpy.stack([u, 1.0 - v], axis=-1).reshape(-1, 2)
+
+    corner = (numpy.arange(h - 1)[:, None] * w + numpy.arange(w - 1)[None, :]).reshape(-1)
+    triangles = numpy.concatenate([
+        numpy.stack([corner, corner + 1, corner + w + 1], axis=1),
+        numpy.stack([corner, corner + w + 1, corner + w], axis=1),
+    ], axis=1).reshape(-1, 3).astype(numpy.uint32)
+    if triangle_count is not None:
+        triangles = numpy.resize(triangles, (triangle_count, 3))
+    return Mesh(positions.astype(numpy.float32), normals.astype(numpy.float32),
+                uvs.astype(numpy.float32), triangles)
+
+
+def material_counts(triangle_count: int, material_count: int)->List[int]:
+    '''
+    index count of each material
+    '''
+    material_count = max(1, material_count)
+    per = triangle_count // material_count
+    counts = [per] * (material_count - 1) + [triangle_count - per * (material_count - 1)]
+    return [x * 3 for x in counts]
+
+
+def write_png(path: pathlib.Path, size: int, seed=0)->None:
+    '''
+    RGBA8 gradient with a checker. no PIL needed
+    '''
+    y, x = numpy.mgrid[0:size, 0:size]
+    pixels = numpy.zeros((size, size, 4), numpy.uint8)
+    pixels[..., 0] = x * 255 // max(size - 1, 1)
+    pixels[..., 1] = y * 255 // max(size - 1, 1)
+    pixels[..., 2] = ((x // 8 + y // 8 + seed) % 2) * 255
+    pixels[..., 3] = 255
+    raw = numpy.concatenate(
+        [numpy.zeros((size, 1), numpy.uint8), pixels.reshape(size, -1)], axis=1).tobytes()
+
+    def chunk(kind: bytes, data: bytes)->bytes:
+        return struct.pack('>I', len(data)) + kind + data +\
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    path.write_bytes(b'\x89PNG\r\n\x1a\n'
+                     + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 6, 0, 0, 0))
+                     + chunk(b'IDAT', zlib.compress(raw, 1))
+                     + chunk(b'IEND', b''))
+
+
+def write_textures(directory: pathlib.Path, texture_count: int, size: int)->List[str]:
+    names = []
+    for i in range(texture_count):
+        name = f'tex{i:03}.png'
+        write_png(directory / name, size, i)
+        names.append(name)
+    return names
+
+
+def _texture(textures: List[str], material: int)->Optional[str]:
+    return textures[material % len(textures)] if textures else None
+
+
+def write_pmd(path: pathlib.Path, mesh: Mesh, material_count: int,
+              textures: List[str])->None:
+    if mesh.vertex_count > 65535:
+        raise ValueError(f'pmd indices are uint16. {mesh.vertex_count} vertices')
+    out = io.BytesIO()
+    out.write(b'Pmd' + struct.pack('<f', 1.0))
+    out.write(b'synthetic'.ljust(20, b'\0') + b'pyvbo benchmark'.ljust(256, b'\0'))
+
+    vertices = numpy.zeros(mesh.vertex_count, [
+        ('pos', '<f4', 3), ('normal', '<f4', 3), ('uv', '<f4', 2),
+        ('bone0', '<i2'), ('bone1', '<i2'), ('weight0', 'i1'), ('flag', 'i1')])
+    vertices['pos'] = mesh.positions
+    vertices['normal'] = mesh.normals
+    vertices['uv'] = mesh.uvs
+    vertices['weight0'] = 100
+    out.write(struct.pack('<I', mesh.vertex_count) + vertices.tobytes())
+    out.write(struct.pack('<I', mesh.index_count) + mesh.triangles.astype('<u2').tobytes())
+
+    counts = material_counts(len(mesh.triangles), material_count)
+    out.write(struct.pack('<I', len(counts)))
+    for i, count in enumerate(counts):
+        texture = _texture(textures, i)
+        out.write(struct.pack('<4ff3f3fbbI', 1, 1, 1, 1, 5, 0, 0, 0, 0.5, 0.5, 0.5,
+                              -1, 0, count)
+                  + (texture.encode('ascii') if texture else b'').ljust(20, b'\0'))
+    # no bones, ik and morphs
+    out.write(struct.pack('<HHH', 0, 0, 0))
+    path.write_bytes(out.getvalue())
+
+
+def write_obj(path: pathlib.Path, mesh: Mesh, material_count: int,
+              textures: List[str])->None:
+    mtl = path.with_suffix('.mtl')
+    counts = material_counts(len(mesh.triangles), material_count)
+    with mtl.open('w') as f:
+        for i in range(len(counts)):
+            f.write(f'newmtl material{i}\nKd 1 1 1\n')
+            texture = _texture(textures, i)
+            if texture:
+                f.write(f'map_Kd {texture}\n')
+
+    with path.open('wb') as f:
+        f.write(f'mtllib {mtl.name}\n'.encode('ascii'))
+        numpy.savetxt(f, mesh.positions, fmt='v %.6f %.6f %.6f')
+        numpy.savetxt(f, mesh.uvs, fmt='vt %.6f %.6f')
+        numpy.savetxt(f, mesh.normals, fmt='vn %.6f %.6f %.6f')
+        corners = numpy.repeat(mesh.triangles.astype(numpy.int64) + 1, 3, axis=1)
+        begin = 0
+        for i, count in enumerate(counts):
+            f.write(f'usemtl material{i}\n'.encode('ascii'))
+            end = begin + count // 3
+            numpy.savetxt(f, corners[begin:end], fmt='f %d/%d/%d %d/%d/%d %d/%d/%d')
+            begin = end
+
+
+def write_gltf(path: pathlib.Path, mesh: Mesh, material_count: int,
+               textures: List[str])->None:
+    '''
+    .glb. one primitive per material sharing the vertex accessors
+    '''
+    index_type, component_type = ('<u2', 5123) if mesh.vertex_count <= 65535 else ('<u4', 5125)
+    views = [mesh.positions, mesh.normals, mesh.uvs,
+             mesh.triangles.astype(index_type).reshape(-1)]
+    buffer_views = []
+    binary = bytearray()
+    for array in views:
+        data = numpy.ascontiguousarray(array).tobytes()
+        buffer_views.append({'buffer': 0, 'byteOffset': len(binary), 'byteLength': len(data)})
+        binary += data
+        binary += b'\0' * (-len(binary) % 4)
+
+    accessors = [
+        {'bufferView': 0, 'componentType': 5126, 'count': mesh.vertex_count, 'type': 'VEC3',
+         'min': mesh.positions.min(axis=0).tolist(), 'max': mesh.positions.max(axis=0).tolist()},
+        {'bufferView': 1, 'componentType': 5126, 'count': mesh.vertex_count, 'type': 'VEC3'},
+        {'bufferView': 2, 'componentType': 5126, 'count': mesh.vertex_count, 'type': 'VEC2'},
+    ]
+    primitives = []
+    materials = []
+    offset = 0
+    itemsize = numpy.dtype(index_type).itemsize
+    for i, count in enumerate(material_counts(len(mesh.triangles), material_count)):
+        accessors.append({'bufferView': 3, 'byteOffset': offset * itemsize,
+                          'componentType': component_type, 'count': count, 'type': 'SCALAR'})
+        primitives.append({'attributes': {'POSITION': 0, 'NORMAL': 1, 'TEXCOORD_0': 2},
+                           'indices': len(accessors) - 1, 'material': i})
+        material = {'name': f'material{i}', 'pbrMetallicRoughness': {}}
+        if textures:
+            material['pbrMetallicRoughness']['baseColorTexture'] = {'index': i % len(textures)}
+        materials.append(material)
+        offset += count
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'pyvbo benchmarks'},
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': buffer_views,
+        'accessors': accessors,
+        'meshes': [{'primitives': primitives}],
+        'nodes': [{'mesh': 0}],
+        'scenes': [{'nodes': [0]}],
+        'materials': materials,
+        'textures': [{'source': i} for i in range(len(textures))],
+        'images': [{'uri': x} for x in textures],
+    }
+    text = json.dumps(gltf).encode('utf-8')
+    text += b' ' * (-len(text) % 4)
+    path.write_bytes(b'glTF' + struct.pack('<II', 2, 12 + 8 + len(text) + 8 + len(binary))
+                     + struct.pack('<I', len(text)) + b'JSON' + text
+                     + struct.pack('<I', len(binary)) + b'BIN\0' + bytes(binary))
+
+
+WRITERS = {
+    'pmd': ('.pmd', write_pmd),
+    'obj': ('.obj', write_obj),
+    'gltf': ('.glb', write_gltf),
+}
+
+
+def generate(directory: pathlib.Path, format: str, vertex_count: int,  # pylint: disable=W0622
+             triangle_count: Optional[int]=None, material_count=1,
+             texture_count=0, texture_size=256)->Tuple[pathlib.Path, Mesh]:
+    '''
+    writes the model and its textures into directory
+    '''
+    extension, writer = WRITERS[format]
+    directory.mkdir(parents=True, exist_ok=True)
+    mesh = grid(vertex_count, triangle_count)
+    textures = write_textures(directory, texture_count, texture_size)
+    path = directory / f'synthetic_{mesh.vertex_count}_{len(mesh.triangles)}{extension}'
+    writer(path, mesh, material_count, textures)
+    return path, mesh
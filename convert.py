@@ -0,0 +1,243 @@
+'''
+batch conversion to cache files
+
+    python convert.py models/ -o cache/ --optimize --lods 0.5,0.25
+
+walks the source trees, loads every model of a registered format, converts
+the coordinates, runs the pipeline, quantizes and writes a .pyvbo cache
+file for the viewer shader (shaders.MmdShader) in a process pool.
+
+a file whose cache key (content hash, shader layout, quantization and
+pipeline) already has a valid cache file, with its textures unchanged, is
+skipped. the viewer hits the baked files when it loads with the same
+quantization and Pipeline.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from pyvbo import cache
+from pyvbo.pipeline import Pipeline
+from pyvbo.registry import REGISTRY
+from renderer import AtlasConfig, Drawer, Quantization, TEXTURE_CACHE, load_drawer
+import shaders
+
+
+class Result:
+    '''
+    status: 'built', 'skipped' or 'failed'
+    stages: seconds by progress message of load_drawer
+    '''
+
+    def __init__(self, path: pathlib.Path, status: str, seconds: float,
+                 stages: Dict[str, float], error: Optional[str]=None)->None:
+        self.path = path
+        self.status = status
+        self.seconds = seconds
+        self.stages = stages
+        self.error = error
+
+    def to_dict(self)->dict:
+        return {
+            'path': str(self.path),
+            'status': self.status,
+            'seconds': self.seconds,
+            'stages': self.stages,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f'{{Result {self.status} {self.seconds:.2f}s {self.path}}}'
+
+
+def collect(sources: Iterable[pathlib.Path])->List[pathlib.Path]:
+    '''
+    files of the registered extensions under the directories.
+    files given directly are taken as is.
+    '''
+    REGISTRY.load_entry_points()
+    extensions = {x for f in REGISTRY.formats for x in f.extensions}
+    files: List[pathlib.Path] = []
+    for source in sources:
+        if source.is_dir():
+            files += sorted(x for x in source.rglob('*')
+                            if x.suffix.lower() in extensions and x.is_file())
+        else:
+            files.append(source)
+    return files
+
+
+def convert_file(path: pathlib.Path, cache_dir: pathlib.Path,
+                 pipeline: Optional[Pipeline]=None, position: Optional[str]=None,
+                 force=False, max_texture_size: Optional[int]=None,
+                 texture_filter='box', atlas_size: Optional[int]=None)->Result:
+    '''
+    runs in a worker process. errors are returned in the Result.
+    position: None for float vertices, else the Quantization position.
+    max_texture_size, texture_filter: see renderer.TextureCache
+    atlas_size: pack the textures up to this size. see renderer.AtlasConfig
+    '''
+    TEXTURE_CACHE.max_size = max_texture_size
+    TEXTURE_CACHE.kernel = texture_filter
+
+    start = time.perf_counter()
+    stages: Dict[str, float] = {}
+    last = [start, 'hash']
+
+    def progress(_value: float, message: str):
+        now = time.perf_counter()
+        stages[last[1]] = stages.get(last[1], 0.0) + now - last[0]
+        last[0], last[1] = now, message
+
+    try:
+        shader = shaders.MmdShader
+        quantization = Quantization(position) if position else None
+        atlas = AtlasConfig(atlas_size) if atlas_size else None
+        store = cache.CacheStore(cache_dir)
+        key = Drawer.cache_key(cache.content_hash(path), shader, quantization,
+                               pipeline.key if pipeline else '', atlas)
+        # a stale or broken file is rebuilt
+        if not force and store.get(key):
+            progress(1.0, 'skipped')
+            return Result(path, 'skipped', time.perf_counter() - start, stages)
+        name, mesh = load_drawer(path, shader, None, progress, quantization, pipeline,
+                                 atlas=atlas)
+        progress(0.9, 'write cache')
+        store.put(key, mesh.to_cache(name))
+        progress(1.0, 'done')
+        return Result(path, 'built', time.perf_counter() - start, stages)
+    except Exception as ex:  # pylint: disable=W0703
+        logger.debug('convert %s', path, exc_info=True)
+        return Result(path, 'failed', time.perf_counter() - start, stages,
+                      f'{type(ex).__name__}: {ex}')
+
+
+def convert_all(files: Sequence[pathlib.Path], cache_dir: pathlib.Path,
+                pipeline: Optional[Pipeline]=None, position: Optional[str]=None,
+                force=False, max_workers: Optional[int]=None,
+                on_result=None, max_texture_size: Optional[int]=None,
+                texture_filter='box', atlas_size: Optional[int]=None)->List[Result]:
+    '''
+    max_workers: None for os.cpu_count()
+    on_result: called with each Result as it finishes
+    '''
+    results: List[Result] = []
+    workers = min(max_workers or os.cpu_count() or 1, max(len(files), 1))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_file, x, cache_dir, pipeline, position, force,
+                                   max_texture_size, texture_filter, atlas_size)
+                   for x in files]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def format_summary(results: Sequence[Result], wall: float, slowest=10)->str:
+    lines = []
+    counts = {status: sum(1 for x in results if x.status == status)
+              for status in ('built', 'skipped', 'failed')}
+    busy = sum(x.seconds for x in results)
+    lines.append(f'{len(results)} files: {counts["built"]} built, '
+                 f'{counts["skipped"]} skipped, {counts["failed"]} failed')
+    lines.append(f'wall {wall:.2f}s, worker {busy:.2f}s')
+
+    stages: Dict[str, float] = {}
+    for result in results:
+        for stage, seconds in result.stages.items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    for stage, seconds in sorted(stages.items(), key=lambda x: -x[1]):
+        lines.append(f'  {stage:<12} {seconds:8.2f}s')
+
+    built = sorted((x for x in results if x.status == 'built'), key=lambda x: -x.seconds)
+    if built:
+        lines.append('slowest:')
+        for result in built[:slowest]:
+            lines.append(f'  {result.seconds:8.2f}s {result.path}')
+    failed = [x for x in results if x.status == 'failed']
+    if failed:
+        lines.append('failed:')
+        for result in failed:
+            lines.append(f'  {result.path}: {result.error}')
+    return '\n'.join(lines)
+
+
+def _ratios(value: str)->List[float]:
+    return [float(x) for x in value.split(',') if x]
+
+
+def main(argv: Optional[Sequence[str]]=None)->int:
+    parser = argparse.ArgumentParser(
+        prog='python convert.py',
+        description='convert model trees to .pyvbo cache files')
+    parser.add_argument('sources', nargs='+', type=pathlib.Path,
+                        help='model files or directories')
+    parser.add_argument('-o', '--output', type=pathlib.Path,
+                        help='cache directory. default: PYVBO_CACHE or ~/.cache/pyvbo')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes. default: cpu count')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild existing cache files')
+    parser.add_argument('--weld', type=float, metavar='EPSILON',
+                        help='merge duplicated vertices')
+    parser.add_argument('--optimize', action='store_true',
+                        help='vertex cache optimization')
+    parser.add_argument('--lods', type=_ratios, default=[], metavar='RATIOS',
+                        help='lod ratios. ex. 0.5,0.25')
+    parser.add_argument('--meshlets', action='store_true',
+                        help='partition into culled meshlets')
+    parser.add_argument('--quantize', choices=('none', 'half', 'int16'), default='none',
+                        help='position quantization. normals and uvs are packed too')
+    parser.add_argument('--max-texture-size', type=int,
+                        help='halve larger textures until they fit')
+    parser.add_argument('--texture-filter', choices=('box', 'lanczos'), default='box',
+                        help='mipmap and clamp filter')
+    parser.add_argument('--atlas', type=int, metavar='SIZE',
+                        help='pack textures up to SIZE into atlas pages')
+    parser.add_argument('--report', type=pathlib.Path,
+                        help='write the results as json')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    cache_dir = args.output if args.output else cache.default_cache_dir()
+    pipeline = Pipeline(args.weld, args.optimize, args.lods, args.meshlets)
+    position = None if args.quantize == 'none' else args.quantize
+
+    files = collect(args.sources)
+    print(f'{len(files)} files -> {cache_dir} {pipeline}')
+
+    def on_result(result: Result):
+        print(f'{result.status:<8} {result.seconds:8.2f}s {result.path}')
+
+    start = time.perf_counter()
+    results = convert_all(files, cache_dir, pipeline if pipeline.key else None,
+                          position, args.force, args.jobs, on_result,
+                          args.max_texture_size, args.texture_filter, args.atlas)
+    wall = time.perf_counter() - start
+    print(format_summary(results, wall))
+
+    if args.report:
+        args.report.write_text(json.dumps({
+            'wall': wall,
+            'pipeline': pipeline.key,
+            'quantize': args.quantize,
+            'results': [x.to_dict() for x in results],
+        }, indent=2))
+    return 1 if any(x.status == 'failed' for x in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
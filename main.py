@@ -11,8 +11,8 @@ from PyQt5.QtCore import Qt, QEventLoop
 
 import glglue.pysidegl
 from scene import Scene
-import pyvbo
-from renderer import Drawer
+import pyvbo.cache
+from renderer import AsyncLoader, LoadTask
 import shaders
 from widgets import SceneTreeWidget, InspectorWidget
 
@@ -55,6 +55,7 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.scene = scene
         self._open_dir = None
+        self.loader = AsyncLoader(shaders.MmdShader, pyvbo.cache.CacheStore())
         self.setWindowTitle('pyVboViewer')
         self.menubar = self.menuBar()
 
@@ -95,6 +96,7 @@ class MainWindow(QMainWindow):
         return dock
 
     def closeEvent(self, evnt):
+        self.loader.shutdown()
         if self.onClosed:
             self.onClosed()
         super().closeEvent(evnt)
@@ -116,7 +118,7 @@ class MainWindow(QMainWindow):
             self, 'Open file',
             str(self._open_dir) if self._open_dir else None,
             ';;'.join([
-                'Models(*.pmd *.obj)',
+                'Models(*.pmd *.pmx *.obj *.gltf *.glb)',
                 'Images (*.png *.xpm *.jpg)'
             ]))
         if not filename:
@@ -126,17 +128,16 @@ class MainWindow(QMainWindow):
         self._open_dir = path.parent
         logger.info('open %s', path)
 
-        model = pyvbo.load(path)
-        logger.info(model)
+        # parse and texture decode run in the loader pool.
+        # the window keeps rendering until the mesh arrives in poll
+        task = self.loader.load(path, self.on_loaded)
+        task.status.connect(
+            lambda status: self.statusBar().showMessage(
+                f'{path.name}: {status} {task.progress.value * 100:.0f}%'))
 
-        # fix scale
-        for i in range(len(model.vertices)):
-            model.vertices[i].pos[0] *= model.metadata.to_meter
-            model.vertices[i].pos[1] *= model.metadata.to_meter
-            model.vertices[i].pos[2] *= model.metadata.to_meter
-
-        mesh = Drawer.from_pmd(model, shaders.MmdShader)
-        self.scene.add_mesh(model.metadata.name, mesh)
+    def on_loaded(self, task: LoadTask):
+        logger.info('loaded %s', task.name)
+        self.scene.add_mesh(task.name, task.mesh)
 
 
 def loop(app, window, scene):
@@ -156,6 +157,7 @@ def loop(app, window, scene):
     while not closed:
         count += 1
         app.processEvents(QEventLoop.AllEvents)
+        window.loader.poll()
 
         now = time.clock()
         delta = now - last_render_time
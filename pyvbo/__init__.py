@@ -2,15 +2,23 @@ from logging import getLogger, Handler, DEBUG, WARNING, ERROR
 logger = getLogger(__name__)
 
 import pathlib
-from . import pmd
+from .registry import REGISTRY, Format, Registry
 
 
-def load(path: pathlib.Path):
-    return load_bytes(path.read_bytes(), path)
+def register(name: str, module: str, magic=(), extensions=())->Format:
+    '''
+    module is imported on first load of the format
+    '''
+    return REGISTRY.register(name, module, magic, extensions)
 
 
-def load_bytes(data: bytes, path: pathlib.Path):
-    if data[0:3] == b'Pmd':
-        return pmd.load_bytes(data, path)
-    else:
-        raise NotImplementedError()
+def load(path: pathlib.Path, use_mmap=False):
+    '''
+    use_mmap: map the file copy-on-write and share vertex, index and
+    material arrays with the mapping instead of copying them.
+    '''
+    return REGISTRY.load(path, use_mmap)
+
+
+def load_bytes(data, path: pathlib.Path):
+    return REGISTRY.load_bytes(data, path)
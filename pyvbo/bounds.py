@@ -0,0 +1,108 @@
+'''
+axis aligned bounding box and bounding sphere
+
+the sphere is centered on the box, so it is not the minimum sphere but
+every vertex is inside.
+'''
+from typing import List, Optional, Sequence, Tuple
+
+import numpy
+
+Vec3 = Tuple[float, float, float]
+
+
+class Bounds:
+    def __init__(self, min: Vec3, max: Vec3, radius: float)->None:  # pylint: disable=W0622
+        self.min = min
+        self.max = max
+        self.radius = radius
+
+    @property
+    def center(self)->Vec3:
+        return ((self.min[0] + self.max[0]) * 0.5,
+                (self.min[1] + self.max[1]) * 0.5,
+                (self.min[2] + self.max[2]) * 0.5)
+
+    def to_list(self)->List[float]:
+        return [*self.min, *self.max, self.radius]
+
+    @staticmethod
+    def from_list(values: Sequence[float])->'Bounds':
+        return Bounds(tuple(values[0:3]), tuple(values[3:6]), values[6])
+
+    def __repr__(self):
+        return f'{{Bounds {self.min} {self.max} r={self.radius:.3g}}}'
+
+
+def compute(positions, indices, index_counts: Sequence[int]
+            )->Tuple[Optional[Bounds], List[Optional[Bounds]]]:
+    '''
+    positions: (V, 3). bounds of the vertices referenced by each index range
+    and of all of them. None for an empty range.
+    '''
+    positions = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+    indices = numpy.asarray(indices)
+    counts = numpy.array(index_counts, numpy.int64)
+    end = int(counts.sum())
+    if end == 0:
+        return None, [None] * len(counts)
+    points = positions[indices[:end]]
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+    valid = counts > 0
+
+    lo = numpy.zeros((len(counts), 3), numpy.float32)
+    hi = numpy.zeros((len(counts), 3), numpy.float32)
+    lo[valid] = numpy.minimum.reduceat(points, starts[valid], axis=0)
+    hi[valid] = numpy.maximum.reduceat(points, starts[valid], axis=0)
+    center = (lo + hi) * 0.5
+    distance = numpy.linalg.norm(points - numpy.repeat(center, counts, axis=0), axis=1)
+    radius = numpy.zeros(len(counts), numpy.float32)
+    radius[valid] = numpy.maximum.reduceat(distance, starts[valid])
+
+    model_lo = lo[valid].min(axis=0)
+    model_hi = hi[valid].max(axis=0)
+    model_radius = numpy.linalg.norm(points - (model_lo + model_hi) * 0.5, axis=1).max()
+
+    def to_bounds(l, h, r)->Bounds:
+        return Bounds(tuple(float(x) for x in l), tuple(float(x) for x in h), float(r))
+
+    return to_bounds(model_lo, model_hi, model_radius),\
+        [to_bounds(l, h, r) if v else None
+         for l, h, r, v in zip(lo, hi, radius, valid)]
+
+
+def frustum_planes(mvp: numpy.ndarray)->numpy.ndarray:
+    '''
+    mvp: 4x4 for row vectors (v @ mvp).
+    (6, 4) normalized planes, facing inside (Gribb, Hartmann)
+    '''
+    c = mvp.T
+    planes = numpy.array([c[3] + c[0], c[3] - c[0],
+                          c[3] + c[1], c[3] - c[1],
+                          c[3] + c[2], c[3] - c[2]])
+    planes /= numpy.linalg.norm(planes[:, :3], axis=1)[:, None]
+    return planes
+
+
+def spheres_in_frustum(planes: numpy.ndarray, centers: numpy.ndarray,
+                       radii: numpy.ndarray)->numpy.ndarray:
+    '''
+    bool per sphere. false if outside a plane
+    '''
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    return (distances >= -radii[:, None]).all(axis=1)
+
+
+def merge(values: Sequence[Optional[Bounds]])->Optional[Bounds]:
+    '''
+    box of the boxes. the sphere contains the spheres
+    '''
+    values = [x for x in values if x]
+    if not values:
+        return None
+    lo = numpy.array([x.min for x in values]).min(axis=0)
+    hi = numpy.array([x.max for x in values]).max(axis=0)
+    center = (lo + hi) * 0.5
+    radius = max(float(numpy.linalg.norm(numpy.array(x.center) - center)) + x.radius
+                 for x in values)
+    return Bounds(tuple(float(x) for x in lo), tuple(float(x) for x in hi), radius)
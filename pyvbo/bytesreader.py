@@ -1,26 +1,257 @@
+import collections
+import re
 import struct
+from typing import Any, List, Optional, Tuple
+
+_FIELD_PATTERN = re.compile(r'^(\d*)([xcbB?hHiIlLqQefds])$')
+
+_DTYPE_MAP = {
+    'c': 'S1',
+    'b': 'i1',
+    'B': 'u1',
+    '?': '?',
+    'h': '<i2',
+    'H': '<u2',
+    'i': '<i4',
+    'I': '<u4',
+    'l': '<i4',
+    'L': '<u4',
+    'q': '<i8',
+    'Q': '<u8',
+    'e': '<f2',
+    'f': '<f4',
+    'd': '<f8',
+}
+
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+FLOAT = struct.Struct('<f')
+
+
+def decode_str(data: bytes, encoding: str)->str:
+    pos = data.find(0)
+    if pos == -1:
+        return data.decode(encoding)
+    else:
+        return data[0:pos].decode(encoding)
+
+
+def decode_strs(values, encoding: str)->List[str]:
+    '''
+    numpy S array to list of str
+    '''
+    return [decode_str(x, encoding) for x in values.tolist()]
+
+
+def gather(data, dtype, offsets, counts=None):
+    '''
+    records scattered at byte offsets into one numpy array. with counts,
+    offsets[i] is the start of counts[i] contiguous records.
+
+    contiguous records are sliced. only records at arbitrary offsets are
+    fancy indexed byte by byte.
+    '''
+    import numpy
+    dtype = numpy.dtype(dtype)
+    size = dtype.itemsize
+    buffer = numpy.frombuffer(data, numpy.uint8)
+    offsets = numpy.asarray(offsets, numpy.int64)
+    if counts is not None:
+        counts = numpy.asarray(counts, numpy.int64)
+        ends = offsets + counts * size
+        if len(offsets) and (offsets.min() < 0 or ends.max() > len(buffer)):
+            raise IndexError('records out of the buffer')
+        # a slice per run
+        values = numpy.concatenate(
+            [buffer[begin:end] for begin, end in zip(offsets.tolist(), ends.tolist())]
+            + [numpy.zeros(0, numpy.uint8)])
+    elif len(offsets) > 0 and (numpy.diff(offsets) == size).all():
+        begin = int(offsets[0])
+        end = begin + len(offsets) * size
+        if begin < 0 or end > len(buffer):
+            raise IndexError('records out of the buffer')
+        values = buffer[begin:end].copy()
+    else:
+        values = buffer[offsets[:, None] + numpy.arange(size)]
+    if dtype.subdtype:
+        base, shape = dtype.subdtype
+        return values.view(base).reshape((-1,) + shape)
+    return values.reshape(-1).view(dtype)
+
+
+class Schema:
+    '''
+    little endian record layout. declared once and compiled to struct.Struct
+    (single record) and numpy dtype (array of records).
+
+    Header = Schema('Header',
+                    ('magic', '3s'),
+                    ('version', 'f'),
+                    ('name', '20s', 'cp932'))
+
+    a field is (name, struct code[, encoding]). 3f becomes a tuple,
+    s with encoding becomes a NUL terminated str. x is padding.
+    '''
+
+    def __init__(self, name: str, *fields: Tuple[str, ...])->None:
+        self.name = name
+        self.fields: List[Tuple[str, str, int, Optional[str]]] = []
+        for field in fields:
+            field_name, code = field[0], field[1]
+            encoding = field[2] if len(field) > 2 else None
+            m = _FIELD_PATTERN.match(code)
+            if not m:
+                raise ValueError('unknown code: %s' % code)
+            count = int(m.group(1)) if m.group(1) else 1
+            self.fields.append((field_name, m.group(2), count, encoding))
+        self.struct = struct.Struct(
+            '<' + ''.join(f'{count}{t}' for _, t, count, _ in self.fields))
+        self.size = self.struct.size
+        self.Record = collections.namedtuple(
+            name, [x[0] for x in self.fields if x[1] != 'x'])
+        # no tuple grouping and no decoding. values map to fields as is
+        self._is_flat = all(
+            (t == 's' and not encoding) or (t not in 'sx' and count == 1)
+            for _, t, count, encoding in self.fields)
+        self._dtype = None
+
+    def __repr__(self)->str:
+        return f'<Schema {self.name} {self.size}bytes>'
+
+    def _make(self, values: Tuple[Any, ...]):
+        if self._is_flat:
+            return self.Record._make(values)
+        res = []
+        i = 0
+        for _, t, count, encoding in self.fields:
+            if t == 'x':
+                continue
+            if t == 's':
+                value = values[i]
+                i += 1
+                if encoding:
+                    value = decode_str(value, encoding)
+            elif count == 1:
+                value = values[i]
+                i += 1
+            else:
+                value = values[i:i + count]
+                i += count
+            res.append(value)
+        return self.Record._make(res)
+
+    def unpack_from(self, data, offset: int=0):
+        return self._make(self.struct.unpack_from(data, offset))
+
+    def iter_unpack(self, data, offset: int, count: int):
+        view = memoryview(data)[offset:offset + self.size * count]
+        return [self._make(x) for x in self.struct.iter_unpack(view)]
+
+    @property
+    def dtype(self):
+        '''
+        numpy dtype with the same packed layout. s fields are kept as bytes.
+        '''
+        if not self._dtype:
+            import numpy
+            names = []
+            formats = []
+            offsets = []
+            offset = 0
+            for field_name, t, count, _ in self.fields:
+                size = struct.calcsize(f'<{count}{t}')
+                if t != 'x':
+                    names.append(field_name)
+                    offsets.append(offset)
+                    if t == 's':
+                        formats.append(f'S{count}')
+                    elif count == 1:
+                        formats.append(_DTYPE_MAP[t])
+                    else:
+                        formats.append((_DTYPE_MAP[t], count))
+                offset += size
+            self._dtype = numpy.dtype({
+                'names': names,
+                'formats': formats,
+                'offsets': offsets,
+                'itemsize': self.size})
+        return self._dtype
 
 
 class BytesReader:
-    def __init__(self, data: bytes):
-        self.data = data
-        self.pos = 0
+    '''
+    cursor over any buffer (bytes, bytearray, mmap).
+    values are unpacked in place, get_bytes returns a memoryview into the
+    source buffer.
+    '''
+
+    def __init__(self, data, pos: int=0):
+        self.data = memoryview(data).cast('B')
+        self.pos = pos
+
+    @property
+    def writable(self)->bool:
+        return not self.data.readonly
+
+    @property
+    def remain(self)->int:
+        return len(self.data) - self.pos
+
+    def skip(self, size: int)->None:
+        self.pos += size
 
-    def get_bytes(self, size: int)->bytes:
+    def get_bytes(self, size: int)->memoryview:
         res = self.data[self.pos:self.pos + size]
         self.pos += size
         return res
 
+    def _unpack(self, s: struct.Struct):
+        value = s.unpack_from(self.data, self.pos)[0]
+        self.pos += s.size
+        return value
+
+    def get_uint8(self)->int:
+        return self._unpack(UINT8)
+
+    def get_uint16(self)->int:
+        return self._unpack(UINT16)
+
+    def get_int32(self)->int:
+        return self._unpack(INT32)
+
     def get_uint32(self)->int:
-        return struct.unpack('I', self.get_bytes(4))[0]
+        return self._unpack(UINT32)
 
     def get_float(self)->float:
-        return struct.unpack('f', self.get_bytes(4))[0]
+        return self._unpack(FLOAT)
 
     def get_str(self, size: int, encoding: str)->str:
-        data = self.get_bytes(size)
-        pos = data.index(0)
-        if pos == -1:
-            return data.decode(encoding)
-        else:
-            return data[0:pos].decode(encoding)
+        return decode_str(self.get_bytes(size).tobytes(), encoding)
+
+    def read(self, schema: Schema):
+        '''
+        one record
+        '''
+        value = schema.unpack_from(self.data, self.pos)
+        self.pos += schema.size
+        return value
+
+    def read_records(self, schema: Schema, count: int):
+        '''
+        list of records in one iter_unpack call
+        '''
+        values = schema.iter_unpack(self.data, self.pos, count)
+        self.pos += schema.size * count
+        return values
+
+    def read_array(self, schema: Schema, count: int):
+        '''
+        numpy record array that shares memory with the source buffer
+        '''
+        import numpy
+        values = numpy.frombuffer(
+            self.data, schema.dtype, count, self.pos)
+        self.pos += schema.size * count
+        return values
@@ -0,0 +1,312 @@
+'''
+drawer ready binary cache (.pyvbo)
+
++--------------------+
+| Header             | magic, version, table size
+| table (json)       | layout, submeshes, textures, blob offsets
+| vertices           | interleaved vertex buffer, as uploaded
+| indices            | index buffer
+| texture blobs      | decoded RGBA mip chains
++--------------------+
+
+blobs are aligned to BLOB_ALIGNMENT so that reading is an mmap and
+memoryview slices.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import hashlib
+import json
+import mmap
+import os
+import pathlib
+import struct
+from typing import Any, Iterable, List, NamedTuple, Optional, Tuple
+
+from .bytesreader import BytesReader, Schema
+
+# bump when the output of a loader or a conversion changes
+LOADER_VERSION = 3
+FORMAT_VERSION = 2
+BLOB_ALIGNMENT = 64
+EXTENSION = '.pyvbo'
+
+Header = Schema('Header',
+                ('magic', '8s'),
+                ('version', 'I'),
+                ('table_size', 'I'))
+
+MAGIC = b'PYVBO\0\0\0'
+
+
+class Attribute(NamedTuple):
+    semantics: str
+    value_type: str
+    value_elements: int
+    offset: Optional[int]
+    normalized: bool = False
+
+
+class CacheSubMesh(NamedTuple):
+    index_count: int
+    color: Tuple[float, float, float, float]
+    # index of CacheEntry.textures or -1
+    texture: int
+    # bounds.Bounds.to_list()
+    bounds: Optional[List[float]] = None
+
+
+class CacheTexture(NamedTuple):
+    name: str
+    width: int
+    height: int
+    # the levels of the mip chain, level 0 first
+    pixels: Any
+    levels: int = 1
+
+
+class CacheEntry:
+    '''
+    vertices, indices and texture pixels are buffers.
+    after read, they are memoryviews over the mapped file.
+    '''
+
+    def __init__(self, name: str, layout: List[Attribute], stride: int,
+                 vertices, indices, index_type: str,
+                 submeshes: List[CacheSubMesh],
+                 textures: List[CacheTexture],
+                 dequantize: Optional[Tuple[float, float, float, float]]=None,
+                 lods: Optional[List[Tuple[int, List[int]]]]=None,
+                 bounds: Optional[List[float]]=None,
+                 meshlets: Optional[List[List[float]]]=None,
+                 sources: Optional[List[Tuple[str, Optional[int]]]]=None)->None:
+        self.name = name
+        self.layout = layout
+        self.stride = stride
+        self.vertices = vertices
+        self.indices = indices
+        self.index_type = index_type
+        self.submeshes = submeshes
+        self.textures = textures
+        # quantized positions. (scale, x, y, z)
+        self.dequantize = dequantize
+        # (index offset, index count per submesh) of each simplified level
+        self.lods = lods if lods else []
+        # bounds.Bounds.to_list() of the model
+        self.bounds = bounds
+        # meshlet.Meshlet.to_list()
+        self.meshlets = meshlets if meshlets else []
+        # file_stamps of the files read besides the model, ex. textures
+        self.sources = sources if sources else []
+
+    def __repr__(self):
+        return f'{{CacheEntry {self.name}}}'
+
+
+def content_hash(path: pathlib.Path, chunk_size=16 * 1024 * 1024)->str:
+    h = hashlib.sha1()
+    with path.open('rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def file_stamps(paths: Iterable[Optional[pathlib.Path]])->List[Tuple[str, Optional[int]]]:
+    '''
+    (resolved path, mtime_ns) of each file once. None mtime if not exists
+    '''
+    stamps = {}
+    for path in paths:
+        if not path:
+            continue
+        path = path.resolve()
+        try:
+            stamps[str(path)] = path.stat().st_mtime_ns
+        except OSError:
+            stamps[str(path)] = None
+    return list(stamps.items())
+
+
+def layout_key(layout: Iterable[Attribute], stride: Optional[int])->str:
+    return ';'.join(f'{x.semantics}:{x.value_elements}{x.value_type}@{x.offset}'
+                    for x in layout) + f'/{stride}'
+
+
+def cache_key(source_hash: str, target_layout_key: str)->str:
+    return hashlib.sha1(
+        f'{source_hash}:{LOADER_VERSION}:{target_layout_key}'.encode('utf-8')).hexdigest()
+
+
+def _align(pos: int)->int:
+    return (pos + BLOB_ALIGNMENT - 1) // BLOB_ALIGNMENT * BLOB_ALIGNMENT
+
+
+def _as_bytes(data)->memoryview:
+    view = memoryview(data)
+    try:
+        return view.cast('B')
+    except TypeError:
+        # ex. ctypes structure array
+        return memoryview(view.tobytes())
+
+
+def write(path: pathlib.Path, entry: CacheEntry)->None:
+    blobs = [_as_bytes(entry.vertices), _as_bytes(entry.indices)]
+    blobs += [_as_bytes(x.pixels) for x in entry.textures]
+
+    def build_table(offsets: List[int])->bytes:
+        table = {
+            'name': entry.name,
+            'layout': [list(x) for x in entry.layout],
+            'stride': entry.stride,
+            'index_type': entry.index_type,
+            'submeshes': [list(x) for x in entry.submeshes],
+            'textures': [[x.name, x.width, x.height, x.levels] for x in entry.textures],
+            'dequantize': entry.dequantize,
+            'lods': [[offset, counts] for offset, counts in entry.lods],
+            'bounds': entry.bounds,
+            'meshlets': entry.meshlets,
+            'sources': entry.sources,
+            'blobs': [[offset, len(blob)] for offset, blob in zip(offsets, blobs)],
+        }
+        return json.dumps(table).encode('utf-8')
+
+    # the table size depends on the offsets. fix it with the upper bound
+    table_size = len(build_table([2 ** 63] * len(blobs)))
+    offsets = []
+    pos = _align(Header.size + table_size)
+    for blob in blobs:
+        offsets.append(pos)
+        pos = _align(pos + len(blob))
+    table = build_table(offsets).ljust(table_size)
+
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with tmp.open('wb') as f:
+        f.write(Header.struct.pack(MAGIC, FORMAT_VERSION, table_size))
+        f.write(table)
+        for offset, blob in zip(offsets, blobs):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(blob)
+    # readers never see a partial file
+    os.replace(str(tmp), str(path))
+
+
+def _chain_size(width: int, height: int, levels: int)->int:
+    '''
+    RGBA8 bytes of a mip chain. same levels as renderer.mipmap.level_sizes
+    '''
+    size = 0
+    for _ in range(levels):
+        size += width * height * 4
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return size
+
+
+def _validate(entry: CacheEntry)->None:
+    '''
+    the counts of the table fit the blobs. ValueError if not, ex. a truncated file
+    '''
+    if entry.stride and len(entry.vertices) % entry.stride:
+        raise ValueError(f'vertices: {len(entry.vertices)} bytes, stride {entry.stride}')
+    index_count = len(entry.indices)
+    if sum(x.index_count for x in entry.submeshes) > index_count:
+        raise ValueError(f'submeshes over {index_count} indices')
+    for offset, counts in entry.lods:
+        if offset < 0 or offset + sum(counts) > index_count:
+            raise ValueError(f'lod over {index_count} indices')
+    for values in entry.meshlets:
+        if values[0] < 0 or values[0] + values[1] > index_count:
+            raise ValueError(f'meshlet over {index_count} indices')
+    for x in entry.textures:
+        if x.levels < 1 or len(x.pixels) != _chain_size(x.width, x.height, x.levels):
+            raise ValueError(f'texture {x.name}: {len(x.pixels)} bytes')
+    for x in entry.submeshes:
+        if x.texture >= len(entry.textures):
+            raise ValueError(f'no texture {x.texture}')
+
+
+def read(path: pathlib.Path)->Optional[CacheEntry]:
+    '''
+    ValueError if the file is truncated or the table does not fit it
+    '''
+    with path.open('rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    r = BytesReader(data)
+    header = r.read(Header)
+    if header.magic != MAGIC or header.version != FORMAT_VERSION:
+        return None
+    table = json.loads(r.get_bytes(header.table_size).tobytes())
+    if not isinstance(table, dict):
+        raise ValueError('table is not an object')
+    # the cache key hashes the model file only
+    sources = [(name, mtime) for name, mtime in table.get('sources', [])]
+    if file_stamps(pathlib.Path(x) for x, _ in sources) != sources:
+        logger.info('%s: texture files changed', path)
+        return None
+    blobs = []
+    for offset, size in table['blobs']:
+        # a slice past the end is short, not an error
+        blob = r.data[offset:offset + size]
+        if offset < 0 or size < 0 or len(blob) != size:
+            raise ValueError(f'blob {offset}+{size} over {len(r.data)} bytes')
+        blobs.append(blob)
+    if len(blobs) != 2 + len(table['textures']):
+        raise ValueError(f'{len(blobs)} blobs')
+    entry = CacheEntry(
+        table['name'],
+        [Attribute(*x) for x in table['layout']],
+        table['stride'],
+        blobs[0],
+        blobs[1].cast(table['index_type']),
+        table['index_type'],
+        [CacheSubMesh(x[0], tuple(x[1]), x[2], x[3] if len(x) > 3 else None)
+         for x in table['submeshes']],
+        [CacheTexture(x[0], x[1], x[2], blob, x[3] if len(x) > 3 else 1)
+         for x, blob in zip(table['textures'], blobs[2:])],
+        tuple(table['dequantize']) if table.get('dequantize') else None,
+        [(offset, counts) for offset, counts in table.get('lods', [])],
+        table.get('bounds'),
+        table.get('meshlets', []),
+        sources)
+    _validate(entry)
+    return entry
+
+
+def default_cache_dir()->pathlib.Path:
+    if 'PYVBO_CACHE' in os.environ:
+        return pathlib.Path(os.environ['PYVBO_CACHE'])
+    return pathlib.Path.home() / '.cache' / 'pyvbo'
+
+
+class CacheStore:
+    '''
+    cache files in a directory, named by cache_key
+    '''
+
+    def __init__(self, directory: pathlib.Path=None)->None:
+        self.directory = directory if directory else default_cache_dir()
+
+    def path(self, key: str)->pathlib.Path:
+        return self.directory / (key + EXTENSION)
+
+    def get(self, key: str)->Optional[CacheEntry]:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            return read(path)
+        except (OSError, ValueError, KeyError, IndexError, TypeError, struct.error) as ex:
+            # truncated or malformed. a miss, rebuilt by the caller
+            logger.warning('broken cache %s: %s', path, ex)
+            return None
+
+    def put(self, key: str, entry: CacheEntry)->pathlib.Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        write(path, entry)
+        logger.debug('write cache %s', path)
+        return path
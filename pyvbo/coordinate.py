@@ -0,0 +1,94 @@
+'''
+unit and axis conversion over the whole vertex array
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import numpy
+
+from .metadata import MetaData, Direction, Coordinate
+from . import model
+from . import pmd
+
+DIRECTIONS = {
+    Direction.X_POSITIVE: (1, 0, 0),
+    Direction.X_NEGATIVE: (-1, 0, 0),
+    Direction.Y_POSITIVE: (0, 1, 0),
+    Direction.Y_NEGATIVE: (0, -1, 0),
+    Direction.Z_POSITIVE: (0, 0, 1),
+    Direction.Z_NEGATIVE: (0, 0, -1),
+}
+
+# columns are the x, y, z axis of the coordinate in YUP_ZBACKWARD
+BASES = {
+    Coordinate.YUP_ZBACKWARD: numpy.identity(3),
+    Coordinate.YUP_ZFORWARD: numpy.diag([1.0, 1.0, -1.0]),
+    Coordinate.ZUP_YFORWARD: numpy.array([[1.0, 0.0, 0.0],
+                                          [0.0, 0.0, 1.0],
+                                          [0.0, -1.0, 0.0]]),
+}
+
+
+def get_matrix(src: Coordinate, dst: Coordinate)->numpy.ndarray:
+    '''
+    3x3 matrix from src to dst. always a rotation or a mirror
+    '''
+    return BASES[dst].T @ BASES[src]
+
+
+def _to_direction(value: numpy.ndarray)->Direction:
+    key = tuple(int(round(x)) for x in value)
+    for k, v in DIRECTIONS.items():
+        if v == key:
+            return k
+    raise ValueError(f'not an axis: {value}')
+
+
+def flip_winding(indices):
+    '''
+    swap the 2nd and 3rd index of each triangle.
+    in place if writable, else returns a copy.
+    '''
+    array = numpy.asarray(indices)
+    if not array.flags.writeable:
+        array = array.copy()
+        indices = array
+    triangles = array[:len(array) // 3 * 3].reshape(-1, 3)
+    triangles[:, [1, 2]] = triangles[:, [2, 1]]
+    return indices
+
+
+def convert(m: model.Model, dst=Coordinate.YUP_ZBACKWARD, to_meter=True)->model.Model:
+    '''
+    apply scale and axis conversion to vertices in place and update metadata.
+    a mirror also flips the triangle winding.
+    '''
+    metadata: MetaData = m.metadata
+    matrix = get_matrix(metadata.coord, dst)
+    scale = metadata.to_meter if to_meter else 1.0
+    if scale == 1.0 and (matrix == numpy.identity(3)).all():
+        metadata.coord = dst
+        return m
+
+    vertices = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    if not vertices.flags.writeable:
+        vertices = vertices.copy()
+        m.vertices = (pmd.Vertex * len(vertices)).from_buffer(vertices)
+    # row vectors. v @ M.T == (M @ v.T).T
+    vertices['pos'] = vertices['pos'] @ (matrix.T * scale).astype(numpy.float32)
+    vertices['normal'] = vertices['normal'] @ matrix.T.astype(numpy.float32)
+    mirror = numpy.linalg.det(matrix) < 0
+    if mirror:
+        m.indices = flip_winding(m.indices)
+    m.transform(matrix, scale)
+    if m.bounds:
+        m.update_bounds()
+
+    metadata.coord = dst
+    metadata.up = _to_direction(matrix @ DIRECTIONS[metadata.up])
+    metadata.forward = _to_direction(matrix @ DIRECTIONS[metadata.forward])
+    metadata.right = _to_direction(matrix @ DIRECTIONS[metadata.right])
+    if to_meter:
+        metadata.to_meter = 1.0
+    logger.debug('%s: scale %f%s', metadata.name, scale, ', mirror' if mirror else '')
+    return m
@@ -0,0 +1,361 @@
+from logging import getLogger
+logger = getLogger(__name__)
+
+import base64
+import json
+import mmap
+import pathlib
+from typing import Any, Dict, List, Optional
+
+import numpy
+
+from .bytesreader import BytesReader, Schema
+from .metadata import MetaData, Direction, Coordinate
+from . import bounds
+from . import model
+from . import pmd
+
+
+GlbHeader = Schema('GlbHeader',
+                   ('magic', '4s'),
+                   ('version', 'I'),
+                   ('length', 'I'))
+
+GlbChunk = Schema('GlbChunk',
+                  ('length', 'I'),
+                  ('type', '4s'))
+
+COMPONENT_TYPES = {
+    5120: 'i1',
+    5121: 'u1',
+    5122: '<i2',
+    5123: '<u2',
+    5125: '<u4',
+    5126: '<f4',
+}
+
+ELEMENT_COUNTS = {
+    'SCALAR': 1,
+    'VEC2': 2,
+    'VEC3': 3,
+    'VEC4': 4,
+    'MAT2': 4,
+    'MAT3': 9,
+    'MAT4': 16,
+}
+
+TRIANGLES = 4
+
+
+class Accessor:
+    '''
+    accessor resolved to its bufferView.
+    array is a strided numpy view over the binary chunk (no copy).
+    buffer_view is -1 for an accessor without bufferView, all zeros.
+    '''
+
+    def __init__(self, buffer_view: int, byte_offset: int, byte_stride: int,
+                 dtype: numpy.dtype, elements: int, count: int,
+                 normalized: bool, array: numpy.ndarray)->None:
+        self.buffer_view = buffer_view
+        self.byte_offset = byte_offset
+        self.byte_stride = byte_stride
+        self.dtype = dtype
+        self.elements = elements
+        self.count = count
+        self.normalized = normalized
+        self.array = array
+
+
+class Material:
+    def __init__(self, name: str, color, texture: Optional[str],
+                 index_count: int)->None:
+        self.name = name
+        self.color = color
+        self.texture = texture
+        self.index_count = index_count
+
+    def __repr__(self):
+        return f'{{Material {self.name}: {self.index_count}}}'
+
+
+class Primitive:
+    def __init__(self, attributes: Dict[str, Accessor],
+                 indices: Optional[Accessor], material: Material)->None:
+        self.attributes = attributes
+        self.indices = indices
+        self.material = material
+
+    @property
+    def vertex_count(self)->int:
+        return self.attributes['POSITION'].count
+
+    @property
+    def vertex_key(self)->tuple:
+        '''
+        primitives with the same key read the same vertices
+        '''
+        return tuple(sorted((k, id(v)) for k, v in self.attributes.items()))
+
+
+class Document:
+    '''
+    glTF json with its buffers. buffers are memoryviews over the GLB binary
+    chunk, mmapped files or decoded data uris.
+    '''
+
+    def __init__(self, gltf: Dict[str, Any], buffers: List[memoryview])->None:
+        self.gltf = gltf
+        self.buffers = buffers
+        self._accessors: Dict[int, Accessor] = {}
+
+    def buffer_view(self, index: int)->memoryview:
+        view = self.gltf['bufferViews'][index]
+        offset = view.get('byteOffset', 0)
+        return self.buffers[view['buffer']][offset:offset + view['byteLength']]
+
+    def accessor(self, index: int)->Accessor:
+        if index in self._accessors:
+            return self._accessors[index]
+        accessor = self.gltf['accessors'][index]
+        if 'sparse' in accessor:
+            raise NotImplementedError('sparse accessor')
+        dtype = numpy.dtype(COMPONENT_TYPES[accessor['componentType']])
+        elements = ELEMENT_COUNTS[accessor['type']]
+        count = accessor['count']
+        if 'bufferView' not in accessor:
+            # initialized with zeros by the spec
+            shape = (count, elements) if elements > 1 else (count,)
+            value = Accessor(-1, 0, dtype.itemsize * elements, dtype, elements, count,
+                             accessor.get('normalized', False), numpy.zeros(shape, dtype))
+            self._accessors[index] = value
+            return value
+        view_index = accessor['bufferView']
+        view = self.gltf['bufferViews'][view_index]
+        byte_offset = accessor.get('byteOffset', 0)
+        byte_stride = view.get('byteStride', dtype.itemsize * elements)
+        data = self.buffer_view(view_index)
+        if count:
+            shape = (count, elements) if elements > 1 else (count,)
+            strides = (byte_stride, dtype.itemsize) if elements > 1 else (byte_stride,)
+            array = numpy.ndarray(shape, dtype, data, byte_offset, strides)
+        else:
+            array = numpy.zeros((0, elements), dtype)
+        value = Accessor(view_index, byte_offset, byte_stride, dtype, elements,
+                         count, accessor.get('normalized', False), array)
+        self._accessors[index] = value
+        return value
+
+
+def _to_float(accessor: Accessor)->numpy.ndarray:
+    '''
+    normalized integers to float. signed ones clamp at -1.0 by the spec
+    '''
+    if accessor.dtype.kind == 'f' or not accessor.normalized:
+        return accessor.array
+    return numpy.maximum(accessor.array / numpy.iinfo(accessor.dtype).max, -1.0)
+
+
+class Model(model.Model):
+    '''
+    primitives keep zero copy views. vertices and indices merge all
+    primitives into pmd.Vertex compatible records on first access.
+    '''
+
+    def __init__(self, metadata: MetaData, document: Document,
+                 primitives: List[Primitive])->None:
+        super().__init__(metadata, None, None,
+                         [x.material for x in primitives])
+        self.document = document
+        self.primitives = primitives
+
+    @property
+    def is_merged(self)->bool:
+        '''
+        vertices or indices were accessed. they may differ from the
+        primitives from now on.
+        '''
+        return self._vertices is not None
+
+    @property
+    def vertices(self):
+        if self._vertices is None:
+            self._merge()
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, value):
+        self._vertices = value
+
+    @property
+    def indices(self):
+        if self._indices is None:
+            self._merge()
+        return self._indices
+
+    @indices.setter
+    def indices(self, value):
+        self._indices = value
+
+    def _merge(self)->None:
+        # primitives that share their attribute accessors share vertices
+        bases: Dict[tuple, int] = {}
+        vertex_count = 0
+        for primitive in self.primitives:
+            key = primitive.vertex_key
+            if key not in bases:
+                bases[key] = vertex_count
+                vertex_count += primitive.vertex_count
+        vertex_array = numpy.zeros(vertex_count, pmd.VertexRecord.dtype)
+        indices = []
+        merged = set()
+        for primitive in self.primitives:
+            key = primitive.vertex_key
+            base = bases[key]
+            end = base + primitive.vertex_count
+            if primitive.indices:
+                indices.append(primitive.indices.array.astype(numpy.uint32) + base)
+            else:
+                indices.append(numpy.arange(base, end, dtype=numpy.uint32))
+            if key in merged:
+                continue
+            merged.add(key)
+            dst = vertex_array[base:end]
+            dst['pos'] = primitive.attributes['POSITION'].array
+            if 'NORMAL' in primitive.attributes:
+                dst['normal'] = primitive.attributes['NORMAL'].array
+            if 'TEXCOORD_0' in primitive.attributes:
+                dst['uv'] = _to_float(primitive.attributes['TEXCOORD_0'])
+        self._vertices = (pmd.Vertex * vertex_count).from_buffer(vertex_array)
+        self._indices = numpy.concatenate(indices) if indices\
+            else numpy.zeros(0, numpy.uint32)
+
+    def update_bounds(self)->None:
+        if self.is_merged:
+            super().update_bounds()
+            return
+        # from the accessors, without merging
+        self.material_bounds = []
+        for primitive in self.primitives:
+            positions = primitive.attributes['POSITION'].array
+            indices = primitive.indices.array if primitive.indices\
+                else numpy.arange(len(positions))
+            _, material_bounds = bounds.compute(positions, indices, [len(indices)])
+            self.material_bounds += material_bounds
+        self.bounds = bounds.merge(self.material_bounds)
+
+    def texture_path(self, material: Material)->Optional[pathlib.Path]:
+        if not material.texture:
+            return None
+        return self.metadata.base_path / material.texture
+
+    def __repr__(self):
+        return f'{{Gltf {self.metadata.name}}}'
+
+
+def _load_uri(uri: str, base_path: pathlib.Path, use_mmap: bool)->memoryview:
+    if uri.startswith('data:'):
+        _, payload = uri.split(',', 1)
+        return memoryview(base64.b64decode(payload))
+    path = base_path / uri
+    if use_mmap:
+        with path.open('rb') as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+    return memoryview(path.read_bytes())
+
+
+def _image_uri(gltf: Dict[str, Any], texture_index: int)->Optional[str]:
+    texture = gltf['textures'][texture_index]
+    if 'source' not in texture:
+        return None
+    image = gltf['images'][texture['source']]
+    uri = image.get('uri')
+    if not uri or uri.startswith('data:'):
+        # embedded image. not a file
+        return None
+    return uri
+
+
+def _load_material(gltf: Dict[str, Any], index: Optional[int])->Material:
+    if index is None:
+        return Material('', (1.0, 1.0, 1.0, 1.0), None, 0)
+    material = gltf['materials'][index]
+    pbr = material.get('pbrMetallicRoughness', {})
+    texture = None
+    if 'baseColorTexture' in pbr:
+        texture = _image_uri(gltf, pbr['baseColorTexture']['index'])
+    return Material(material.get('name', ''),
+                    tuple(pbr.get('baseColorFactor', (1.0, 1.0, 1.0, 1.0))),
+                    texture, 0)
+
+
+def load_document(data, path: pathlib.Path, use_mmap=False)->Document:
+    r = BytesReader(data)
+    if r.remain >= GlbHeader.size and r.data[0:4] == b'glTF':
+        header = r.read(GlbHeader)
+        if header.version != 2:
+            raise NotImplementedError('glb version %d' % header.version)
+        chunk = r.read(GlbChunk)
+        if chunk.type != b'JSON':
+            raise ValueError('first chunk is not JSON')
+        gltf = json.loads(r.get_bytes(chunk.length).tobytes())
+        binary = None
+        if r.pos < header.length:
+            chunk = r.read(GlbChunk)
+            if chunk.type == b'BIN\0':
+                binary = r.get_bytes(chunk.length)
+    else:
+        gltf = json.loads(r.data.tobytes())
+        binary = None
+
+    buffers = []
+    for buffer in gltf.get('buffers', []):
+        if 'uri' in buffer:
+            buffers.append(_load_uri(buffer['uri'], path.parent, use_mmap))
+        else:
+            buffers.append(binary)
+    return Document(gltf, buffers)
+
+
+def load_bytes(data, path: pathlib.Path, use_mmap=False):
+    '''
+    triangle primitives of every mesh, in mesh order. node transforms are
+    not applied.
+    '''
+    document = load_document(data, path, use_mmap)
+    gltf = document.gltf
+
+    primitives: List[Primitive] = []
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            if primitive.get('mode', TRIANGLES) != TRIANGLES:
+                logger.warning('skip primitive mode %d', primitive['mode'])
+                continue
+            attributes = {k: document.accessor(v)
+                          for k, v in primitive['attributes'].items()}
+            indices = document.accessor(primitive['indices'])\
+                if 'indices' in primitive else None
+            material = _load_material(gltf, primitive.get('material'))
+            material.index_count = indices.count if indices\
+                else attributes['POSITION'].count
+            primitives.append(Primitive(attributes, indices, material))
+    logger.debug('%d primitives', len(primitives))
+
+    asset = gltf.get('asset', {})
+    metadata = MetaData(
+        path, path.stem, asset.get('generator', ''),
+        Coordinate.YUP_ZBACKWARD,
+        Direction.Y_POSITIVE,
+        Direction.Z_POSITIVE,
+        Direction.X_NEGATIVE
+    )
+
+    return Model(metadata, document, primitives)
+
+
+def load(path: pathlib.Path, use_mmap=False):
+    if use_mmap and path.suffix.lower() == '.glb':
+        with path.open('rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return load_bytes(data, path, use_mmap)
+    return load_bytes(path.read_bytes(), path, use_mmap)
@@ -0,0 +1,234 @@
+'''
+meshlets. clusters of at most MAX_VERTICES vertices and MAX_TRIANGLES
+triangles inside each material range.
+
+triangles of a meshlet are contiguous in the index buffer, so a meshlet is
+an index range that can be drawn or skipped. each has a bounding sphere and
+a normal cone for culling.
+
+a meshlet grows from a seed triangle by adjacency, taking the triangle
+that adds the fewest new vertices first. optimize after build_meshlets
+reorders the triangles inside each meshlet for the vertex cache.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+from typing import List, Sequence, Tuple
+
+import numpy
+
+from . import bounds
+from . import model
+from . import pmd
+from .optimize import material_ranges
+
+MAX_VERTICES = 64
+MAX_TRIANGLES = 124
+
+
+class Meshlet:
+    '''
+    offset, count: index range
+    material: index of the material
+    center, radius: bounding sphere
+    axis, cutoff: normal cone. cutoff is the sine of the cone spread.
+                  1.0 if the normals spread over a half sphere or more.
+    '''
+
+    def __init__(self, offset: int, count: int, material: int,
+                 center, radius: float, axis, cutoff: float)->None:
+        self.offset = offset
+        self.count = count
+        self.material = material
+        self.center = center
+        self.radius = radius
+        self.axis = axis
+        self.cutoff = cutoff
+
+    def to_list(self)->List[float]:
+        return [self.offset, self.count, self.material,
+                *self.center, self.radius, *self.axis, self.cutoff]
+
+    @staticmethod
+    def from_list(values: Sequence[float])->'Meshlet':
+        return Meshlet(int(values[0]), int(values[1]), int(values[2]),
+                       tuple(values[3:6]), values[6], tuple(values[7:10]), values[10])
+
+    def __repr__(self):
+        return f'{{Meshlet {self.offset}+{self.count}}}'
+
+
+def partition(triangles: numpy.ndarray, max_vertices=MAX_VERTICES,
+              max_triangles=MAX_TRIANGLES)->Tuple[numpy.ndarray, List[int]]:
+    '''
+    triangles: (n, 3)
+    returns (triangle order, triangle count of each meshlet)
+    '''
+    n = len(triangles)
+    if n == 0:
+        return numpy.zeros(0, numpy.int64), []
+    flat = triangles.ravel()
+    vertex_ids, local = numpy.unique(flat, return_inverse=True)
+    local = local.reshape(-1)
+    valence = numpy.bincount(local, minlength=len(vertex_ids))
+    adjacency = (numpy.argsort(local, kind='stable') // 3).tolist()
+    starts = numpy.concatenate([[0], numpy.cumsum(valence)]).tolist()
+    tris = local.reshape(-1, 3).tolist()
+
+    assigned = bytearray(n)
+    order: List[int] = []
+    sizes: List[int] = []
+    cursor = 0
+    while len(order) < n:
+        while assigned[cursor]:
+            cursor += 1
+        vertices: set = set()
+        count = 0
+        # candidates by the new vertex count when pushed. may be stale,
+        # but only too high
+        buckets: List[List[int]] = [[cursor], [], [], []]
+        while count < max_triangles:
+            t = -1
+            for bucket in buckets:
+                while bucket:
+                    candidate = bucket.pop()
+                    if not assigned[candidate]:
+                        t = candidate
+                        break
+                if t >= 0:
+                    break
+            if t < 0:
+                break
+            new = [v for v in tris[t] if v not in vertices]
+            if len(vertices) + len(new) > max_vertices:
+                # may fit later in another meshlet
+                continue
+            assigned[t] = 1
+            order.append(t)
+            count += 1
+            vertices.update(new)
+            for v in new:
+                for u in adjacency[starts[v]:starts[v + 1]]:
+                    if not assigned[u]:
+                        buckets[sum(1 for x in tris[u] if x not in vertices)].append(u)
+        sizes.append(count)
+    return numpy.array(order, numpy.int64), sizes
+
+
+def _cones(positions: numpy.ndarray, triangles: numpy.ndarray, sizes: List[int]):
+    '''
+    (center, radius, axis, cutoff) arrays of each meshlet
+    '''
+    starts = numpy.concatenate([[0], numpy.cumsum(sizes)[:-1]]).astype(numpy.int64)
+    points = positions[triangles]
+    cross = numpy.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    length = numpy.linalg.norm(cross, axis=1)
+    normals = cross / numpy.maximum(length, 1e-30)[:, None]
+
+    flat_points = points.reshape(-1, 3)
+    corner_starts = starts * 3
+    lo = numpy.minimum.reduceat(flat_points, corner_starts, axis=0)
+    hi = numpy.maximum.reduceat(flat_points, corner_starts, axis=0)
+    center = (lo + hi) * 0.5
+    corner_counts = numpy.array(sizes, numpy.int64) * 3
+    distance = numpy.linalg.norm(
+        flat_points - numpy.repeat(center, corner_counts, axis=0), axis=1)
+    radius = numpy.maximum.reduceat(distance, corner_starts)
+
+    # area weighted average normal
+    axis = numpy.add.reduceat(cross, starts, axis=0)
+    axis_length = numpy.linalg.norm(axis, axis=1)
+    axis = axis / numpy.maximum(axis_length, 1e-30)[:, None]
+    dots = (normals * numpy.repeat(axis, sizes, axis=0)).sum(axis=1)
+    # degenerate triangles do not widen the cone
+    dots[length <= 0] = 1.0
+    min_dot = numpy.minimum.reduceat(dots, starts)
+    cutoff = numpy.where((min_dot <= 0) | (axis_length <= 0), 1.0,
+                         numpy.sqrt(numpy.maximum(1.0 - min_dot * min_dot, 0.0)))
+    return center, radius, axis, cutoff
+
+
+def build_meshlets(m: model.Model, max_vertices=MAX_VERTICES,
+                   max_triangles=MAX_TRIANGLES)->List[Meshlet]:
+    '''
+    reorder the triangles of each material range in place and set m.meshlets
+    '''
+    indices = numpy.asarray(m.indices)
+    positions = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)['pos'].astype(numpy.float64)
+    ranges = material_ranges(m.materials, len(indices))
+    reordered = indices.copy()
+    meshlets: List[Meshlet] = []
+    for material, (begin, end) in enumerate(ranges):
+        if material >= len(m.materials):
+            # indices after the materials are not drawn
+            break
+        triangles = indices[begin:end].reshape(-1, 3).astype(numpy.int64)
+        order, sizes = partition(triangles, max_vertices, max_triangles)
+        if not sizes:
+            continue
+        triangles = triangles[order]
+        reordered[begin:end] = triangles.reshape(-1)
+        center, radius, axis, cutoff = _cones(positions, triangles, sizes)
+        offset = begin
+        for i, size in enumerate(sizes):
+            meshlets.append(Meshlet(
+                offset, size * 3, material,
+                tuple(float(x) for x in center[i]), float(radius[i]),
+                tuple(float(x) for x in axis[i]), float(cutoff[i])))
+            offset += size * 3
+    m.indices = reordered
+    m.meshlets = meshlets
+    logger.info('%s: %d meshlets', m.metadata.name, len(meshlets))
+    return meshlets
+
+
+class MeshletCuller:
+    '''
+    meshlet arrays for culling all of them at once
+    '''
+
+    def __init__(self, meshlets: Sequence[Meshlet])->None:
+        self.meshlets = list(meshlets)
+        self.offsets = numpy.array([x.offset for x in meshlets], numpy.int64)
+        self.counts = numpy.array([x.count for x in meshlets], numpy.int64)
+        self.materials = numpy.array([x.material for x in meshlets], numpy.int64)
+        self.centers = numpy.array([x.center for x in meshlets], numpy.float64).reshape(-1, 3)
+        self.radii = numpy.array([x.radius for x in meshlets], numpy.float64)
+        self.axes = numpy.array([x.axis for x in meshlets], numpy.float64).reshape(-1, 3)
+        self.cutoffs = numpy.array([x.cutoff for x in meshlets], numpy.float64)
+
+    def visible(self, mvp: numpy.ndarray, camera: numpy.ndarray,
+                backfacing_cones=False)->numpy.ndarray:
+        '''
+        mvp: 4x4 model view projection for row vectors (v @ mvp).
+        camera: camera position in model space.
+        returns a bool per meshlet. false if outside the frustum, or with
+        backfacing_cones, if all triangles face away from the camera.
+        the cone test is only right when back faces are culled. double
+        sided materials are visible from behind
+        '''
+        inside = bounds.spheres_in_frustum(
+            bounds.frustum_planes(mvp), self.centers, self.radii)
+        if not backfacing_cones:
+            return inside
+
+        # normal cone. meshoptimizer meshopt_computeMeshletBounds
+        to_center = self.centers - camera
+        d = numpy.linalg.norm(to_center, axis=1)
+        backfacing = (to_center * self.axes).sum(axis=1) >= self.cutoffs * d + self.radii
+        return inside & ~backfacing
+
+    def ranges(self, visible: numpy.ndarray)->List[Tuple[int, int, int]]:
+        '''
+        (material, offset, count) of the visible meshlets.
+        neighbors in the index buffer are merged into one range.
+        '''
+        result: List[Tuple[int, int, int]] = []
+        for material, offset, count in zip(self.materials[visible].tolist(),
+                                           self.offsets[visible].tolist(),
+                                           self.counts[visible].tolist()):
+            if result and result[-1][0] == material and result[-1][1] + result[-1][2] == offset:
+                result[-1] = (material, result[-1][1], result[-1][2] + count)
+            else:
+                result.append((material, offset, count))
+        return result
@@ -0,0 +1,66 @@
+import pathlib
+from typing import Optional
+
+from .metadata import MetaData
+
+
+class Model:
+    '''
+    array-backed model shared by the loaders.
+
+    vertices: pmd.Vertex compatible records (pos, normal, uv, bone0, bone1,
+              weight0, flag). ctypes.Array
+    indices: array.array, memoryview or numpy array
+    materials: sequence of records with color and index_count
+    lods: simplify.Lod list. extra indices over the same vertices
+    bounds, material_bounds: bounds.Bounds of the model and of each material.
+                             set by update_bounds
+    '''
+
+    def __init__(self, metadata: MetaData, vertices, indices, materials)->None:
+        self.metadata = metadata
+        self.vertices = vertices
+        self.indices = indices
+        self.materials = materials
+        self.lods: list = []
+        self.bounds = None
+        self.material_bounds: list = []
+        # meshlet.Meshlet list. ranges of indices
+        self.meshlets: list = []
+
+    def texture_path(self, material)->Optional[pathlib.Path]:
+        return None
+
+    def transform(self, matrix, scale: float)->None:
+        '''
+        called by coordinate.convert after vertices.
+        loaders with other model space arrays override this.
+        '''
+
+    def update_bounds(self)->None:
+        import numpy
+        from . import bounds
+        from . import pmd
+        records = numpy.frombuffer(self.vertices, pmd.VertexRecord.dtype)
+        self.bounds, self.material_bounds = bounds.compute(
+            records['pos'], self.indices, [x.index_count for x in self.materials])
+
+    def vertex_key_arrays(self)->list:
+        '''
+        per vertex arrays besides vertices that must match to weld vertices
+        '''
+        return []
+
+    def select_vertices(self, selection)->None:
+        '''
+        vertices = vertices[selection]. ex. a reorder or the unique vertices.
+        indices are left to the caller.
+        loaders with other per vertex arrays extend this.
+        '''
+        import numpy
+        from . import pmd
+        records = numpy.frombuffer(self.vertices, pmd.VertexRecord.dtype)[selection]
+        self.vertices = (pmd.Vertex * len(records)).from_buffer(records)
+
+    def __repr__(self):
+        return f'{{{self.__class__.__module__.split(".")[-1].capitalize()} {self.metadata.name}}}'
@@ -0,0 +1,366 @@
+from logging import getLogger
+logger = getLogger(__name__)
+
+import io
+import pathlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy
+
+from .metadata import MetaData, Direction, Coordinate
+from . import model
+from . import pmd
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+HASH = ord('#')
+SPACE = ord(' ')
+TAB = ord('\t')
+CR = ord('\r')
+LF = ord('\n')
+
+
+class Material:
+    def __init__(self, name: str)->None:
+        self.name = name
+        self.color = (1.0, 1.0, 1.0, 1.0)
+        self.texture: Optional[str] = None
+        self.index_count = 0
+
+    def __repr__(self):
+        return f'{{Material {self.name}: {self.index_count}}}'
+
+
+class Model(model.Model):
+    def texture_path(self, material: Material)->Optional[pathlib.Path]:
+        if not material.texture:
+            return None
+        return self.metadata.base_path / material.texture
+
+    def __repr__(self):
+        return f'{{Obj {self.metadata.name}}}'
+
+
+def _parse_rows(data: bytes, row_count: int, dtype)->numpy.ndarray:
+    '''
+    all numbers of row_count lines in one call.
+    rows are trimmed to the shortest row (ex. v x y z [w | r g b])
+    '''
+    values = numpy.fromstring(data, dtype=dtype, sep=' ')
+    if row_count == 0:
+        return values.reshape(0, 0)
+    if len(values) % row_count == 0:
+        return values.reshape(row_count, -1)
+    # mixed column count. slow path
+    rows = [numpy.fromstring(x, dtype=dtype, sep=' ')
+            for x in data.splitlines()]
+    cols = min(len(x) for x in rows)
+    return numpy.array([x[:cols] for x in rows], dtype=dtype)
+
+
+class _Parser:
+    '''
+    tokenize v/vt/vn/f/usemtl lines chunk by chunk with numpy.
+    '''
+
+    def __init__(self)->None:
+        self.positions: List[numpy.ndarray] = []
+        self.uvs: List[numpy.ndarray] = []
+        self.normals: List[numpy.ndarray] = []
+        # corner (v, vt, vn). 0 origin. -1 if missing
+        self.corners: List[numpy.ndarray] = []
+        # corner count per face
+        self.face_sizes: List[numpy.ndarray] = []
+        self.face_materials: List[numpy.ndarray] = []
+        self.v_count = 0
+        self.vt_count = 0
+        self.vn_count = 0
+        self.material_names: List[str] = []
+        self.material_map: Dict[str, int] = {}
+        self.current_material = -1
+        self.mtllibs: List[str] = []
+
+    def _material_id(self, name: str)->int:
+        if name not in self.material_map:
+            self.material_map[name] = len(self.material_names)
+            self.material_names.append(name)
+        return self.material_map[name]
+
+    def push_chunk(self, chunk: bytes)->None:
+        buf = numpy.frombuffer(chunk, numpy.uint8).copy()
+        lf = numpy.flatnonzero(buf == LF)
+        starts = numpy.empty(len(lf), numpy.int64)
+        starts[0] = 0
+        starts[1:] = lf[:-1] + 1
+        line_sizes = lf - starts + 1
+
+        is_hash = buf == HASH
+        if is_hash.any():
+            # blank from # to the end of the line
+            hashes = numpy.cumsum(is_hash)
+            before_line = (hashes - is_hash)[starts]
+            in_comment = hashes > numpy.repeat(before_line, line_sizes)
+            buf[in_comment & (buf != LF)] = SPACE
+
+        # the keyword is the first non blank byte. LF if the line is blank
+        non_blank = numpy.flatnonzero((buf != SPACE) & (buf != TAB))
+        keywords = non_blank[numpy.searchsorted(non_blank, starts)]
+
+        first = buf[keywords]
+        second = buf[numpy.minimum(keywords + 1, len(buf) - 1)]
+        second_is_space = (second == SPACE) | (second == TAB)
+        is_v = (first == ord('v')) & second_is_space
+        is_vt = (first == ord('v')) & (second == ord('t'))
+        is_vn = (first == ord('v')) & (second == ord('n'))
+        is_f = (first == ord('f')) & second_is_space
+
+        # statements with a string argument are few
+        usemtl_lines: List[int] = []
+        usemtl_ids: List[int] = []
+        for i in numpy.flatnonzero((first == ord('u')) | (first == ord('m'))):
+            line = buf[keywords[i]:lf[i]].tobytes()
+            if line.startswith(b'usemtl'):
+                usemtl_lines.append(i)
+                usemtl_ids.append(self._material_id(
+                    line[6:].decode('utf-8', 'replace').strip()))
+            elif line.startswith(b'mtllib'):
+                self.mtllibs.append(
+                    line[6:].decode('utf-8', 'replace').strip())
+
+        # blank the keywords
+        buf[keywords[is_v | is_vt | is_vn | is_f]] = SPACE
+        buf[keywords[is_vt | is_vn] + 1] = SPACE
+
+        def select(mask)->bytes:
+            return buf[numpy.repeat(mask, line_sizes)].tobytes()
+
+        v = _parse_rows(select(is_v), int(is_v.sum()), numpy.float32)
+        self.positions.append(v[:, :3])
+        vt = _parse_rows(select(is_vt), int(is_vt.sum()), numpy.float32)
+        self.uvs.append(vt[:, :2])
+        vn = _parse_rows(select(is_vn), int(is_vn.sum()), numpy.float32)
+        self.normals.append(vn[:, :3])
+
+        # faces
+        if is_f.any():
+            self._push_faces(buf, starts, line_sizes, is_f,
+                             is_v, is_vt, is_vn, usemtl_lines, usemtl_ids)
+        if usemtl_ids:
+            self.current_material = usemtl_ids[-1]
+
+        self.v_count += len(v)
+        self.vt_count += len(vt)
+        self.vn_count += len(vn)
+
+    def _push_faces(self, buf, starts, line_sizes, is_f,
+                    is_v, is_vt, is_vn, usemtl_lines, usemtl_ids)->None:
+        face_lines = numpy.flatnonzero(is_f)
+
+        # corners per face from token starts
+        is_space = (buf == SPACE) | (buf == TAB) | (buf == CR) | (buf == LF)
+        token_start = ~is_space
+        token_start[1:] &= is_space[:-1]
+        tokens = numpy.add.reduceat(token_start.astype(numpy.int32), starts)
+        face_sizes = tokens[face_lines].astype(numpy.int64)
+
+        # v, v/vt, v//vn, v/vt/vn. 0 is missing
+        text = buf[numpy.repeat(is_f, line_sizes)].tobytes()
+        first_corner = text.split(None, 1)[0]
+        components = 1 + first_corner.count(b'/')
+        values = numpy.fromstring(
+            text.replace(b'//', b'/0/').replace(b'/', b' '),
+            dtype=numpy.int64, sep=' ')
+        if len(values) == face_sizes.sum() * components:
+            values = values.reshape(-1, components)
+            values = numpy.pad(values, ((0, 0), (0, 3 - components)))
+        else:
+            # mixed corner format. slow path
+            values = numpy.array([
+                [int(x) if x else 0 for x in (corner.split(b'/') + [b'', b''])[:3]]
+                for corner in text.split()], numpy.int64)
+
+        # resolve 1 origin and negative index
+        def resolve(column, is_kind, base):
+            before = base + numpy.cumsum(is_kind)[face_lines]
+            before = numpy.repeat(before, face_sizes)
+            return numpy.where(column < 0, before + column, column - 1)
+
+        corners = numpy.stack([
+            resolve(values[:, 0], is_v, self.v_count),
+            resolve(values[:, 1], is_vt, self.vt_count),
+            resolve(values[:, 2], is_vn, self.vn_count),
+        ], axis=1)
+
+        # material per face
+        if self.current_material < 0 and (not usemtl_lines or usemtl_lines[0] > face_lines[0]):
+            self.current_material = self._material_id('')
+        previous = numpy.array([self.current_material] + usemtl_ids, numpy.int64)
+        face_materials = previous[numpy.searchsorted(
+            numpy.array(usemtl_lines, numpy.int64), face_lines, side='right')]
+
+        self.corners.append(corners)
+        self.face_sizes.append(face_sizes)
+        self.face_materials.append(face_materials)
+
+
+def _concat(values: List[numpy.ndarray], shape: Tuple[int, ...], dtype)->numpy.ndarray:
+    values = [x for x in values if len(x)]
+    if not values:
+        return numpy.zeros(shape, dtype)
+    return numpy.concatenate(values)
+
+
+def _triangulate(face_sizes: numpy.ndarray)->numpy.ndarray:
+    '''
+    fan triangulation. corner indices of (0, i, i + 1)
+    '''
+    face_start = numpy.cumsum(face_sizes) - face_sizes
+    triangle_counts = face_sizes - 2
+    first = numpy.repeat(face_start, triangle_counts)
+    local = numpy.arange(triangle_counts.sum()) - numpy.repeat(
+        numpy.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+    return numpy.stack([first, first + local + 1, first + local + 2], axis=1)
+
+
+def _unique_corners(corners: numpy.ndarray, sizes: Tuple[int, int, int]):
+    '''
+    deduplicate (v, vt, vn). packed into int64 keys when they fit.
+    '''
+    nv, nt, nn = (x + 1 for x in sizes)
+    if nv * nt * nn < 2 ** 63:
+        keys = ((corners[:, 0] + 1) * nt + corners[:, 1] + 1) * nn + corners[:, 2] + 1
+        _, first, inverse = numpy.unique(
+            keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = numpy.unique(
+            corners, axis=0, return_index=True, return_inverse=True)
+    return corners[first], inverse.reshape(-1)
+
+
+def _calc_normals(positions: numpy.ndarray, triangles: numpy.ndarray)->numpy.ndarray:
+    p0 = positions[triangles[:, 0]]
+    p1 = positions[triangles[:, 1]]
+    p2 = positions[triangles[:, 2]]
+    face_normals = numpy.cross(p1 - p0, p2 - p0)
+    normals = numpy.zeros_like(positions)
+    for i in range(3):
+        numpy.add.at(normals, triangles[:, i], face_normals)
+    length = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    length[length == 0] = 1
+    return normals / length
+
+
+def load_mtl(path: pathlib.Path, materials: List[Material])->None:
+    material_map = {x.name: x for x in materials}
+    current = None
+    for line in path.read_text(errors='replace').splitlines():
+        values = line.split()
+        if not values:
+            continue
+        if values[0] == 'newmtl':
+            current = material_map.get(line.strip()[6:].strip())
+        elif not current:
+            continue
+        elif values[0] == 'Kd':
+            current.color = (float(values[1]), float(values[2]),
+                             float(values[3]), current.color[3])
+        elif values[0] == 'd':
+            current.color = current.color[0:3] + (float(values[1]),)
+        elif values[0] == 'map_Kd':
+            current.texture = values[-1].replace('\\', '/')
+
+
+def load_stream(f: BinaryIO, path: pathlib.Path, chunk_size=CHUNK_SIZE):
+    parser = _Parser()
+    rest = b''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        data = rest + data
+        pos = data.rfind(b'\n')
+        if pos < 0:
+            rest = data
+            continue
+        rest = data[pos + 1:]
+        parser.push_chunk(data[:pos + 1])
+    if rest.strip():
+        parser.push_chunk(rest + b'\n')
+
+    positions = _concat(parser.positions, (0, 3), numpy.float32)
+    uvs = _concat(parser.uvs, (0, 2), numpy.float32)
+    normals = _concat(parser.normals, (0, 3), numpy.float32)
+    corners = _concat(parser.corners, (0, 3), numpy.int64)
+    face_sizes = _concat(parser.face_sizes, (0,), numpy.int64)
+    face_materials = _concat(parser.face_materials, (0,), numpy.int64)
+    logger.debug('%d v, %d vt, %d vn, %d f',
+                 len(positions), len(uvs), len(normals), len(face_sizes))
+    if len(corners) and (corners[:, 0].min() < 0 or corners[:, 0].max() >= len(positions)):
+        raise ValueError('vertex index out of range')
+    # dangling vt/vn are treated as missing
+    corners[corners[:, 1] >= len(uvs), 1] = -1
+    corners[corners[:, 2] >= len(normals), 2] = -1
+
+    # triangles grouped by material. stable to keep the authoring order
+    triangles = _triangulate(face_sizes)
+    triangle_materials = numpy.repeat(face_materials, face_sizes - 2)
+    order = numpy.argsort(triangle_materials, kind='stable')
+    triangles = triangles[order]
+    triangle_materials = triangle_materials[order]
+
+    unique, inverse = _unique_corners(
+        corners, (len(positions), len(uvs), len(normals)))
+    triangle_indices = inverse[triangles]
+
+    vertex_array = numpy.zeros(len(unique), pmd.VertexRecord.dtype)
+    vertex_array['pos'] = positions[unique[:, 0]]
+    if len(uvs):
+        has_uv = unique[:, 1] >= 0
+        vertex_array['uv'][has_uv] = uvs[unique[has_uv, 1]]
+        # bottom left origin
+        vertex_array['uv'][has_uv, 1] = 1.0 - vertex_array['uv'][has_uv, 1]
+    if len(normals) and (unique[:, 2] >= 0).all():
+        vertex_array['normal'] = normals[unique[:, 2]]
+    else:
+        vertex_array['normal'] = _calc_normals(
+            vertex_array['pos'], triangle_indices)
+    vertices = (pmd.Vertex * len(vertex_array)).from_buffer(vertex_array)
+
+    index_dtype = numpy.uint16 if len(vertex_array) < 65536 else numpy.uint32
+    indices = triangle_indices.reshape(-1).astype(index_dtype)
+    logger.debug('%d vertices, %d indices', len(vertex_array), len(indices))
+
+    # submeshes
+    materials = [Material(x) for x in parser.material_names]
+    counts = numpy.bincount(triangle_materials, minlength=len(materials))
+    for material, count in zip(materials, counts):
+        material.index_count = int(count) * 3
+    for mtllib in parser.mtllibs:
+        mtl_path = path.parent / mtllib
+        if mtl_path.exists():
+            load_mtl(mtl_path, materials)
+        else:
+            logger.warning('%s not exists', mtl_path)
+    materials = [x for x in materials if x.index_count]
+
+    metadata = MetaData(
+        path, path.stem, '',
+        Coordinate.YUP_ZBACKWARD,
+        Direction.Y_POSITIVE,
+        Direction.Z_POSITIVE,
+        Direction.X_NEGATIVE
+    )
+
+    return Model(metadata, vertices, indices, materials)
+
+
+def load_bytes(data, path: pathlib.Path):
+    return load_stream(io.BytesIO(data), path, min(CHUNK_SIZE, len(data) + 1))
+
+
+def load(path: pathlib.Path, use_mmap=False, chunk_size=CHUNK_SIZE):
+    # text. streamed in chunks instead of mapped.
+    # read allocates the chunk size, small files read their size
+    chunk_size = min(chunk_size, path.stat().st_size + 1)
+    with path.open('rb') as f:
+        return load_stream(f, path, chunk_size)
@@ -0,0 +1,211 @@
+'''
+index and vertex order for the post transform vertex cache
+
+* triangles are reordered inside each material range (Forsyth,
+  "Linear-Speed Vertex Cache Optimisation"), so Material.index_count
+  and the draw offsets do not change. with m.meshlets, inside each
+  meshlet, so the meshlets stay index ranges.
+* vertices are reordered by first use and the indices remapped, m.lods
+  too. the lods keep their triangle order.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+from typing import List, Sequence, Tuple
+
+import numpy
+
+from . import model
+
+# forsyth scoring
+CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+# FIFO used to measure ACMR/ATVR
+FIFO_SIZE = 32
+
+
+class CacheReport:
+    '''
+    acmr: average cache miss ratio. misses / triangles. 0.5 - 3.0
+    atvr: average transform to vertex ratio. misses / vertices. 1.0 is best
+    '''
+
+    def __init__(self, acmr_before: float, atvr_before: float,
+                 acmr_after: float, atvr_after: float)->None:
+        self.acmr_before = acmr_before
+        self.atvr_before = atvr_before
+        self.acmr_after = acmr_after
+        self.atvr_after = atvr_after
+
+    def __repr__(self):
+        return (f'{{ACMR {self.acmr_before:.3f} -> {self.acmr_after:.3f}, '
+                f'ATVR {self.atvr_before:.3f} -> {self.atvr_after:.3f}}}')
+
+
+def measure(indices, vertex_count: int, cache_size=FIFO_SIZE)->Tuple[float, float]:
+    '''
+    (ACMR, ATVR) with a FIFO cache
+    '''
+    cache: collections.deque = collections.deque()
+    cached = set()
+    misses = 0
+    for i in numpy.asarray(indices).tolist():
+        if i in cached:
+            continue
+        misses += 1
+        cache.append(i)
+        cached.add(i)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    triangles = len(indices) // 3
+    used = len(numpy.unique(numpy.asarray(indices)))
+    return (misses / triangles if triangles else 0.0,
+            misses / used if used else 0.0)
+
+
+def material_ranges(materials, index_count: int)->List[Tuple[int, int]]:
+    '''
+    (begin, end) of each material. the rest, if any, is the last range
+    '''
+    ranges = []
+    begin = 0
+    for x in materials:
+        end = min(begin + x.index_count, index_count)
+        ranges.append((begin, end))
+        begin = end
+    if begin < index_count:
+        ranges.append((begin, index_count))
+    return ranges
+
+
+def forsyth(triangles: numpy.ndarray)->numpy.ndarray:
+    '''
+    triangles: (n, 3) vertex ids
+    returns the triangle order
+    '''
+    n = len(triangles)
+    if n == 0:
+        return numpy.zeros(0, numpy.int64)
+    unique, local = numpy.unique(triangles, return_inverse=True)
+    local = local.reshape(-1, 3)
+    vertex_count = len(unique)
+
+    # triangles of each vertex
+    flat = local.ravel()
+    valence = numpy.bincount(flat, minlength=vertex_count)
+    adjacency = (numpy.argsort(flat, kind='stable') // 3).tolist()
+    starts = numpy.concatenate([[0], numpy.cumsum(valence)]).tolist()
+
+    # score tables. cache_score[position + 1]
+    cache_score = [0.0] + [LAST_TRIANGLE_SCORE] * 3 + [
+        (1.0 - (i - 3) / (CACHE_SIZE - 3)) ** CACHE_DECAY_POWER
+        for i in range(3, CACHE_SIZE)]
+    valence_score = [0.0] + (VALENCE_BOOST_SCALE * numpy.arange(
+        1, valence.max() + 1, dtype=numpy.float64) ** -VALENCE_BOOST_POWER).tolist()
+
+    remaining = valence.tolist()
+    position = [-1] * vertex_count
+    vertex_score = [valence_score[x] for x in remaining]
+    triangle_score = numpy.array(vertex_score)[local].sum(axis=1).tolist()
+    triangles_list = local.tolist()
+
+    emitted = bytearray(n)
+    order = []
+    cache: List[int] = []
+    best = int(numpy.argmax(triangle_score))
+    cursor = 0
+    for _ in range(n):
+        if best < 0:
+            # no candidate around the cache
+            while emitted[cursor]:
+                cursor += 1
+            best = cursor
+        triangle = triangles_list[best]
+        emitted[best] = 1
+        order.append(best)
+        for v in triangle:
+            remaining[v] -= 1
+
+        cache = triangle + [v for v in cache if v not in triangle]
+        for i, v in enumerate(cache):
+            position[v] = i if i < CACHE_SIZE else -1
+        # evicted vertices are updated too
+        candidates = []
+        for v in cache:
+            r = remaining[v]
+            if not r:
+                continue
+            score = cache_score[position[v] + 1] + valence_score[r]
+            diff = score - vertex_score[v]
+            vertex_score[v] = score
+            for t in adjacency[starts[v]:starts[v + 1]]:
+                if not emitted[t]:
+                    triangle_score[t] += diff
+                    candidates.append(t)
+        del cache[CACHE_SIZE:]
+        best = max(candidates, key=triangle_score.__getitem__) if candidates else -1
+
+    return numpy.array(order, numpy.int64)
+
+
+def optimize_vertex_cache(indices, ranges: Sequence[Tuple[int, int]])->numpy.ndarray:
+    '''
+    reorder triangles inside each range
+    '''
+    src = numpy.asarray(indices)
+    dst = src.copy()
+    for begin, end in ranges:
+        triangles = src[begin:end].reshape(-1, 3)
+        dst[begin:end] = triangles[forsyth(triangles)].reshape(-1)
+    return dst
+
+
+def optimize_vertex_fetch(indices, vertex_count: int)->Tuple[numpy.ndarray, numpy.ndarray]:
+    '''
+    vertex order by first use. unused vertices go last.
+    returns (remapped indices, vertex order)
+    '''
+    src = numpy.asarray(indices)
+    used, first = numpy.unique(src, return_index=True)
+    order = used[numpy.argsort(first, kind='stable')].astype(numpy.int64)
+    if len(order) < vertex_count:
+        unused = numpy.ones(vertex_count, bool)
+        unused[order] = False
+        order = numpy.concatenate([order, numpy.nonzero(unused)[0]])
+    remap = numpy.empty(vertex_count, numpy.int64)
+    remap[order] = numpy.arange(vertex_count)
+    return remap[src].astype(src.dtype), order
+
+
+def optimize(m: model.Model)->CacheReport:
+    '''
+    reorder m.indices and m.vertices in place. indices of m.lods are rewritten too.
+    '''
+    vertex_count = len(m.vertices)
+    indices = numpy.asarray(m.indices)
+    acmr_before, atvr_before = measure(indices, vertex_count)
+
+    if m.meshlets:
+        ranges = [(x.offset, x.offset + x.count) for x in m.meshlets]
+    else:
+        ranges = material_ranges(m.materials, len(indices))
+    indices = optimize_vertex_cache(indices, ranges)
+    indices, order = optimize_vertex_fetch(indices, vertex_count)
+    m.select_vertices(order)
+    m.indices = indices
+    if m.lods:
+        remap = numpy.empty(vertex_count, numpy.int64)
+        remap[order] = numpy.arange(vertex_count)
+        for x in m.lods:
+            lod_indices = numpy.asarray(x.indices)
+            x.indices = remap[lod_indices].astype(lod_indices.dtype)
+
+    acmr_after, atvr_after = measure(indices, vertex_count)
+    report = CacheReport(acmr_before, atvr_before, acmr_after, atvr_after)
+    logger.info('%s: %s', m.metadata.name, report)
+    return report
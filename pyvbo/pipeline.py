@@ -0,0 +1,55 @@
+'''
+model stages after the coordinate conversion: weld, optimize, lods and
+meshlets. the key of a Pipeline is a part of the cache key.
+'''
+from typing import Optional, Sequence
+
+from . import model
+
+
+class Pipeline:
+    '''
+    model stages after the coordinate conversion, in this order.
+    weld: None or the epsilon. 0.0 merges byte equal vertices only.
+    lods: ratios for build_lods. empty for no lod.
+    '''
+
+    def __init__(self, weld: Optional[float]=None, optimize=False,
+                 lods: Sequence[float]=(), meshlets=False)->None:
+        self.weld = weld
+        self.optimize = optimize
+        self.lods = tuple(lods)
+        self.meshlets = meshlets
+
+    @property
+    def key(self)->str:
+        stages = []
+        if self.weld is not None:
+            stages.append(f'weld{self.weld}')
+        if self.meshlets:
+            stages.append('meshlets')
+        if self.optimize:
+            stages.append('optimize')
+        if self.lods:
+            stages.append('lods' + ','.join(str(x) for x in self.lods))
+        return ';'.join(stages)
+
+    def __call__(self, m: model.Model)->None:
+        # optimize keeps the triangles of a meshlet together, so meshlets
+        # come first. lods index the vertices, so they come after the vertex
+        # reorders. meshlets reorder the base level only
+        if self.weld is not None:
+            from .weld import weld
+            weld(m, self.weld)
+        if self.meshlets:
+            from .meshlet import build_meshlets
+            build_meshlets(m)
+        if self.optimize:
+            from .optimize import optimize
+            optimize(m)
+        if self.lods:
+            from .simplify import build_lods
+            build_lods(m, self.lods)
+
+    def __repr__(self):
+        return f'{{Pipeline {self.key}}}'
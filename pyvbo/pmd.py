@@ -4,9 +4,11 @@ logger = getLogger(__name__)
 import ctypes
 import array
 import pathlib
+from typing import Any, Dict, List, Optional
 
-from .bytesreader import BytesReader
+from .bytesreader import BytesReader, Schema, gather, decode_strs
 from .metadata import MetaData, Direction, Coordinate
+from . import model
 
 
 class Vertex(ctypes.Structure):
@@ -24,6 +26,15 @@ class Vertex(ctypes.Structure):
 
 assert ctypes.sizeof(Vertex) == 38
 
+VertexRecord = Schema('Vertex',
+                      ('pos', '3f'),
+                      ('normal', '3f'),
+                      ('uv', '2f'),
+                      ('bone0', 'h'),
+                      ('bone1', 'h'),
+                      ('weight0', 'b'),
+                      ('flag', 'b'))
+
 
 class Material(ctypes.Structure):
     _pack_ = 1
@@ -42,51 +53,492 @@ class Material(ctypes.Structure):
 assert ctypes.sizeof(Material) == 70
 
 
-class Model:
-    def __init__(self, metadata, vertices, indices, materials):
-        self.metadata = metadata
-        self.vertices = vertices
-        self.indices = indices
-        self.materials = materials
+Header = Schema('Header',
+                ('magic', '3s'),
+                ('version', 'f'),
+                ('name', '20s', 'cp932'),
+                ('comment', '256s', 'cp932'))
+
+Bone = Schema('Bone',
+              ('name', '20s'),
+              ('parent', 'h'),
+              ('tail', 'h'),
+              ('type', 'B'),
+              ('ik_parent', 'h'),
+              ('pos', '3f'))
+
+Ik = Schema('Ik',
+            ('target', 'H'),
+            ('effector', 'H'),
+            ('chain_length', 'B'),
+            ('iterations', 'H'),
+            ('limit', 'f'))
+
+Morph = Schema('Morph',
+               ('name', '20s'),
+               ('vertex_count', 'I'),
+               ('type', 'B'))
+
+MorphVertex = Schema('MorphVertex',
+                     ('index', 'I'),
+                     ('pos', '3f'))
+
+BoneDisplay = Schema('BoneDisplay',
+                     ('bone', 'H'),
+                     ('frame', 'B'))
+
+RigidBody = Schema('RigidBody',
+                   ('name', '20s'),
+                   ('bone', 'h'),
+                   ('group', 'B'),
+                   ('mask', 'H'),
+                   ('shape', 'B'),
+                   ('size', '3f'),
+                   ('pos', '3f'),
+                   ('rot', '3f'),
+                   ('mass', 'f'),
+                   ('linear_damping', 'f'),
+                   ('angular_damping', 'f'),
+                   ('restitution', 'f'),
+                   ('friction', 'f'),
+                   ('mode', 'B'))
+
+Joint = Schema('Joint',
+               ('name', '20s'),
+               ('rigidbody_a', 'I'),
+               ('rigidbody_b', 'I'),
+               ('pos', '3f'),
+               ('rot', '3f'),
+               ('pos_min', '3f'),
+               ('pos_max', '3f'),
+               ('rot_min', '3f'),
+               ('rot_max', '3f'),
+               ('spring_pos', '3f'),
+               ('spring_rot', '3f'))
+
+TOON_COUNT = 10
+TOON_NAME_SIZE = 100
+NAME_SIZE = 20
+BONE_DISPLAY_NAME_SIZE = 50
+
+
+class VariableTable:
+    '''
+    fixed size records with variable length payloads.
+    payloads are concatenated in values, the i-th payload is
+    values[offsets[i]:offsets[i+1]].
+    '''
+
+    def __init__(self, records, values, offsets)->None:
+        self.records = records
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self)->int:
+        return len(self.records)
+
+    def __getitem__(self, i: int):
+        return self.records[i], self.values[self.offsets[i]:self.offsets[i + 1]]
+
+
+class English:
+    def __init__(self, name: str, comment: str,
+                 bone_names: List[str], morph_names: List[str],
+                 bone_display_names: List[str])->None:
+        self.name = name
+        self.comment = comment
+        self.bone_names = bone_names
+        self.morph_names = morph_names
+        self.bone_display_names = bone_display_names
+
+
+class Sections:
+    '''
+    sections after the material table.
+    the first pass only records offsets, each section is decoded on first
+    access. sections missing from old files are empty.
+    '''
+
+    def __init__(self, r: BytesReader)->None:
+        self._data = r.data
+        self._cache: Dict[str, Any] = {}
+
+        def read_count(get):
+            if r.remain <= 0:
+                return 0
+            return get()
+
+        # bones
+        self.bone_count = read_count(r.get_uint16)
+        self._bone_pos = r.pos
+        r.skip(Bone.size * self.bone_count)
+
+        # ik. variable size
+        self.ik_count = read_count(r.get_uint16)
+        self._ik_pos: List[int] = []
+        self._ik_chain_length: List[int] = []
+        for _ in range(self.ik_count):
+            self._ik_pos.append(r.pos)
+            chain_length = self._data[r.pos + 4]
+            self._ik_chain_length.append(chain_length)
+            r.skip(Ik.size + 2 * chain_length)
+
+        # morphs. variable size
+        self.morph_count = read_count(r.get_uint16)
+        self._morph_pos: List[int] = []
+        self._morph_vertex_count: List[int] = []
+        for _ in range(self.morph_count):
+            self._morph_pos.append(r.pos)
+            r.skip(NAME_SIZE)
+            vertex_count = r.get_uint32()
+            self._morph_vertex_count.append(vertex_count)
+            r.skip(1 + MorphVertex.size * vertex_count)
+
+        # display frames
+        self.morph_display_count = read_count(r.get_uint8)
+        self._morph_display_pos = r.pos
+        r.skip(2 * self.morph_display_count)
+
+        self.bone_display_name_count = read_count(r.get_uint8)
+        self._bone_display_name_pos = r.pos
+        r.skip(BONE_DISPLAY_NAME_SIZE * self.bone_display_name_count)
+
+        self.bone_display_count = read_count(r.get_uint32)
+        self._bone_display_pos = r.pos
+        r.skip(BoneDisplay.size * self.bone_display_count)
+
+        # english
+        self._english_pos = None
+        if read_count(r.get_uint8):
+            self._english_pos = r.pos
+            r.skip(NAME_SIZE + 256
+                   + NAME_SIZE * self.bone_count
+                   + NAME_SIZE * max(self.morph_count - 1, 0)
+                   + BONE_DISPLAY_NAME_SIZE * self.bone_display_name_count)
+
+        # toon
+        self._toon_pos = None
+        if r.remain >= TOON_COUNT * TOON_NAME_SIZE:
+            self._toon_pos = r.pos
+            r.skip(TOON_COUNT * TOON_NAME_SIZE)
+
+        # physics
+        self.rigidbody_count = read_count(r.get_uint32)
+        self._rigidbody_pos = r.pos
+        r.skip(RigidBody.size * self.rigidbody_count)
+
+        self.joint_count = read_count(r.get_uint32)
+        self._joint_pos = r.pos
+        r.skip(Joint.size * self.joint_count)
+
+    def _get(self, key: str, decode):
+        if key not in self._cache:
+            logger.debug('decode %s', key)
+            self._cache[key] = decode()
+        return self._cache[key]
+
+    def _array(self, schema: Schema, pos: int, count: int):
+        return BytesReader(self._data, pos).read_array(schema, count)
+
+    def _strs(self, pos: int, size: int, count: int)->List[str]:
+        r = BytesReader(self._data, pos)
+        return [r.get_str(size, 'cp932') for _ in range(count)]
+
+    @property
+    def bones(self):
+        return self._get('bones', lambda: self._array(
+            Bone, self._bone_pos, self.bone_count))
+
+    @property
+    def bone_names(self)->List[str]:
+        return self._get('bone_names', lambda: decode_strs(
+            self.bones['name'], 'cp932'))
+
+    @property
+    def ik_list(self)->VariableTable:
+        '''
+        records: Ik, values: chain bone indices
+        '''
+        def decode():
+            chain_pos = [x + Ik.size for x in self._ik_pos]
+            return VariableTable(
+                gather(self._data, Ik.dtype, self._ik_pos),
+                gather(self._data, '<u2', chain_pos, self._ik_chain_length),
+                _offsets(self._ik_chain_length))
+        return self._get('ik_list', decode)
+
+    @property
+    def morphs(self)->VariableTable:
+        '''
+        records: Morph, values: MorphVertex
+        '''
+        def decode():
+            vertex_pos = [x + Morph.size for x in self._morph_pos]
+            return VariableTable(
+                gather(self._data, Morph.dtype, self._morph_pos),
+                gather(self._data, MorphVertex.dtype,
+                       vertex_pos, self._morph_vertex_count),
+                _offsets(self._morph_vertex_count))
+        return self._get('morphs', decode)
+
+    @morphs.setter
+    def morphs(self, value: VariableTable)->None:
+        # ex. remapped by select_morph_vertices
+        self._cache['morphs'] = value
+
+    @property
+    def morph_names(self)->List[str]:
+        return self._get('morph_names', lambda: decode_strs(
+            self.morphs.records['name'], 'cp932'))
+
+    @property
+    def morph_display(self):
+        def decode():
+            import numpy
+            return numpy.frombuffer(self._data, '<u2', self.morph_display_count,
+                                    self._morph_display_pos)
+        return self._get('morph_display', decode)
+
+    @property
+    def bone_display_names(self)->List[str]:
+        return self._get('bone_display_names', lambda: self._strs(
+            self._bone_display_name_pos, BONE_DISPLAY_NAME_SIZE,
+            self.bone_display_name_count))
+
+    @property
+    def bone_display(self):
+        return self._get('bone_display', lambda: self._array(
+            BoneDisplay, self._bone_display_pos, self.bone_display_count))
+
+    @property
+    def english(self)->Optional[English]:
+        def decode():
+            if self._english_pos is None:
+                return None
+            r = BytesReader(self._data, self._english_pos)
+            name = r.get_str(NAME_SIZE, 'cp932')
+            comment = r.get_str(256, 'cp932')
+            return English(
+                name, comment,
+                [r.get_str(NAME_SIZE, 'cp932')
+                 for _ in range(self.bone_count)],
+                [r.get_str(NAME_SIZE, 'cp932')
+                 for _ in range(max(self.morph_count - 1, 0))],
+                [r.get_str(BONE_DISPLAY_NAME_SIZE, 'cp932')
+                 for _ in range(self.bone_display_name_count)])
+        return self._get('english', decode)
+
+    @property
+    def toon_textures(self)->List[str]:
+        def decode():
+            if self._toon_pos is None:
+                return []
+            return self._strs(self._toon_pos, TOON_NAME_SIZE, TOON_COUNT)
+        return self._get('toon_textures', decode)
+
+    @property
+    def rigidbodies(self):
+        return self._get('rigidbodies', lambda: self._array(
+            RigidBody, self._rigidbody_pos, self.rigidbody_count))
+
+    @property
+    def joints(self):
+        return self._get('joints', lambda: self._array(
+            Joint, self._joint_pos, self.joint_count))
+
+    def transform(self, matrix, scale: float)->None:
+        '''
+        bones, morphs, rigid bodies and joints. see coordinate.convert.
+        euler angles are mirrored like the rotation axes of
+        vmd.Motion.convert. an axis flips by a mirror
+        '''
+        import numpy
+        position = (matrix.T * scale).astype(numpy.float32)
+        axis = (matrix.T * numpy.linalg.det(matrix)).astype(numpy.float32)
+        # per axis values without sign
+        permute = numpy.abs(matrix.T).astype(numpy.float32)
+
+        bones = self.bones.copy()
+        bones['pos'] = bones['pos'] @ position
+        self._cache['bones'] = bones
+
+        if self.morph_count:
+            # base positions and offsets
+            morphs = self.morphs
+            values = morphs.values.copy()
+            values['pos'] = values['pos'] @ position
+            self.morphs = VariableTable(morphs.records, values, morphs.offsets)
+
+        rigidbodies = self.rigidbodies.copy()
+        rigidbodies['pos'] = rigidbodies['pos'] @ position
+        rigidbodies['rot'] = rigidbodies['rot'] @ axis
+        rigidbodies['size'] = rigidbodies['size'] * scale
+        self._cache['rigidbodies'] = rigidbodies
+
+        joints = self.joints.copy()
+        joints['pos'] = joints['pos'] @ position
+        joints['rot'] = joints['rot'] @ axis
+        for lo, hi, m in (('pos_min', 'pos_max', position), ('rot_min', 'rot_max', axis)):
+            # a flipped axis swaps the limits
+            a = joints[lo] @ m
+            b = joints[hi] @ m
+            joints[lo] = numpy.minimum(a, b)
+            joints[hi] = numpy.maximum(a, b)
+        joints['spring_pos'] = joints['spring_pos'] @ permute
+        joints['spring_rot'] = joints['spring_rot'] @ permute
+        self._cache['joints'] = joints
+
+
+def _offsets(counts: List[int]):
+    import numpy
+    offsets = numpy.zeros(len(counts) + 1, numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def morph_vertex_entries(morphs: VariableTable, vertex_count: int):
+    '''
+    (base morph, base entry of each vertex or -1). base is -1 without a base morph
+    '''
+    import numpy
+    entries = numpy.full(vertex_count, -1, numpy.int64)
+    found = numpy.flatnonzero(morphs.records['type'] == 0)
+    if not len(found):
+        return -1, entries
+    base = int(found[0])
+    _, values = morphs[base]
+    entries[values['index']] = numpy.arange(len(values))
+    return base, entries
+
+
+def select_morph_vertices(morphs: VariableTable, selection,
+                          vertex_count: int)->VariableTable:
+    '''
+    morphs after vertices = vertices[selection].
+    the base morph indexes the vertices, the other morphs index the base.
+    entries of removed vertices are dropped. a duplicated vertex gets its
+    own base entry, and the morphs that move the original move it too.
+    '''
+    import numpy
+    base, entry_of_vertex = morph_vertex_entries(morphs, vertex_count)
+    if base < 0:
+        return morphs
+    _, base_values = morphs[base]
+    base_count = len(base_values)
+    entries = entry_of_vertex[numpy.asarray(selection, numpy.int64)]
+    new_vertices = numpy.flatnonzero(entries >= 0)
+    # old entry of each new base entry
+    old_entries = entries[new_vertices]
+    # new base entries of each old entry are new_entries[starts[j]:starts[j] + counts[j]]
+    new_entries = numpy.argsort(old_entries, kind='stable')
+    counts = numpy.bincount(old_entries, minlength=base_count)
+    starts = numpy.cumsum(counts) - counts
+
+    values = []
+    for i in range(len(morphs)):
+        _, morph_values = morphs[i]
+        if i == base:
+            selected = morph_values[old_entries]
+            selected['index'] = new_vertices
+        else:
+            ref = morph_values['index'].astype(numpy.int64)
+            valid = ref < base_count
+            ref = numpy.where(valid, ref, 0)
+            repeat = numpy.where(valid, counts[ref], 0)
+            source = numpy.repeat(numpy.arange(len(morph_values)), repeat)
+            nth = numpy.arange(len(source)) - numpy.repeat(numpy.cumsum(repeat) - repeat, repeat)
+            selected = morph_values[source]
+            selected['index'] = new_entries[starts[ref[source]] + nth]
+        values.append(selected)
+    records = morphs.records.copy()
+    records['vertex_count'] = [len(x) for x in values]
+    return VariableTable(records, numpy.concatenate(values),
+                         _offsets([len(x) for x in values]))
+
+
+class Model(model.Model):
+    def __init__(self, metadata, vertices, indices, materials, sections=None):
+        super().__init__(metadata, vertices, indices, materials)
+        self.sections = sections
+
+    def texture_path(self, material: Material)->Optional[pathlib.Path]:
+        if not material.texture:
+            return None
+        texture_name = material.texture.decode('cp932')
+        if '*' in texture_name:
+            texture_name, _ = texture_name.split('*', 1)
+        return self.metadata.base_path / texture_name
+
+    def transform(self, matrix, scale: float)->None:
+        if self.sections:
+            self.sections.transform(matrix, scale)
+
+    def vertex_key_arrays(self)->list:
+        # a vertex moved by a morph is not merged. its base entry differs
+        if not self.sections or not self.sections.morph_count:
+            return []
+        _, entries = morph_vertex_entries(self.sections.morphs, len(self.vertices))
+        return [entries]
+
+    def select_vertices(self, selection)->None:
+        vertex_count = len(self.vertices)
+        super().select_vertices(selection)
+        if self.sections and self.sections.morph_count:
+            self.sections.morphs = select_morph_vertices(
+                self.sections.morphs, selection, vertex_count)
 
     def __repr__(self):
         return f'{{Pmd {self.metadata.name}}}'
 
 
-def load_bytes(data: bytes, path: pathlib.Path):
+def _array_from(r: BytesReader, t, count: int):
+    '''
+    writable buffer(mmap ACCESS_COPY) is shared without copy.
+    '''
+    data = r.get_bytes(count * ctypes.sizeof(t))
+    if r.writable:
+        return (t * count).from_buffer(data)
+    else:
+        return (t * count).from_buffer_copy(data)
+
+
+def load_bytes(data, path: pathlib.Path):
     # header
     r = BytesReader(data)
-    if r.get_bytes(3) != b'Pmd':
+    header = r.read(Header)
+    if header.magic != b'Pmd':
         return None
 
-    version = r.get_float()
-    if version != 1.0:
+    if header.version != 1.0:
         return None
 
-    name = r.get_str(20, 'cp932')
+    name = header.name
     logger.debug(name)
-    comment = r.get_str(256, 'cp932')
+    comment = header.comment
     logger.debug(comment)
 
     # vertices
     vertex_count = r.get_uint32()
-    vertices_bytes = r.get_bytes(vertex_count * ctypes.sizeof(Vertex))
-    vertices = (Vertex * vertex_count).from_buffer_copy(vertices_bytes)
-    logger.debug('%d vertices. %d bytes', vertex_count, len(vertices))
+    vertices = _array_from(r, Vertex, vertex_count)
+    logger.debug('%d vertices. %d bytes', vertex_count, ctypes.sizeof(vertices))
 
     # indices
     index_count = r.get_uint32()
-    indices = array.array('H')
-    indices.frombytes(r.get_bytes(
-        index_count * ctypes.sizeof(ctypes.c_uint16)))
+    indices_bytes = r.get_bytes(index_count * ctypes.sizeof(ctypes.c_uint16))
+    if r.writable:
+        indices = indices_bytes.cast('H')
+    else:
+        indices = array.array('H')
+        indices.frombytes(indices_bytes)
     logger.debug('%d indices. %d bytes', index_count,
                  indices.itemsize * len(indices))
 
     # materials
     material_count = r.get_uint32()
-    materials_bytes = r.get_bytes(material_count * ctypes.sizeof(Material))
-    materials = (Material * material_count).from_buffer_copy(materials_bytes)
-    logger.debug('%d materials. %d bytes', material_count, len(materials))
+    materials = _array_from(r, Material, material_count)
+    logger.debug('%d materials. %d bytes', material_count, ctypes.sizeof(materials))
+
+    sections = Sections(r)
 
     metadata = MetaData(
         path, name, comment,
@@ -97,4 +549,4 @@ def load_bytes(data: bytes, path: pathlib.Path):
         1.58 / 20
     )
 
-    return Model(metadata, vertices, indices, materials)
+    return Model(metadata, vertices, indices, materials, sections)
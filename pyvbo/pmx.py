@@ -0,0 +1,332 @@
+from logging import getLogger
+logger = getLogger(__name__)
+
+import ctypes
+import pathlib
+from typing import List, Optional
+
+import numpy
+
+from .bytesreader import BytesReader, Schema, gather
+from .metadata import MetaData, Direction, Coordinate
+from . import model
+from . import pmd
+
+
+Header = Schema('Header',
+                ('magic', '4s'),
+                ('version', 'f'),
+                ('globals_count', 'B'),
+                ('encoding', 'B'),
+                ('additional_uv', 'B'),
+                ('vertex_index_size', 'B'),
+                ('texture_index_size', 'B'),
+                ('material_index_size', 'B'),
+                ('bone_index_size', 'B'),
+                ('morph_index_size', 'B'),
+                ('rigidbody_index_size', 'B'))
+
+ENCODINGS = {
+    0: 'utf-16-le',
+    1: 'utf-8',
+}
+
+# vertex index is unsigned. 4 bytes is int32 in the spec, read as uint32
+# since an index is never negative
+VERTEX_INDEX_DTYPES = {
+    1: 'u1',
+    2: '<u2',
+    4: '<u4',
+}
+
+INDEX_DTYPES = {
+    1: 'i1',
+    2: '<i2',
+    4: '<i4',
+}
+
+# bone0 and bone1 of pmd.Vertex
+PMD_BONE_MAX = 32767
+
+BDEF1 = 0
+BDEF2 = 1
+BDEF4 = 2
+SDEF = 3
+QDEF = 4
+
+MaterialRecord0 = Schema('MaterialRecord0',
+                         ('color', '4f'),
+                         ('specular', '3f'),
+                         ('specularity', 'f'),
+                         ('ambient', '3f'),
+                         ('flag', 'B'),
+                         ('edge_color', '4f'),
+                         ('edge_size', 'f'))
+
+
+class Material:
+    def __init__(self, name: str, english_name: str,
+                 color, specular, specularity: float, ambient,
+                 flag: int, edge_color, edge_size: float,
+                 texture_index: int, sphere_index: int, sphere_mode: int,
+                 toon_shared: int, toon_index: int,
+                 memo: str, index_count: int)->None:
+        self.name = name
+        self.english_name = english_name
+        self.color = color
+        self.specular = specular
+        self.specularity = specularity
+        self.ambient = ambient
+        self.flag = flag
+        self.edge_color = edge_color
+        self.edge_size = edge_size
+        self.texture_index = texture_index
+        self.sphere_index = sphere_index
+        self.sphere_mode = sphere_mode
+        self.toon_shared = toon_shared
+        self.toon_index = toon_index
+        self.memo = memo
+        self.index_count = index_count
+
+    def __repr__(self):
+        return f'{{Material {self.name}: {self.index_count}}}'
+
+
+class Skinning:
+    '''
+    per vertex deform as arrays. unused slots have index -1 and weight 0.
+    '''
+
+    def __init__(self, deform, bone_indices, bone_weights,
+                 sdef_c, sdef_r0, sdef_r1)->None:
+        self.deform = deform
+        self.bone_indices = bone_indices
+        self.bone_weights = bone_weights
+        self.sdef_c = sdef_c
+        self.sdef_r0 = sdef_r0
+        self.sdef_r1 = sdef_r1
+
+
+class Model(model.Model):
+    def __init__(self, metadata, vertices, indices, materials,
+                 textures: List[str], skinning: Skinning,
+                 additional_uvs, edge_scale, sections_pos: int)->None:
+        super().__init__(metadata, vertices, indices, materials)
+        self.textures = textures
+        self.skinning = skinning
+        self.additional_uvs = additional_uvs
+        self.edge_scale = edge_scale
+        # offset of the bone section. not parsed yet
+        self.sections_pos = sections_pos
+
+    def texture_path(self, material: Material)->Optional[pathlib.Path]:
+        if material.texture_index < 0 or material.texture_index >= len(self.textures):
+            return None
+        return self.metadata.base_path / self.textures[material.texture_index]
+
+    def transform(self, matrix, scale: float)->None:
+        m = (matrix.T * scale).astype(numpy.float32)
+        self.skinning.sdef_c = self.skinning.sdef_c @ m
+        self.skinning.sdef_r0 = self.skinning.sdef_r0 @ m
+        self.skinning.sdef_r1 = self.skinning.sdef_r1 @ m
+
+    def vertex_key_arrays(self)->list:
+        return [self.skinning.deform, self.skinning.bone_indices,
+                self.skinning.bone_weights, self.skinning.sdef_c,
+                self.skinning.sdef_r0, self.skinning.sdef_r1,
+                self.additional_uvs, self.edge_scale]
+
+    def select_vertices(self, selection)->None:
+        super().select_vertices(selection)
+        skinning = self.skinning
+        for name in ('deform', 'bone_indices', 'bone_weights',
+                     'sdef_c', 'sdef_r0', 'sdef_r1'):
+            setattr(skinning, name, getattr(skinning, name)[selection])
+        self.additional_uvs = self.additional_uvs[selection]
+        self.edge_scale = self.edge_scale[selection]
+
+    def __repr__(self):
+        return f'{{Pmx {self.metadata.name}}}'
+
+
+def _deform_sizes(bone_index_size: int)->List[int]:
+    return [
+        bone_index_size,  # BDEF1
+        bone_index_size * 2 + 4,  # BDEF2
+        bone_index_size * 4 + 16,  # BDEF4
+        bone_index_size * 2 + 4 + 36,  # SDEF
+        bone_index_size * 4 + 16,  # QDEF
+    ]
+
+
+def _read_vertices(r: BytesReader, header, vertex_count: int):
+    '''
+    locate the variable size vertex records in one pass over the deform
+    type bytes, then decode each attribute for all vertices at once.
+    the pass is sequential, each offset depends on the previous deform
+    type. it only reads one byte per vertex.
+    '''
+    bone_size = header.bone_index_size
+    prefix_size = 32 + 16 * header.additional_uv
+    record_sizes = [prefix_size + 1 + x + 4 for x in _deform_sizes(bone_size)]
+
+    # record boundaries
+    data = r.data
+    starts = [0] * vertex_count
+    pos = r.pos
+    for i in range(vertex_count):
+        starts[i] = pos
+        pos += record_sizes[data[pos + prefix_size]]
+    r.pos = pos
+    offsets = numpy.array(starts, numpy.int64)
+
+    deform = gather(data, 'u1', offsets + prefix_size)
+    sizes = numpy.array(record_sizes, numpy.int64)[deform]
+
+    vertices = numpy.zeros(vertex_count, pmd.VertexRecord.dtype)
+    base = gather(data, [('pos', '<f4', 3),
+                         ('normal', '<f4', 3),
+                         ('uv', '<f4', 2)], offsets)
+    vertices['pos'] = base['pos']
+    vertices['normal'] = base['normal']
+    vertices['uv'] = base['uv']
+
+    additional_uvs = gather(data, ('<f4', (header.additional_uv, 4)), offsets + 32)\
+        if header.additional_uv else numpy.zeros((vertex_count, 0, 4), numpy.float32)
+    edge_scale = gather(data, '<f4', offsets + sizes - 4)
+
+    # skinning
+    bone_dtype = INDEX_DTYPES[bone_size]
+    bone_indices = numpy.full((vertex_count, 4), -1, numpy.int32)
+    bone_weights = numpy.zeros((vertex_count, 4), numpy.float32)
+    sdef = numpy.zeros((vertex_count, 3, 3), numpy.float32)
+    deform_pos = offsets + prefix_size + 1
+
+    mask = deform == BDEF1
+    if mask.any():
+        bone_indices[mask, 0] = gather(data, bone_dtype, deform_pos[mask])
+        bone_weights[mask, 0] = 1.0
+
+    mask = (deform == BDEF2) | (deform == SDEF)
+    if mask.any():
+        values = gather(data, [('bones', bone_dtype, 2),
+                               ('weight', '<f4')], deform_pos[mask])
+        bone_indices[mask, 0:2] = values['bones']
+        bone_weights[mask, 0] = values['weight']
+        bone_weights[mask, 1] = 1.0 - values['weight']
+
+    mask = deform == SDEF
+    if mask.any():
+        sdef[mask] = gather(data, ('<f4', (3, 3)),
+                            deform_pos[mask] + bone_size * 2 + 4)
+
+    mask = (deform == BDEF4) | (deform == QDEF)
+    if mask.any():
+        values = gather(data, [('bones', bone_dtype, 4),
+                               ('weights', '<f4', 4)], deform_pos[mask])
+        bone_indices[mask] = values['bones']
+        bone_weights[mask] = values['weights']
+
+    # pmd compatible part. int16. Skinning keeps the full indices
+    bone0 = bone_indices[:, 0]
+    bone1 = numpy.where(bone_indices[:, 1] < 0, bone0, bone_indices[:, 1])
+    overflow = (bone0 > PMD_BONE_MAX) | (bone1 > PMD_BONE_MAX)
+    if overflow.any():
+        logger.warning('%d vertices use bones over %d. clamped in vertices',
+                       int(overflow.sum()), PMD_BONE_MAX)
+    vertices['bone0'] = numpy.minimum(bone0, PMD_BONE_MAX)
+    vertices['bone1'] = numpy.minimum(bone1, PMD_BONE_MAX)
+    vertices['weight0'] = numpy.rint(bone_weights[:, 0] * 100)
+
+    skinning = Skinning(deform, bone_indices, bone_weights,
+                        sdef[:, 0], sdef[:, 1], sdef[:, 2])
+    return vertices, skinning, additional_uvs, edge_scale
+
+
+def load_bytes(data, path: pathlib.Path):
+    # header
+    r = BytesReader(data)
+    header = r.read(Header)
+    if header.magic != b'PMX ':
+        return None
+
+    # float32. 2.1 is 2.0999999
+    if round(header.version, 1) not in (2.0, 2.1):
+        logger.warning('unknown version: %f', header.version)
+        return None
+    # skip unknown globals
+    r.skip(header.globals_count - 8)
+
+    encoding = ENCODINGS[header.encoding]
+
+    def get_text()->str:
+        size = r.get_int32()
+        return r.get_bytes(size).tobytes().decode(encoding)
+
+    name = get_text()
+    logger.debug(name)
+    _english_name = get_text()
+    comment = get_text()
+    logger.debug(comment)
+    _english_comment = get_text()
+
+    # vertices
+    vertex_count = r.get_int32()
+    vertex_array, skinning, additional_uvs, edge_scale = _read_vertices(
+        r, header, vertex_count)
+    vertices = (pmd.Vertex * vertex_count).from_buffer(vertex_array)
+    logger.debug('%d vertices. %d bytes', vertex_count, ctypes.sizeof(vertices))
+
+    # indices
+    index_count = r.get_int32()
+    index_dtype = numpy.dtype(VERTEX_INDEX_DTYPES[header.vertex_index_size])
+    indices = numpy.frombuffer(r.data, index_dtype, index_count, r.pos)
+    r.skip(index_dtype.itemsize * index_count)
+    logger.debug('%d indices. %d bytes', index_count, indices.nbytes)
+
+    # textures
+    texture_count = r.get_int32()
+    textures = [get_text().replace('\\', '/') for _ in range(texture_count)]
+
+    # materials
+    texture_dtype = numpy.dtype(INDEX_DTYPES[header.texture_index_size])
+
+    def get_texture_index()->int:
+        value = numpy.frombuffer(r.data, texture_dtype, 1, r.pos)[0]
+        r.skip(texture_dtype.itemsize)
+        return int(value)
+
+    def read_material()->Material:
+        material_name = get_text()
+        english_name = get_text()
+        record = r.read(MaterialRecord0)
+        texture_index = get_texture_index()
+        sphere_index = get_texture_index()
+        sphere_mode = r.get_uint8()
+        toon_shared = r.get_uint8()
+        toon_index = r.get_uint8() if toon_shared else get_texture_index()
+        memo = get_text()
+        index_count = r.get_int32()
+        return Material(material_name, english_name,
+                        record.color, record.specular, record.specularity,
+                        record.ambient, record.flag,
+                        record.edge_color, record.edge_size,
+                        texture_index, sphere_index, sphere_mode,
+                        toon_shared, toon_index,
+                        memo, index_count)
+
+    material_count = r.get_int32()
+    materials = [read_material() for _ in range(material_count)]
+    logger.debug('%d materials', material_count)
+
+    metadata = MetaData(
+        path, name, comment,
+        Coordinate.YUP_ZFORWARD,
+        Direction.Y_POSITIVE,
+        Direction.Z_NEGATIVE,
+        Direction.X_NEGATIVE,
+        1.58 / 20
+    )
+
+    return Model(metadata, vertices, indices, materials,
+                 textures, skinning, additional_uvs, edge_scale, r.pos)
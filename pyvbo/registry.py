@@ -0,0 +1,128 @@
+'''
+loader registry
+
+a format is a module path with its magic bytes and extensions. the module
+is imported on first use and provides
+
+    load_bytes(data, path) -> Model
+    load(path, use_mmap=False) -> Model  # optional. ex. streaming
+
+other packages add formats with an entry point in the 'pyvbo.loaders'
+group that points to a function taking the Registry:
+
+    [options.entry_points]
+    pyvbo.loaders =
+        myformat = mypackage.pyvbo_plugin:register
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import importlib
+import mmap
+import pathlib
+from typing import Any, Iterable, List, Optional
+
+ENTRY_POINT_GROUP = 'pyvbo.loaders'
+
+# enough for every registered magic
+SNIFF_SIZE = 16
+
+
+class Format:
+    def __init__(self, name: str, module: str,
+                 magic: Iterable[bytes]=(), extensions: Iterable[str]=())->None:
+        self.name = name
+        self.module = module
+        self.magic = tuple(magic)
+        self.extensions = tuple(x.lower() for x in extensions)
+        self._loaded: Any = None
+
+    def get_module(self):
+        if not self._loaded:
+            logger.debug('import %s', self.module)
+            self._loaded = importlib.import_module(self.module)
+        return self._loaded
+
+    def match_magic(self, head: bytes)->bool:
+        return any(head.startswith(x) for x in self.magic)
+
+    def match_extension(self, path: pathlib.Path)->bool:
+        return path.suffix.lower() in self.extensions
+
+    def __repr__(self):
+        return f'{{Format {self.name}: {self.module}}}'
+
+
+class Registry:
+    def __init__(self)->None:
+        self.formats: List[Format] = []
+        self._entry_points_loaded = False
+
+    def register(self, name: str, module: str,
+                 magic: Iterable[bytes]=(), extensions: Iterable[str]=())->Format:
+        '''
+        a later registration of the same name replaces the former
+        '''
+        value = Format(name, module, magic, extensions)
+        self.formats = [x for x in self.formats if x.name != name]
+        self.formats.append(value)
+        return value
+
+    def load_entry_points(self)->None:
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=ENTRY_POINT_GROUP)
+        else:
+            eps = eps.get(ENTRY_POINT_GROUP, [])
+        for ep in eps:
+            try:
+                ep.load()(self)
+            except Exception as ex:  # pylint: disable=W0703
+                logger.error('entry point %s: %s', ep.name, ex)
+
+    def sniff(self, head: bytes, path: Optional[pathlib.Path]=None)->Format:
+        '''
+        magic bytes first, then the extension
+        '''
+        self.load_entry_points()
+        head = bytes(head[:SNIFF_SIZE])
+        for x in self.formats:
+            if x.match_magic(head):
+                return x
+        if path:
+            for x in self.formats:
+                if x.match_extension(path):
+                    return x
+        raise NotImplementedError(f'unknown format: {path}')
+
+    def find(self, path: pathlib.Path)->Format:
+        with path.open('rb') as f:
+            head = f.read(SNIFF_SIZE)
+        return self.sniff(head, path)
+
+    def load(self, path: pathlib.Path, use_mmap=False):
+        module = self.find(path).get_module()
+        if hasattr(module, 'load'):
+            return module.load(path, use_mmap)
+        if use_mmap:
+            with path.open('rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            return module.load_bytes(data, path)
+        return module.load_bytes(path.read_bytes(), path)
+
+    def load_bytes(self, data, path: pathlib.Path):
+        return self.sniff(data[:SNIFF_SIZE], path).get_module().load_bytes(data, path)
+
+
+REGISTRY = Registry()
+REGISTRY.register('pmd', 'pyvbo.pmd', [b'Pmd'], ['.pmd'])
+REGISTRY.register('pmx', 'pyvbo.pmx', [b'PMX '], ['.pmx'])
+REGISTRY.register('gltf', 'pyvbo.gltf', [b'glTF'], ['.gltf', '.glb'])
+REGISTRY.register('obj', 'pyvbo.obj', [], ['.obj'])
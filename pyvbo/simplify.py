@@ -0,0 +1,238 @@
+'''
+level of detail by quadric error metric edge collapse
+(Garland, Heckbert "Surface Simplification Using Quadric Error Metrics")
+
+collapses are half edge collapses. a vertex moves onto a neighbor, so
+every level indexes the original vertex buffer.
+
+* vertices on an open edge are locked. with pmd style vertices, uv seams and
+  hard edges are duplicated vertices, which are open edges, so they stay.
+* vertices used by more than one material are locked. each triangle keeps
+  its material.
+* collapses that flip a triangle or make the mesh non manifold are rejected.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import heapq
+from typing import List, Sequence, Set
+
+import numpy
+
+from . import model
+from . import pmd
+
+DEFAULT_RATIOS = (0.5, 0.25, 0.125)
+
+# minimum cos between the normals before and after a collapse
+FLIP_THRESHOLD = 0.2
+
+
+class Lod:
+    '''
+    indices: triangles grouped by material in the material order.
+    index_counts: per material, like Material.index_count
+    error: max quadric error of the collapses up to this level
+    '''
+
+    def __init__(self, ratio: float, indices: numpy.ndarray,
+                 index_counts: List[int], error: float)->None:
+        self.ratio = ratio
+        self.indices = indices
+        self.index_counts = index_counts
+        self.error = error
+
+    @property
+    def triangle_count(self)->int:
+        return len(self.indices) // 3
+
+    def __repr__(self):
+        return f'{{Lod {self.ratio}: {self.triangle_count} triangles, error {self.error:.3g}}}'
+
+
+def _quadrics(positions: numpy.ndarray, triangles: numpy.ndarray)->numpy.ndarray:
+    '''
+    area weighted plane quadric per vertex. (V, 4, 4)
+    '''
+    p0 = positions[triangles[:, 0]]
+    cross = numpy.cross(positions[triangles[:, 1]] - p0,
+                        positions[triangles[:, 2]] - p0)
+    area2 = numpy.linalg.norm(cross, axis=1)
+    normal = cross / numpy.maximum(area2, 1e-30)[:, None]
+    plane = numpy.concatenate(
+        [normal, -(normal * p0).sum(axis=1)[:, None]], axis=1)
+    q = plane[:, :, None] * plane[:, None, :] * (area2 * 0.5)[:, None, None]
+    quadrics = numpy.zeros((len(positions), 4, 4))
+    for k in range(3):
+        numpy.add.at(quadrics, triangles[:, k], q)
+    return quadrics
+
+
+def _locked(triangles: numpy.ndarray, materials: numpy.ndarray,
+            vertex_count: int)->numpy.ndarray:
+    # open edges
+    edges = numpy.sort(numpy.concatenate([triangles[:, [0, 1]],
+                                          triangles[:, [1, 2]],
+                                          triangles[:, [2, 0]]]), axis=1)
+    keys = edges[:, 0] * vertex_count + edges[:, 1]
+    unique, counts = numpy.unique(keys, return_counts=True)
+    border = unique[counts == 1]
+    locked = numpy.zeros(vertex_count, bool)
+    locked[border // vertex_count] = True
+    locked[border % vertex_count] = True
+    # material boundaries
+    if len(materials):
+        lo = numpy.full(vertex_count, len(materials), numpy.int64)
+        hi = numpy.full(vertex_count, -1, numpy.int64)
+        for k in range(3):
+            numpy.minimum.at(lo, triangles[:, k], materials)
+            numpy.maximum.at(hi, triangles[:, k], materials)
+        locked |= (hi >= 0) & (lo != hi)
+    return locked
+
+
+def _normal(a, b, c):
+    ux, uy, uz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    vx, vy, vz = c[0] - a[0], c[1] - a[1], c[2] - a[2]
+    return (uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx)
+
+
+def _cos(n, m)->float:
+    d = (n[0] * n[0] + n[1] * n[1] + n[2] * n[2]) * (m[0] * m[0] + m[1] * m[1] + m[2] * m[2])
+    if d <= 0:
+        return -1.0
+    return (n[0] * m[0] + n[1] * m[1] + n[2] * m[2]) / d ** 0.5
+
+
+def simplify(positions, indices, index_counts: Sequence[int],
+             ratios: Sequence[float]=DEFAULT_RATIOS)->List[Lod]:
+    '''
+    positions: (V, 3). indices: triangle list. index_counts: per material.
+    works for a MeshBuilder output as well, after its duplicated vertices
+    are welded.
+
+    levels are built progressively, each from the previous one.
+    a level that can not reach its ratio stops the chain.
+    '''
+    positions = numpy.asarray(positions, numpy.float64).reshape(-1, 3)
+    triangles = numpy.asarray(indices).astype(numpy.int64).reshape(-1, 3)
+    vertex_count = len(positions)
+    triangle_count = len(triangles)
+    counts = list(index_counts)
+    if sum(counts) < triangle_count * 3:
+        counts.append(triangle_count * 3 - sum(counts))
+    materials = numpy.repeat(numpy.arange(len(counts)),
+                             numpy.array(counts, numpy.int64) // 3)[:triangle_count]
+
+    quadrics = _quadrics(positions, triangles)
+    locked = _locked(triangles, materials, vertex_count).tolist()
+    points = positions.tolist()
+    homogeneous = numpy.concatenate([positions, numpy.ones((vertex_count, 1))], axis=1)
+
+    tris = triangles.tolist()
+    alive = [True] * triangle_count
+    vertex_tris: List[Set[int]] = [set() for _ in range(vertex_count)]
+    for t, (a, b, c) in enumerate(tris):
+        vertex_tris[a].add(t)
+        vertex_tris[b].add(t)
+        vertex_tris[c].add(t)
+    version = [0] * vertex_count
+
+    def costs(edges: numpy.ndarray)->List[float]:
+        # move edges[:, 0] onto edges[:, 1]
+        h = homogeneous[edges[:, 1]]
+        q = quadrics[edges[:, 0]] + quadrics[edges[:, 1]]
+        return numpy.einsum('ni,nij,nj->n', h, q, h).tolist()
+
+    def push_edges(v: int):
+        neighbors = set()
+        for t in vertex_tris[v]:
+            neighbors.update(tris[t])
+        neighbors.discard(v)
+        edges = [(w, v) for w in neighbors if not locked[w]]
+        if not locked[v]:
+            edges += [(v, w) for w in neighbors]
+        if edges:
+            for c, (a, b) in zip(costs(numpy.array(edges)), edges):
+                heapq.heappush(heap, (c, a, b, version[a], version[b]))
+
+    # initial costs in one pass
+    edges = numpy.unique(numpy.sort(numpy.concatenate(
+        [triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]), axis=1), axis=0)
+    edges = numpy.concatenate([edges, edges[:, ::-1]])
+    edges = edges[~numpy.array(locked, bool)[edges[:, 0]]]
+    heap = [(c, u, v, 0, 0) for c, (u, v) in zip(costs(edges), edges.tolist())]
+    heapq.heapify(heap)
+
+    def try_collapse(u: int, v: int)->bool:
+        shared = [t for t in vertex_tris[u] if v in tris[t]]
+        if not shared:
+            return False
+        # link condition
+        neighbors_u = set()
+        for t in vertex_tris[u]:
+            neighbors_u.update(tris[t])
+        neighbors_v = set()
+        for t in vertex_tris[v]:
+            neighbors_v.update(tris[t])
+        if len((neighbors_u & neighbors_v) - {u, v}) > len(shared):
+            return False
+        # flip
+        moved = [t for t in vertex_tris[u] if v not in tris[t]]
+        for t in moved:
+            a, b, c = tris[t]
+            before = _normal(points[a], points[b], points[c])
+            after = _normal(*(points[v] if x == u else points[x] for x in (a, b, c)))
+            if _cos(before, after) < FLIP_THRESHOLD:
+                return False
+
+        for t in shared:
+            alive[t] = False
+            for x in tris[t]:
+                vertex_tris[x].discard(t)
+        for t in moved:
+            tris[t] = [v if x == u else x for x in tris[t]]
+            vertex_tris[v].add(t)
+        vertex_tris[u].clear()
+        quadrics[v] += quadrics[u]
+        version[u] += 1
+        version[v] += 1
+        nonlocal live
+        live -= len(shared)
+        return True
+
+    lods: List[Lod] = []
+    live = triangle_count
+    error = 0.0
+    for ratio in ratios:
+        target = int(triangle_count * ratio)
+        while live > target and heap:
+            c, u, v, vu, vv = heapq.heappop(heap)
+            if version[u] != vu or version[v] != vv:
+                continue
+            if try_collapse(u, v):
+                error = max(error, c)
+                push_edges(v)
+        if live > target:
+            logger.info('stop at %d triangles. target %d', live, target)
+            break
+
+        mask = numpy.array(alive, bool)
+        current = numpy.array(tris, numpy.int64)[mask]
+        current_materials = materials[mask]
+        order = numpy.argsort(current_materials, kind='stable')
+        lod_indices = current[order].reshape(-1).astype(numpy.asarray(indices).dtype)
+        lod_counts = (numpy.bincount(current_materials, minlength=len(counts)) * 3).tolist()
+        lods.append(Lod(ratio, lod_indices, lod_counts[:len(index_counts)], error))
+        logger.debug('%s', lods[-1])
+    return lods
+
+
+def build_lods(m: model.Model, ratios: Sequence[float]=DEFAULT_RATIOS)->List[Lod]:
+    '''
+    sets m.lods
+    '''
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    m.lods = simplify(records['pos'], m.indices,
+                      [x.index_count for x in m.materials], ratios)
+    return m.lods
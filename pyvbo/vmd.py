@@ -0,0 +1,332 @@
+'''
+VMD motion
+
+bone and morph keyframes become tracks, one per name. the keys of all
+tracks are numpy arrays sorted by (track, frame), so all tracks are
+sampled at a frame in a few vectorized calls:
+
+* the segment of each track is found by one numpy.searchsorted over
+  track << 32 | frame keys.
+* the last segment of each track is kept. while playback stays in it, the
+  track skips the search.
+* the bezier curves of the segments are solved at once.
+
+not a registered format. a motion is not a model, pyvbo.load does not
+take it. values are in VMD space (YUP_ZFORWARD, MMD units) until convert.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import math
+import pathlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy
+
+from .bytesreader import BytesReader, Schema
+from .metadata import Coordinate
+from . import coordinate
+
+MAGIC = b'Vocaloid Motion Data 0002'
+MAGIC_OLD = b'Vocaloid Motion Data file'
+
+NAME_SIZE = 15
+
+# same as pmd
+TO_METER = 1.58 / 20
+
+# bisection steps of a bezier. error < 2 ** -16
+BEZIER_ITERATIONS = 16
+
+Header = Schema('Header',
+                ('magic', '30s'),
+                ('model', '20s', 'cp932'))
+
+HeaderOld = Schema('HeaderOld',
+                   ('magic', '30s'),
+                   ('model', '10s', 'cp932'))
+
+BoneFrame = Schema('BoneFrame',
+                   ('name', '15s'),
+                   ('frame', 'I'),
+                   ('pos', '3f'),
+                   ('rot', '4f'),
+                   ('interpolation', '64B'))
+
+MorphFrame = Schema('MorphFrame',
+                    ('name', '15s'),
+                    ('frame', 'I'),
+                    ('weight', 'f'))
+
+
+def decode_name(data: bytes)->str:
+    # cut at 15 bytes, maybe in the middle of a character
+    return data.split(b'\0', 1)[0].decode('cp932', errors='ignore')
+
+
+def track_name(name: str)->str:
+    '''
+    a bone or morph name as stored in VMD
+    '''
+    return decode_name(name.encode('cp932', errors='ignore')[:NAME_SIZE])
+
+
+def _cubic(s: numpy.ndarray, p1: numpy.ndarray, p2: numpy.ndarray)->numpy.ndarray:
+    # p0 = 0, p3 = 1
+    r = 1.0 - s
+    return 3.0 * r * r * s * p1 + 3.0 * r * s * s * p2 + s * s * s
+
+
+def bezier(x: numpy.ndarray, curves: numpy.ndarray)->numpy.ndarray:
+    '''
+    y at x of the curves from (0, 0) to (1, 1).
+    x: in [0, 1]. curves: (x.shape, 4) of x1, y1, x2, y2 in [0, 1]
+    '''
+    x1, y1, x2, y2 = (curves[..., i] for i in range(4))
+    lo = numpy.zeros_like(x)
+    hi = numpy.ones_like(x)
+    # x(s) is monotonic for control points in [0, 1]
+    for _ in range(BEZIER_ITERATIONS):
+        s = (lo + hi) * 0.5
+        below = _cubic(s, x1, x2) < x
+        lo = numpy.where(below, s, lo)
+        hi = numpy.where(below, hi, s)
+    y = _cubic((lo + hi) * 0.5, y1, y2)
+    # exact at the keys. the bisection stops half a step inside
+    return numpy.where(x <= 0.0, 0.0, numpy.where(x >= 1.0, 1.0, y))
+
+
+def slerp(a: numpy.ndarray, b: numpy.ndarray, t: numpy.ndarray)->numpy.ndarray:
+    '''
+    a, b: (n, 4) xyzw quaternions. t: (n,)
+    '''
+    dot = (a * b).sum(axis=1)
+    # the shorter arc
+    b = numpy.where(dot[:, None] < 0, -b, b)
+    dot = numpy.abs(dot)
+    theta = numpy.arccos(numpy.clip(dot, -1.0, 1.0))
+    sin = numpy.sin(theta)
+    linear = sin < 1e-6
+    safe = numpy.where(linear, 1.0, sin)
+    wa = numpy.where(linear, 1.0 - t, numpy.sin((1.0 - t) * theta) / safe)
+    wb = numpy.where(linear, t, numpy.sin(t * theta) / safe)
+    q = a * wa[:, None] + b * wb[:, None]
+    return q / numpy.linalg.norm(q, axis=1)[:, None]
+
+
+class Tracks:
+    '''
+    names: track names
+    offsets: the keys of track i are [offsets[i], offsets[i + 1])
+    frames: (keys,) sorted in each track
+
+    sample keeps a cursor per track. not thread safe
+    '''
+
+    def __init__(self, names: List[str], offsets: numpy.ndarray,
+                 frames: numpy.ndarray)->None:
+        self.names = names
+        self.offsets = offsets
+        self.frames = frames
+        self._index = {x: i for i, x in enumerate(names)}
+        track = numpy.repeat(numpy.arange(len(names), dtype=numpy.int64),
+                             numpy.diff(offsets))
+        self._keys = (track << 32) | frames.astype(numpy.int64)
+        # frame of the next key in the track. the last key lasts forever
+        self._next = numpy.empty(len(frames), numpy.float64)
+        self._next[:-1] = frames[1:]
+        self._next[offsets[1:] - 1] = numpy.inf
+        self._first = offsets[:-1].copy()
+        self._last = numpy.maximum(offsets[1:] - 1, self._first)
+        self._cursor = self._first.copy()
+
+    def __len__(self)->int:
+        return len(self.names)
+
+    @property
+    def key_count(self)->int:
+        return len(self.frames)
+
+    @property
+    def frame_count(self)->int:
+        '''
+        the last frame + 1
+        '''
+        return int(self.frames.max()) + 1 if len(self.frames) else 0
+
+    def index(self, name: str)->int:
+        '''
+        -1 if no track
+        '''
+        return self._index.get(track_name(name), -1)
+
+    def indices(self, names: Sequence[str])->numpy.ndarray:
+        '''
+        track of each name, ex. the bones of a model. -1 if no track
+        '''
+        return numpy.array([self.index(x) for x in names], numpy.int64)
+
+    def segments(self, frame: float)->Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        '''
+        (key, next key, t) of each track. t in [0, 1] from key to next key.
+        before the first key and after the last key both keys are the same
+        '''
+        cursor = self._cursor
+        frames = self.frames
+        current = frames[cursor]
+        hit = ((current <= frame) & (frame < self._next[cursor])) |\
+            ((cursor == self._first) & (frame < current))
+        if not hit.all():
+            miss = numpy.flatnonzero(~hit)
+            query = (miss << 32) | max(int(math.floor(frame)), 0)
+            found = numpy.searchsorted(self._keys, query, 'right') - 1
+            cursor[miss] = numpy.maximum(found, self._first[miss])
+        key = cursor.copy()
+        following = numpy.minimum(key + 1, self._last)
+        start = frames[key].astype(numpy.float64)
+        span = frames[following] - start
+        t = numpy.clip((frame - start) / numpy.where(span > 0, span, 1.0), 0.0, 1.0)
+        t[span <= 0] = 0.0
+        return key, following, t
+
+
+class BoneTracks(Tracks):
+    '''
+    positions: (keys, 3) translation from the rest pose
+    rotations: (keys, 4) xyzw
+    curves: (keys, 4, 4) bezier x1, y1, x2, y2 of x, y, z and rotation.
+            the curve of a key is the segment ending at it
+    '''
+
+    def __init__(self, names: List[str], offsets: numpy.ndarray, frames: numpy.ndarray,
+                 positions: numpy.ndarray, rotations: numpy.ndarray,
+                 curves: numpy.ndarray)->None:
+        super().__init__(names, offsets, frames)
+        self.positions = positions
+        self.rotations = rotations
+        self.curves = curves
+
+    def sample(self, frame: float)->Tuple[numpy.ndarray, numpy.ndarray]:
+        '''
+        (positions, rotations) of all tracks at frame
+        '''
+        key, following, t = self.segments(frame)
+        weights = bezier(numpy.repeat(t[:, None], 4, axis=1), self.curves[following])
+        p0 = self.positions[key]
+        positions = p0 + (self.positions[following] - p0) * weights[:, :3]
+        rotations = slerp(self.rotations[key], self.rotations[following], weights[:, 3])
+        return positions.astype(numpy.float32), rotations.astype(numpy.float32)
+
+
+class MorphTracks(Tracks):
+    '''
+    weights: (keys,). linear
+    '''
+
+    def __init__(self, names: List[str], offsets: numpy.ndarray, frames: numpy.ndarray,
+                 weights: numpy.ndarray)->None:
+        super().__init__(names, offsets, frames)
+        self.weights = weights
+
+    def sample(self, frame: float)->numpy.ndarray:
+        '''
+        weights of all tracks at frame
+        '''
+        key, following, t = self.segments(frame)
+        w0 = self.weights[key]
+        return (w0 + (self.weights[following] - w0) * t).astype(numpy.float32)
+
+
+class Motion:
+    def __init__(self, path: pathlib.Path, model: str,
+                 bones: BoneTracks, morphs: MorphTracks)->None:
+        self.path = path
+        # the model the motion was made for
+        self.model = model
+        self.bones = bones
+        self.morphs = morphs
+        self.coord = Coordinate.YUP_ZFORWARD
+        self.to_meter = TO_METER
+
+    @property
+    def frame_count(self)->int:
+        return max(self.bones.frame_count, self.morphs.frame_count)
+
+    def convert(self, dst=Coordinate.YUP_ZBACKWARD, to_meter=True)->'Motion':
+        '''
+        same as coordinate.convert of the model. in place
+        '''
+        matrix = coordinate.get_matrix(self.coord, dst)
+        scale = self.to_meter if to_meter else 1.0
+        bones = self.bones
+        bones.positions = (bones.positions @ (matrix.T * scale)).astype(numpy.float32)
+        # the axis of a rotation flips by a mirror
+        axis = matrix.T * numpy.linalg.det(matrix)
+        bones.rotations[:, :3] = bones.rotations[:, :3] @ axis.astype(numpy.float32)
+        self.coord = dst
+        if to_meter:
+            self.to_meter = 1.0
+        return self
+
+    def __repr__(self):
+        return (f'{{Vmd {self.model}: {self.frame_count} frames, '
+                f'{len(self.bones)} bones {self.bones.key_count} keys, '
+                f'{len(self.morphs)} morphs {self.morphs.key_count} keys}}')
+
+
+def _group(records: numpy.ndarray)->Tuple[List[str], numpy.ndarray, numpy.ndarray]:
+    '''
+    (names, offsets, order of the records by track and frame)
+    '''
+    # bytes after the first NUL are garbage in some files
+    raw = numpy.array(records['name']).view(numpy.uint8).reshape(-1, NAME_SIZE)
+    raw[numpy.cumsum(raw == 0, axis=1) > 0] = 0
+    names, inverse = numpy.unique(raw.view(f'S{NAME_SIZE}').reshape(-1), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = numpy.lexsort((records['frame'], inverse))
+    offsets = numpy.zeros(len(names) + 1, numpy.int64)
+    numpy.cumsum(numpy.bincount(inverse, minlength=len(names)), out=offsets[1:])
+    return [decode_name(x) for x in names.tolist()], offsets, order
+
+
+def _read_count(r: BytesReader)->int:
+    # old files end after any section
+    return r.get_uint32() if r.remain >= 4 else 0
+
+
+def load_bytes(data, path: pathlib.Path)->Optional[Motion]:
+    r = BytesReader(data)
+    magic = bytes(r.data[:len(MAGIC)])
+    if magic == MAGIC:
+        header = r.read(Header)
+    elif magic == MAGIC_OLD:
+        header = r.read(HeaderOld)
+    else:
+        return None
+
+    count = _read_count(r)
+    records = r.read_array(BoneFrame, count)
+    names, offsets, order = _group(records)
+    records = records[order]
+    # x1 of x, y, z, r, then y1, x2 and y2. the other 48 bytes repeat them
+    curves = records['interpolation'][:, :16].reshape(-1, 4, 4).transpose(0, 2, 1)
+    bones = BoneTracks(names, offsets, records['frame'].astype(numpy.uint32),
+                       records['pos'].astype(numpy.float32),
+                       records['rot'].astype(numpy.float32),
+                       (curves / 127.0).astype(numpy.float32))
+    logger.debug('%d bone keys', count)
+
+    count = _read_count(r)
+    records = r.read_array(MorphFrame, count)
+    names, offsets, order = _group(records)
+    records = records[order]
+    morphs = MorphTracks(names, offsets, records['frame'].astype(numpy.uint32),
+                         records['weight'].astype(numpy.float32))
+    logger.debug('%d morph keys', count)
+
+    # camera, light and shadow keys are not read
+    return Motion(path, header.model, bones, morphs)
+
+
+def load(path: pathlib.Path)->Optional[Motion]:
+    return load_bytes(path.read_bytes(), path)
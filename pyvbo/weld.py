@@ -0,0 +1,105 @@
+'''
+merge duplicated vertices and rewrite the indices
+
+keys are the vertex record bytes. with epsilon, float attributes are
+rounded to multiples of epsilon first, so values within epsilon usually
+merge (two values on each side of a grid line do not).
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+from typing import Tuple
+
+import numpy
+
+from . import model
+from . import pmd
+
+
+class WeldReport:
+    def __init__(self, vertices_before: int, vertices_after: int,
+                 vertex_size: int)->None:
+        self.vertices_before = vertices_before
+        self.vertices_after = vertices_after
+        self.vertex_size = vertex_size
+
+    @property
+    def saved_bytes(self)->int:
+        return (self.vertices_before - self.vertices_after) * self.vertex_size
+
+    @property
+    def ratio(self)->float:
+        return self.vertices_after / self.vertices_before if self.vertices_before else 1.0
+
+    def __repr__(self):
+        return (f'{{Weld {self.vertices_before} -> {self.vertices_after} vertices, '
+                f'-{(1.0 - self.ratio) * 100:.1f}%, {self.saved_bytes} bytes}}')
+
+
+def vertex_keys(records: numpy.ndarray, epsilon=0.0)->numpy.ndarray:
+    '''
+    one fixed size bytes key per record of a structured array
+    '''
+    n = len(records)
+    columns = []
+    for name in records.dtype.names:
+        values = records[name]
+        if values.dtype.kind == 'f':
+            if epsilon > 0:
+                values = numpy.rint(values / epsilon).astype(numpy.int64)
+            else:
+                # -0.0 == 0.0
+                values = values + values.dtype.type(0)
+        columns.append(numpy.ascontiguousarray(values).view(numpy.uint8).reshape(n, -1))
+    return extra_keys(numpy.concatenate(columns, axis=1))
+
+
+def extra_keys(*arrays: numpy.ndarray)->numpy.ndarray:
+    '''
+    per vertex arrays to bytes keys. (n, width) void
+    '''
+    n = len(arrays[0])
+    data = numpy.ascontiguousarray(numpy.concatenate(
+        [numpy.ascontiguousarray(x).view(numpy.uint8).reshape(n, -1) for x in arrays],
+        axis=1))
+    return data.view(numpy.dtype((numpy.void, data.shape[1]))).reshape(n)
+
+
+def weld_keys(keys: numpy.ndarray)->Tuple[numpy.ndarray, numpy.ndarray]:
+    '''
+    returns (kept vertices in the original order, old to new index)
+    '''
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    order = numpy.argsort(first, kind='stable')
+    rank = numpy.empty(len(order), numpy.int64)
+    rank[order] = numpy.arange(len(order))
+    return first[order], rank[inverse.reshape(-1)]
+
+
+def _index_dtype(dtype: numpy.dtype, vertex_count: int)->numpy.dtype:
+    if dtype.itemsize > 2 and vertex_count <= 65536:
+        return numpy.dtype(numpy.uint16)
+    return dtype
+
+
+def weld(m: model.Model, epsilon=0.0)->WeldReport:
+    '''
+    in place. indices of m.lods are rewritten too.
+    '''
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    keys = vertex_keys(records, epsilon)
+    extra = m.vertex_key_arrays()
+    if extra:
+        keys = extra_keys(keys, *extra)
+    keep, remap = weld_keys(keys)
+
+    report = WeldReport(len(records), len(keep), records.dtype.itemsize)
+    if len(keep) < len(records):
+        indices = numpy.asarray(m.indices)
+        dtype = _index_dtype(indices.dtype, len(keep))
+        m.select_vertices(keep)
+        m.indices = remap[indices].astype(dtype)
+        for x in m.lods:
+            x.indices = remap[x.indices].astype(dtype)
+    logger.info('%s: %s', m.metadata.name, report)
+    return report
@@ -5,3 +5,7 @@ from .glsl import ShaderProgram
 from .camera import Camera
 from .rendercontext import RenderContext
 from .texture import Texture
+from .texturecache import TextureCache, TEXTURE_CACHE
+from .atlas import AtlasConfig
+from .loader import AsyncLoader, LoadTask, load_drawer
+from .repack import Quantization
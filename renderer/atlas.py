@@ -0,0 +1,320 @@
+'''
+texture atlas for small textures
+
+textures up to AtlasConfig.max_texture_size are packed into pages by a
+skyline bottom-left packer, with a border of repeated edge texels. the uvs
+of the materials that use them are rewritten into the page, so the
+materials share one texture and neighbors can be drawn as one.
+
+* only materials whose uvs stay in [0, 1] are packed. repeating uvs need
+  their own texture.
+* a vertex shared by materials with different textures is duplicated.
+* mip levels of a page stop before the border is averaged away.
+
+the layout is made from the image headers. only the packed textures are
+decoded, through TEXTURE_CACHE, when the page is built. with lazy, on the
+first bind of the page.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import concurrent.futures
+import hashlib
+import math
+import pathlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy
+
+import pyvbo.model
+from pyvbo import pmd
+from pyvbo.optimize import material_ranges
+from .texture import ImageData, Texture
+from .texturecache import TEXTURE_CACHE, image_size, texture_key
+from . import mipmap
+
+# uv tolerance of the [0, 1] test
+UV_EPSILON = 1e-3
+
+
+class AtlasConfig:
+    '''
+    max_texture_size: textures up to this size are packed
+    page_size: width and max height of a page
+    padding: border texels around each texture
+    '''
+
+    def __init__(self, max_texture_size=256, page_size=2048, padding=4)->None:
+        self.max_texture_size = max_texture_size
+        self.page_size = page_size
+        self.padding = padding
+
+    @property
+    def key(self)->str:
+        return f'atlas{self.max_texture_size}:{self.page_size}:{self.padding}'
+
+
+class Atlas:
+    '''
+    pages: Texture of each page
+    material_pages: page of each material or -1
+    '''
+
+    def __init__(self, pages: List[Texture], material_pages: List[int])->None:
+        self.pages = pages
+        self.material_pages = material_pages
+
+    def __repr__(self):
+        packed = sum(1 for x in self.material_pages if x >= 0)
+        return f'{{Atlas {len(self.pages)} pages, {packed} materials}}'
+
+
+class SkylinePacker:
+    '''
+    bottom-left skyline. the skyline is (x, y, width) segments
+    '''
+
+    def __init__(self, width: int, height: int)->None:
+        self.width = width
+        self.height = height
+        self.skyline: List[Tuple[int, int, int]] = [(0, 0, width)]
+
+    @property
+    def used_height(self)->int:
+        return max(y for _, y, _ in self.skyline)
+
+    def _fit(self, i: int, w: int, h: int)->Optional[int]:
+        x = self.skyline[i][0]
+        if x + w > self.width:
+            return None
+        y = 0
+        remaining = w
+        while remaining > 0:
+            if i >= len(self.skyline):
+                return None
+            y = max(y, self.skyline[i][1])
+            if y + h > self.height:
+                return None
+            remaining -= self.skyline[i][2]
+            i += 1
+        return y
+
+    def insert(self, w: int, h: int)->Optional[Tuple[int, int]]:
+        '''
+        (x, y) or None if it does not fit
+        '''
+        best = None
+        for i, (x, _, _) in enumerate(self.skyline):
+            y = self._fit(i, w, h)
+            if y is not None and (best is None or (y + h, x) < best[0]):
+                best = ((y + h, x), i, x, y)
+        if not best:
+            return None
+        _, i, x, y = best
+
+        end = x + w
+        skyline = self.skyline[:i] + [(x, y + h, w)]
+        for sx, sy, sw in self.skyline[i:]:
+            if sx + sw <= end:
+                continue
+            if sx < end:
+                skyline.append((end, sy, sx + sw - end))
+            else:
+                skyline.append((sx, sy, sw))
+        merged: List[Tuple[int, int, int]] = []
+        for segment in skyline:
+            if merged and merged[-1][1] == segment[1]:
+                merged[-1] = (merged[-1][0], segment[1], merged[-1][2] + segment[2])
+            else:
+                merged.append(segment)
+        self.skyline = merged
+        return x, y
+
+
+def pack(sizes: List[Tuple[int, int]], page_size: int
+         )->Tuple[List[Tuple[int, int, int]], List[SkylinePacker]]:
+    '''
+    sizes: (w, h) of each rect.
+    returns ((page, x, y) of each rect, packer of each page)
+    '''
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    packers: List[SkylinePacker] = []
+    placements: List[Tuple[int, int, int]] = [(0, 0, 0)] * len(sizes)
+    for i in order:
+        w, h = sizes[i]
+        for page, packer in enumerate(packers):
+            position = packer.insert(w, h)
+            if position:
+                break
+        else:
+            packers.append(SkylinePacker(page_size, page_size))
+            page = len(packers) - 1
+            position = packers[page].insert(w, h)
+            if not position:
+                raise ValueError(f'{w}x{h} does not fit in a page of {page_size}')
+        placements[i] = (page, *position)
+    return placements, packers
+
+
+def _page_image(pixels: numpy.ndarray, padding: int)->ImageData:
+    height, width = pixels.shape[:2]
+    if not TEXTURE_CACHE.mipmaps:
+        return width, height, pixels.tobytes(), 1
+    w, h, chain, levels = mipmap.build(width, height, pixels.tobytes(),
+                                       None, True, TEXTURE_CACHE.kernel)
+    # a level whose border is less than a texel bleeds the neighbors
+    levels = min(levels, int(math.log2(max(padding, 1))) + 1)
+    chain = chain[:sum(x * y * 4 for x, y in mipmap.level_sizes(w, h, levels))]
+    return w, h, chain, levels
+
+
+def _page_source(width: int, height: int, padding: int,
+                 tiles: List[Tuple[pathlib.Path, Tuple[int, int], Tuple[int, int]]],
+                 executor: concurrent.futures.Executor=None
+                 )->Callable[[], Optional[ImageData]]:
+    '''
+    tiles: (resolved path, (w, h), (x, y) of the border) of the textures of a page
+    '''
+    def source()->Optional[ImageData]:
+        pixels = numpy.zeros((height, width, 4), numpy.uint8)
+        textures = TEXTURE_CACHE.acquire_files([x for x, _, _ in tiles], executor)
+        try:
+            for texture_file, (w, h), (x, y) in tiles:
+                image = textures[texture_file].get_image()
+                if not image or image[:2] != (w, h):
+                    # changed after the layout
+                    logger.warning('%s: not %dx%d', texture_file, w, h)
+                    continue
+                # level 0 of the mip chain
+                tile = numpy.frombuffer(image[2], numpy.uint8)[:w * h * 4].reshape(h, w, 4)
+                tile = numpy.pad(tile, ((padding, padding), (padding, padding), (0, 0)),
+                                 mode='edge')
+                pixels[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+        finally:
+            for texture in textures.values():
+                TEXTURE_CACHE.release(texture)
+        return _page_image(pixels, padding)
+    return source
+
+
+def build_atlas(m: pyvbo.model.Model, config: AtlasConfig,
+                executor: concurrent.futures.Executor=None, lazy=False)->Optional[Atlas]:
+    '''
+    rewrites m.vertices, m.indices and the m.lods indices in place.
+    None if less than two textures can be packed.
+    lazy: build the pages on first bind
+    '''
+    texture_files = [m.texture_path(x) for x in m.materials]
+    texture_files = [x.resolve() if x else None for x in texture_files]
+    # size after the clamp of TEXTURE_CACHE
+    sizes: Dict[pathlib.Path, Optional[Tuple[int, int]]] = {}
+    for texture_file in texture_files:
+        if texture_file and texture_file not in sizes:
+            size = image_size(texture_file)
+            sizes[texture_file] = mipmap.clamp_size(
+                *size, TEXTURE_CACHE.max_size) if size else None
+
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    indices = numpy.asarray(m.indices).astype(numpy.int64)
+    ranges = material_ranges(m.materials, len(indices))
+
+    # texture of each material in the atlas or -1
+    textures: List[pathlib.Path] = []
+    material_textures = []
+    for (begin, end), texture_file in zip(ranges, texture_files):
+        size = sizes.get(texture_file) if texture_file else None
+        packed = -1
+        if size and begin < end and max(size) <= config.max_texture_size:
+            uv = records['uv'][indices[begin:end]]
+            if uv.min() >= -UV_EPSILON and uv.max() <= 1.0 + UV_EPSILON:
+                if texture_file not in textures:
+                    textures.append(texture_file)
+                packed = textures.index(texture_file)
+        material_textures.append(packed)
+    if len(textures) < 2:
+        return None
+
+    padding = config.padding
+    placements, packers = pack(
+        [(sizes[x][0] + padding * 2, sizes[x][1] + padding * 2) for x in textures],
+        config.page_size)
+    # crop the pages to the used height
+    page_heights = [1 << max(0, math.ceil(math.log2(max(x.used_height, 1))))
+                    for x in packers]
+    tiles: List[list] = [[] for _ in packers]
+    transforms = []
+    for texture_file, (page, x, y) in zip(textures, placements):
+        w, h = sizes[texture_file]
+        tiles[page].append((texture_file, (w, h), (x, y)))
+        page_height = page_heights[page]
+        transforms.append((w / config.page_size, h / page_height,
+                           (x + padding) / config.page_size, (y + padding) / page_height))
+
+    # shared by the drawers of the same textures
+    digest = hashlib.sha1('\n'.join(texture_key(x, TEXTURE_CACHE.format) or str(x)
+                                    for x in textures).encode('utf-8'))
+    digest.update(config.key.encode('utf-8'))
+    page_textures = []
+    for i, page_height in enumerate(page_heights):
+        key = f'{TEXTURE_CACHE.format}:atlas:{digest.hexdigest()}:{i}'
+        source = _page_source(config.page_size, page_height, padding, tiles[i],
+                              None if lazy else executor)
+        # the source builds the page again after the upload drops it
+        page_textures.append(TEXTURE_CACHE.acquire(
+            key, (lambda: None) if lazy else source, source))
+
+    # one copy of a vertex per texture transform (-1 is none)
+    vertex_count = len(records)
+    owner = numpy.full(vertex_count, -2, numpy.int64)
+    copies: Dict[int, numpy.ndarray] = {}
+    sources: List[numpy.ndarray] = []
+    source_owners: List[numpy.ndarray] = []
+    added = 0
+
+    def remap(values: numpy.ndarray, texture: int)->numpy.ndarray:
+        nonlocal added
+        ids = numpy.unique(values)
+        owner[ids[owner[ids] == -2]] = texture
+        if texture not in copies:
+            copies[texture] = numpy.full(vertex_count, -1, numpy.int64)
+        copy = copies[texture]
+        other = ids[(owner[ids] != texture) & (copy[ids] < 0)]
+        if len(other):
+            copy[other] = vertex_count + added + numpy.arange(len(other))
+            added += len(other)
+            sources.append(other)
+            source_owners.append(numpy.full(len(other), texture, numpy.int64))
+        return numpy.where(owner[values] == texture, values, copy[values])
+
+    for (begin, end), texture in zip(ranges, material_textures):
+        indices[begin:end] = remap(indices[begin:end], texture)
+    for lod in m.lods:
+        lod_indices = numpy.asarray(lod.indices).astype(numpy.int64)
+        begin = 0
+        for count, texture in zip(lod.index_counts, material_textures):
+            lod_indices[begin:begin + count] = remap(lod_indices[begin:begin + count], texture)
+            begin += count
+        lod.indices = lod_indices
+
+    if sources:
+        m.select_vertices(numpy.concatenate([numpy.arange(vertex_count)] + sources))
+        owner = numpy.concatenate([owner] + source_owners)
+    else:
+        m.select_vertices(numpy.arange(vertex_count))
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    uv = records['uv']
+    for texture, (su, sv, ou, ov) in enumerate(transforms):
+        mask = owner == texture
+        uv[mask] = numpy.clip(uv[mask], 0.0, 1.0) * (su, sv) + (ou, ov)
+
+    dtype = numpy.asarray(m.indices).dtype
+    if len(records) > 65536 and dtype.itemsize < 4:
+        dtype = numpy.dtype(numpy.uint32)
+    m.indices = indices.astype(dtype)
+    for lod in m.lods:
+        lod.indices = lod.indices.astype(dtype)
+
+    atlas = Atlas(page_textures,
+                  [placements[x][0] if x >= 0 else -1 for x in material_textures])
+    logger.info('%s: %s. %d vertices duplicated', m.metadata.name, atlas, added)
+    return atlas
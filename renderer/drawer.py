@@ -2,32 +2,58 @@
 from logging import getLogger
 logger = getLogger(__name__)
 
+import bisect
+import concurrent.futures
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy
 from OpenGL.GL import *
 
-from .vbo import ArrayVBO, ArrayVBOIndex, CtypesVBO
+from .vbo import ArrayVBO, ArrayVBOIndex, get_typecode
 from .texture import Texture
+from .texturecache import TEXTURE_CACHE
+from .atlas import AtlasConfig, build_atlas
 from .vertexbuffer import Topology, AttributeLayout, Semantics, MeshBuilder
 from .rendercontext import RenderContext
 from .glsl import ShaderProgram
-from pyvbo import pmd
-from PIL import Image
+from .repack import (PackedVertices, Quantization,
+                     builder_records, repack, repack_records)
+import lah
+import pyvbo.model
+from pyvbo import cache
+from pyvbo.bounds import Bounds, frustum_planes, merge, spheres_in_frustum
+from pyvbo.meshlet import Meshlet, MeshletCuller
+
+
+GLTF_SEMANTICS = {
+    Semantics.POSITION: 'POSITION',
+    Semantics.NORMAL: 'NORMAL',
+    Semantics.COLOR: 'COLOR_0',
+    Semantics.TEXCOORD: 'TEXCOORD_0',
+}
 
 
 class SubMesh:
-    def __init__(self, shader, index_count, color, texture):
+    def __init__(self, shader, index_count, color, texture,
+                 bounds: Optional[Bounds]=None):
         self.shader = shader
         self.index_count = index_count
         self.color = color
         self.texture = texture
+        self.bounds = bounds
 
-    def apply_shader(self, context: RenderContext):
+    def apply_shader(self, context: RenderContext, bind_texture=True):
+        '''
+        bind_texture: false if the texture is bound already
+        '''
         self.shader.use()
         self.shader.set_uniform_mat4('uM', context.model.array)
         self.shader.set_uniform_mat4('uV', context.view.array)
         self.shader.set_uniform_mat4('uVM', context.mv.array)
         self.shader.set_uniform_mat4('uPVM', context.mvp.array)
         self.shader.set_uniform_vec3('uLightDir', context.lightDir.array)
-        if self.texture:
+        if self.texture and bind_texture:
             self.texture.bind()
             self.shader.set_uniform_texture('uTex0', 0)
         self.shader.set_uniform_vec4('uColor', context.color)
@@ -39,6 +65,26 @@ class Drawer:
         self.vertices = None
         self.layout = None
         self.stride = 0
+        # (scale, x, y, z) of int16 quantized positions
+        self.dequantize = None
+        # (index offset, index count per submesh) of each simplified level
+        self.lods: List[Tuple[int, List[int]]] = []
+        # level to draw. or by the view distance if lod_distances
+        self.lod = 0
+        self.lod_distances: List[float] = []
+        self.bounds: Optional[Bounds] = None
+        # per meshlet frustum culling of the base level
+        self.culler: Optional[MeshletCuller] = None
+        self.cull_meshlets = True
+        # normal cone test of the meshlets. only with GL_CULL_FACE, the
+        # back faces of double sided materials are drawn otherwise
+        self.cull_backfacing = False
+        # skip submeshes out of the frustum by SubMesh.bounds. their
+        # textures are not bound, so lazy ones are not decoded
+        self.cull_submeshes = True
+        self._spheres: Optional[Tuple[numpy.ndarray, numpy.ndarray]] = None
+        # cache.file_stamps of the texture files. stale cache files are a miss
+        self.sources: List[Tuple[str, Optional[int]]] = []
         self.vao = None
         self._topology = None
         self._gl_topology = None
@@ -58,13 +104,28 @@ class Drawer:
         else:
             raise Exception("unknown topology")
 
+    def set_packed(self, packed: PackedVertices)->None:
+        self.vertices = ArrayVBO(packed.data)
+        self.layout = packed.layout
+        self.stride = packed.stride
+        self.dequantize = packed.dequantize
+        if packed.errors:
+            logger.info('quantization error %s', packed.errors)
+
     @staticmethod
-    def from_builder(builder: MeshBuilder, shader: ShaderProgram):
+    def from_builder(builder: MeshBuilder, shader: ShaderProgram,
+                     quantization: Optional[Quantization]=None):
         self = Drawer()
         self.indices = ArrayVBOIndex(builder.indices)
-        self.vertices = ArrayVBO(builder.vertices)
-        self.layout = builder.layout
-        self.stride = builder.stride
+        if quantization:
+            self.set_packed(repack_records(
+                builder_records(builder.vertices, builder.layout, builder.stride),
+                {x.semantics: x.semantics.name for x in builder.layout},
+                builder.layout, quantization))
+        else:
+            self.vertices = ArrayVBO(builder.vertices)
+            self.layout = builder.layout
+            self.stride = builder.stride
         self.topology = builder.topology
         self.submeshes = [
             SubMesh(shader, len(self.indices.data), (1, 1, 1, 1), Texture())
@@ -72,34 +133,260 @@ class Drawer:
         return self
 
     @staticmethod
-    def from_pmd(model: pmd.Model, shader: ShaderProgram):
+    def from_pmd(model: pyvbo.model.Model, shader: ShaderProgram,
+                 quantization: Optional[Quantization]=None, lazy_textures=False,
+                 atlas: Optional[AtlasConfig]=None):
+        '''
+        upload only the attributes of the shader, repacked.
+        lazy_textures: decode on first draw instead of now
+        atlas: pack the small textures and merge the submeshes that share
+               a page. rewrites the uvs of model
+        '''
+        self = Drawer()
+        overrides: Dict[int, Texture] = {}
+        if atlas:
+            packed = build_atlas(model, atlas, lazy=lazy_textures)
+            if packed:
+                overrides = {i: packed.pages[x]
+                             for i, x in enumerate(packed.material_pages) if x >= 0}
+        if model.lods:
+            # levels follow the base indices in one buffer
+            base = numpy.asarray(model.indices)
+            offset = len(base)
+            for x in model.lods:
+                self.lods.append((offset, x.index_counts))
+                offset += len(x.indices)
+            self.indices = ArrayVBOIndex(numpy.concatenate(
+                [base] + [x.indices for x in model.lods]).astype(base.dtype))
+        else:
+            self.indices = ArrayVBOIndex(model.indices)
+        self.set_packed(repack(model.vertices, shader.vertex_layout, quantization))
+        if model.meshlets:
+            self.culler = MeshletCuller(model.meshlets)
+        self.topology = Topology.Triangle
+
+        self.submeshes = Drawer.create_submeshes(
+            model, shader, lazy_textures=lazy_textures, overrides=overrides)
+        if overrides and not self.lods and not self.culler:
+            # lods and meshlets index the submeshes
+            self.merge_submeshes()
+        self.bounds = model.bounds
+        return self
+
+    @staticmethod
+    def create_submeshes(model: pyvbo.model.Model, shader: ShaderProgram,
+                         executor: concurrent.futures.Executor=None, lazy_textures=False,
+                         overrides: Optional[Dict[int, Texture]]=None):
+        '''
+        textures come from TEXTURE_CACHE. misses are decoded in parallel.
+        submeshes that use the same file share the Texture, and so do other
+        drawers. Drawer.release returns them.
+        overrides: texture of a material instead of its file. ex. an atlas page
+        '''
+        overrides = overrides or {}
+        texture_files = [model.texture_path(x) if i not in overrides else None
+                         for i, x in enumerate(model.materials)]
+        textures = TEXTURE_CACHE.acquire_files(
+            [x for x in texture_files if x], executor, lazy_textures)
+
+        def get_texture(i: int, texture_file: Optional[pathlib.Path])->Texture:
+            if i in overrides:
+                return overrides[i]
+            if not texture_file:
+                return Texture()
+            return textures[texture_file.resolve()]
+
+        material_bounds = model.material_bounds or [None] * len(model.materials)
+        return [SubMesh(shader, material.index_count, material.color,
+                        get_texture(i, texture_file), bounds)
+                for i, (material, texture_file, bounds)
+                in enumerate(zip(model.materials, texture_files, material_bounds))]
+
+    def merge_submeshes(self)->None:
+        '''
+        neighbors with the same texture and color are drawn as one.
+        not with lods or meshlets, which index the submeshes
+        '''
+        assert not self.lods and not self.culler
+        merged: List[SubMesh] = []
+        for x in self.submeshes:
+            last = merged[-1] if merged else None
+            if (last and last.shader is x.shader and last.texture is x.texture
+                    and tuple(last.color) == tuple(x.color)):
+                # without bounds is always visible
+                bounds = merge([last.bounds, x.bounds]) if last.bounds and x.bounds else None
+                merged[-1] = SubMesh(x.shader, last.index_count + x.index_count,
+                                     last.color, x.texture, bounds)
+            else:
+                merged.append(x)
+        if len(merged) < len(self.submeshes):
+            logger.info('merge %d submeshes into %d', len(self.submeshes), len(merged))
+        self.submeshes = merged
+        self._spheres = None
+
+    @staticmethod
+    def from_gltf(model, shader: ShaderProgram,
+                  quantization: Optional[Quantization]=None, lazy_textures=False,
+                  atlas: Optional[AtlasConfig]=None):
+        '''
+        upload the glTF bufferViews as is when all primitives share one
+        interleaved vertex range that has the shader attributes and their
+        indices are contiguous. otherwise same as from_pmd.
+        '''
+        primitives = model.primitives
+        if (not primitives or quantization or model.is_merged
+                or model.lods or model.meshlets or atlas):
+            return Drawer.from_pmd(model, shader, quantization, lazy_textures, atlas)
+
+        first = primitives[0]
+        accessors = []
+        for x in shader.vertex_layout:
+            accessor = first.attributes.get(GLTF_SEMANTICS.get(x.semantics))
+            if (not accessor or accessor.dtype.kind != 'f'
+                    or accessor.elements != x.value_elements):
+                return Drawer.from_pmd(model, shader, lazy_textures=lazy_textures)
+            accessors.append(accessor)
+        if len({x.buffer_view for x in accessors}) != 1 or accessors[0].buffer_view < 0:
+            # -1 is zeros, not in a bufferView
+            return Drawer.from_pmd(model, shader, lazy_textures=lazy_textures)
+        stride = accessors[0].byte_stride
+        base = min(x.byte_offset for x in accessors)
+        if any(x.byte_offset - base >= stride for x in accessors):
+            return Drawer.from_pmd(model, shader, lazy_textures=lazy_textures)
+
+        index_end = None
+        for primitive in primitives:
+            if any(primitive.attributes.get(GLTF_SEMANTICS[x.semantics]) is not a
+                   for x, a in zip(shader.vertex_layout, accessors)):
+                return Drawer.from_pmd(model, shader, lazy_textures=lazy_textures)
+            indices = primitive.indices
+            if (not indices or indices.buffer_view < 0
+                    or indices.buffer_view != first.indices.buffer_view
+                    or indices.dtype != first.indices.dtype
+                    or (index_end is not None and indices.byte_offset != index_end)):
+                return Drawer.from_pmd(model, shader, lazy_textures=lazy_textures)
+            index_end = indices.byte_offset + indices.count * indices.dtype.itemsize
+
+        logger.debug('upload interleaved bufferView without repacking')
+        document = model.document
+        self = Drawer()
+        index_view = document.buffer_view(first.indices.buffer_view)
+        self.indices = ArrayVBOIndex(
+            index_view[first.indices.byte_offset:index_end].cast(
+                first.indices.dtype.char))
+        self.vertices = ArrayVBO(
+            document.buffer_view(accessors[0].buffer_view)[base:])
+        self.layout = [AttributeLayout(x.semantics, 'f', x.value_elements,
+                                       a.byte_offset - base)
+                       for x, a in zip(shader.vertex_layout, accessors)]
+        self.stride = stride
+        self.topology = Topology.Triangle
+        self.submeshes = Drawer.create_submeshes(model, shader, lazy_textures=lazy_textures)
+        self.bounds = model.bounds
+        return self
+
+    @staticmethod
+    def cache_key(source_hash: str, shader: ShaderProgram,
+                  quantization: Optional[Quantization]=None, pipeline_key='',
+                  atlas: Optional[AtlasConfig]=None)->str:
+        key = cache.layout_key(
+            (cache.Attribute(x.semantics.name, x.value_type, x.value_elements, x.offset)
+             for x in shader.vertex_layout), shader.vertex_stride)
+        if quantization:
+            key += '/' + quantization.key
+        if pipeline_key:
+            key += '/' + pipeline_key
+        if atlas:
+            key += '/' + atlas.key
+        # mip chains and size clamp of the textures
+        key += '/' + TEXTURE_CACHE.format
+        return cache.cache_key(source_hash, key)
+
+    @staticmethod
+    def from_cache(entry: cache.CacheEntry, shader: ShaderProgram):
         self = Drawer()
-        self.indices = ArrayVBOIndex(model.indices)
-        self.vertices = CtypesVBO(model.vertices)
-        self.layout = shader.vertex_layout
-        self.stride = shader.vertex_stride
+        self.indices = ArrayVBOIndex(entry.indices)
+        self.vertices = ArrayVBO(entry.vertices)
+        self.layout = [AttributeLayout(Semantics[x.semantics], x.value_type,
+                                       x.value_elements, x.offset, x.normalized)
+                       for x in entry.layout]
+        self.stride = entry.stride
+        self.dequantize = entry.dequantize
+        self.lods = entry.lods
+        if entry.meshlets:
+            self.culler = MeshletCuller(
+                [Meshlet.from_list(x) for x in entry.meshlets])
+        self.bounds = Bounds.from_list(entry.bounds) if entry.bounds else None
         self.topology = Topology.Triangle
+        self.sources = entry.sources
 
-        def create_submesh(material):
-            texture = Texture()
-            if material.texture:
-                texture_name = material.texture.decode('cp932')
-                if '*' in texture_name:
-                    texture_name, _ = texture_name.split('*', 1)
-                texture_file = model.metadata.base_path / texture_name
-                if texture_file.exists():
-                    logger.debug("%s exists", texture_file)
-                    with texture_file.open('rb') as f:
-                        image = Image.open(f)
-                        image = image.convert('RGBA')
-                    texture.create_texture(
-                        image.width, image.height, image.tobytes())
-                else:
-                    logger.warning("%s not exists", texture_file)
-            return SubMesh(shader, material.index_count, material.color, texture)
-        self.submeshes = [create_submesh(x) for x in model.materials]
+        textures = []
+        for x in entry.textures:
+            if x.name:
+                # shared with the drawers of the same file
+                texture = TEXTURE_CACHE.acquire_pixels(
+                    x.name, x.width, x.height, x.pixels, x.levels)
+            else:
+                texture = Texture()
+                texture.create_texture(x.width, x.height, x.pixels, x.levels)
+            textures.append(texture)
+        self.submeshes = [
+            SubMesh(shader, x.index_count, x.color,
+                    textures[x.texture] if x.texture >= 0 else Texture(),
+                    Bounds.from_list(x.bounds) if x.bounds else None)
+            for x in entry.submeshes]
         return self
 
+    def release(self)->None:
+        '''
+        return the shared textures to TEXTURE_CACHE. the drawer is not
+        drawn after this
+        '''
+        released = set()
+        for x in self.submeshes:
+            if x.texture and id(x.texture) not in released:
+                released.add(id(x.texture))
+                TEXTURE_CACHE.release(x.texture)
+
+    def to_cache(self, name: str)->cache.CacheEntry:
+        '''
+        buffers as uploaded and decoded textures
+        '''
+        textures: List[cache.CacheTexture] = []
+        texture_map: Dict[int, int] = {}
+        submeshes = []
+        for x in self.submeshes:
+            texture_index = -1
+            if x.texture:
+                if id(x.texture) not in texture_map:
+                    # decodes a lazy texture
+                    image = x.texture.get_image()
+                    texture_map[id(x.texture)] = len(textures) if image else -1
+                    if image:
+                        w, h, data, levels = image
+                        textures.append(cache.CacheTexture(
+                            x.texture.key or '', w, h, data, levels))
+                texture_index = texture_map[id(x.texture)]
+            submeshes.append(cache.CacheSubMesh(
+                x.index_count, tuple(x.color), texture_index,
+                x.bounds.to_list() if x.bounds else None))
+        return cache.CacheEntry(
+            name,
+            [cache.Attribute(x.semantics.name, x.value_type, x.value_elements,
+                             x.offset, x.normalized)
+             for x in self.layout],
+            self.stride,
+            self.vertices.data,
+            self.indices.data,
+            get_typecode(self.indices.data),
+            submeshes,
+            textures,
+            self.dequantize,
+            self.lods,
+            self.bounds.to_list() if self.bounds else None,
+            [x.to_list() for x in self.culler.meshlets] if self.culler else [],
+            self.sources)
+
     def initialize(self):
         self.indices.initialize()
         self.vertices.initialize()
@@ -109,19 +396,90 @@ class Drawer:
         self.vertices.set_layouts(self.layout, self.stride)
         self.indices.setIndex()
 
+    def select_lod(self, context: RenderContext)->int:
+        if not self.lods:
+            return 0
+        if self.lod_distances:
+            # model origin in view space
+            x, y, z = context.mv.array[12:15]
+            level = bisect.bisect(self.lod_distances, (x * x + y * y + z * z) ** 0.5)
+        else:
+            level = self.lod
+        return max(0, min(level, len(self.lods)))
+
+    def visible_ranges(self, context: RenderContext)->List[Tuple[int, int, int]]:
+        '''
+        (submesh, index offset, index count) of the meshlets in the view
+        '''
+        mv = numpy.array(context.mv.array).reshape(4, 4)
+        mvp = numpy.array(context.mvp.array).reshape(4, 4)
+        camera = numpy.linalg.inv(mv)[3, :3]
+        return self.culler.ranges(self.culler.visible(mvp, camera, self.cull_backfacing))
+
+    def visible_submeshes(self, context: RenderContext)->List[bool]:
+        '''
+        bounding sphere in the view. true without bounds
+        '''
+        if self._spheres is None:
+            self._spheres = (
+                numpy.array([x.bounds.center if x.bounds else (0, 0, 0)
+                             for x in self.submeshes], numpy.float64).reshape(-1, 3),
+                numpy.array([x.bounds.radius if x.bounds else numpy.inf
+                             for x in self.submeshes], numpy.float64))
+        mvp = numpy.array(context.mvp.array).reshape(4, 4)
+        return spheres_in_frustum(frustum_planes(mvp), *self._spheres).tolist()
+
     def render(self, context: RenderContext):
         if not self.vao:
             self.initialize()
 
         glBindVertexArray(self.vao)
 
-        offset = 0
-        for x in self.submeshes:
-            # update material
-            context.set_submesh(x.color)
+        # in model space, before dequantize
+        level = self.select_lod(context)
+        ranges = None
+        visible = None
+        if not level and self.culler and self.cull_meshlets:
+            ranges = self.visible_ranges(context)
+        elif self.cull_submeshes:
+            visible = self.visible_submeshes(context)
+
+        if self.dequantize:
+            s, x, y, z = self.dequantize
+            context.set_local(lah.Mat4(s, 0, 0, 0,
+                                       0, s, 0, 0,
+                                       0, 0, s, 0,
+                                       x, y, z, 1))
+
+        if ranges is not None:
+            current = -1
+            bound = None
+            for material, offset, count in ranges:
+                x = self.submeshes[material]
+                if material != current:
+                    context.set_submesh(x.color)
+                    x.apply_shader(context, x.texture is not bound)
+                    bound = x.texture
+                    current = material
+                self.indices.drawIndex(self._gl_topology, offset, count)
+        else:
+            if level:
+                offset, counts = self.lods[level - 1]
+            else:
+                offset, counts = 0, [x.index_count for x in self.submeshes]
+            # submeshes of an atlas page share the texture
+            bound = None
+            for i, (x, count) in enumerate(zip(self.submeshes, counts)):
+                if count and (not visible or visible[i]):
+                    # update material
+                    context.set_submesh(x.color)
+
+                    x.apply_shader(context, x.texture is not bound)
+                    bound = x.texture
 
-            x.apply_shader(context)
+                    self.indices.drawIndex(self._gl_topology, offset, count)
+                offset += count
 
-            self.indices.drawIndex(self._gl_topology, offset, x.index_count)
-            offset += x.index_count
+        if self.dequantize:
+            context.set_local(None)
         #assert len(self.indices.data) == offset
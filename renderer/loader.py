@@ -0,0 +1,167 @@
+from logging import getLogger
+logger = getLogger(__name__)
+
+import concurrent.futures
+import pathlib
+import queue
+from typing import Callable, List, Optional, Tuple
+
+import pyvbo
+from pyvbo import cache, coordinate
+from pyvbo.pipeline import Pipeline
+from pyvbo.metadata import Coordinate
+from observable_property import Prop
+
+from .drawer import Drawer
+from .glsl import ShaderProgram
+from .repack import Quantization
+from .atlas import AtlasConfig
+
+ProgressCallback = Callable[[float, str], None]
+
+
+def load_drawer(path: pathlib.Path, shader: ShaderProgram,
+                cache_store: Optional[cache.CacheStore]=None,
+                progress: ProgressCallback=None,
+                quantization: Optional[Quantization]=None,
+                pipeline: Optional[Pipeline]=None,
+                lazy_textures=False,
+                atlas: Optional[AtlasConfig]=None)->Tuple[str, Drawer]:
+    '''
+    parse, convert and decode textures. no GL call, runs on any thread.
+    GL objects are created by Drawer.initialize on first render.
+
+    pipeline: weld, optimize, lods and meshlets. a part of the cache key,
+    so a viewer hits the cache files baked by convert.py with the same one.
+    lazy_textures: decode each texture on its first draw. writing the cache
+    decodes them anyway.
+    atlas: pack the small textures into shared pages. see renderer.atlas
+    '''
+    def report(value: float, message: str):
+        if progress:
+            progress(value, message)
+
+    key = None
+    if cache_store:
+        report(0.0, 'hash')
+        key = Drawer.cache_key(cache.content_hash(path), shader, quantization,
+                               pipeline.key if pipeline else '', atlas)
+        entry = cache_store.get(key)
+        if entry:
+            logger.info('cache hit %s', cache_store.path(key))
+            report(1.0, 'cache hit')
+            return entry.name, Drawer.from_cache(entry, shader)
+
+    report(0.1, 'parse')
+    model = pyvbo.load(path, use_mmap=True)
+    logger.info(model)
+
+    report(0.4, 'convert')
+    # meter, OpenGL axes. no-op for glTF, which keeps its zero copy views
+    coordinate.convert(model, Coordinate.YUP_ZBACKWARD)
+    if pipeline:
+        report(0.45, 'pipeline')
+        pipeline(model)
+    model.update_bounds()
+    # before the textures are decoded. an edit after it is a miss
+    sources = cache.file_stamps(model.texture_path(x) for x in model.materials)
+    if hasattr(model, 'primitives'):
+        mesh = Drawer.from_gltf(model, shader, quantization, lazy_textures, atlas)
+    else:
+        report(0.5, 'textures')
+        mesh = Drawer.from_pmd(model, shader, quantization, lazy_textures, atlas)
+    mesh.sources = sources
+
+    if cache_store:
+        report(0.9, 'write cache')
+        cache_store.put(key, mesh.to_cache(model.metadata.name))
+    report(1.0, 'done')
+    return model.metadata.name, mesh
+
+
+class LoadTask:
+    def __init__(self, path: pathlib.Path,
+                 on_loaded: Callable[['LoadTask'], None])->None:
+        self.path = path
+        self.on_loaded = on_loaded
+        self.progress = Prop[float](0.0)
+        self.status = Prop[str]('queued')
+        self.future: Optional[concurrent.futures.Future] = None
+        self.name: Optional[str] = None
+        self.mesh: Optional[Drawer] = None
+
+    def __repr__(self):
+        return f'{{LoadTask {self.path.name}: {self.status.value}}}'
+
+
+class AsyncLoader:
+    '''
+    runs load_drawer in a worker pool.
+    poll() is called from the render loop every frame. it forwards progress
+    to the observables and hands finished drawers to on_loaded on the render
+    thread, so the GL upload happens there on the next draw.
+    '''
+
+    def __init__(self, shader: ShaderProgram,
+                 cache_store: Optional[cache.CacheStore]=None,
+                 max_workers: Optional[int]=None,
+                 quantization: Optional[Quantization]=None,
+                 pipeline: Optional[Pipeline]=None,
+                 lazy_textures=False,
+                 atlas: Optional[AtlasConfig]=None)->None:
+        self.shader = shader
+        self.cache_store = cache_store
+        self.quantization = quantization
+        self.pipeline = pipeline
+        self.lazy_textures = lazy_textures
+        self.atlas = atlas
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='loader')
+        self.tasks: List[LoadTask] = []
+        self.queue: queue.Queue = queue.Queue()
+        self.loading = Prop[int](0)
+
+    def load(self, path: pathlib.Path,
+             on_loaded: Callable[[LoadTask], None])->LoadTask:
+        task = LoadTask(path, on_loaded)
+
+        def progress(value: float, message: str):
+            # from a worker. applied in poll
+            self.queue.put((task, value, message))
+
+        task.future = self.executor.submit(
+            load_drawer, path, self.shader, self.cache_store, progress,
+            self.quantization, self.pipeline, self.lazy_textures, self.atlas)
+        self.tasks.append(task)
+        self.loading.value = len(self.tasks)
+        return task
+
+    def poll(self)->None:
+        while True:
+            try:
+                task, value, message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            task.progress.value = value
+            task.status.value = message
+
+        if not self.tasks:
+            return
+        running = []
+        for task in self.tasks:
+            if not task.future.done():
+                running.append(task)
+                continue
+            try:
+                task.name, task.mesh = task.future.result()
+            except Exception as ex:  # pylint: disable=W0703
+                logger.error('load %s: %s', task.path, ex)
+                task.status.value = 'failed'
+                continue
+            task.progress.value = 1.0
+            task.on_loaded(task)
+        self.tasks = running
+        self.loading.value = len(self.tasks)
+
+    def shutdown(self)->None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,126 @@
+'''
+mip chains of RGBA8 images with numpy
+
+each level halves the previous one (floor, at least 1) like GL expects.
+filters are separable: 'box' averages 2x2, 'lanczos' is lanczos3.
+filtering is done on premultiplied alpha, so transparent texels do not
+bleed their color.
+
+the chain is one buffer, level 0 first, so it can be stored and mapped
+as a single blob.
+'''
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+
+FILTERS = ('box', 'lanczos')
+
+LANCZOS_A = 3
+
+_kernels: Dict[str, Tuple[numpy.ndarray, numpy.ndarray]] = {}
+
+
+def _kernel(name: str)->Tuple[numpy.ndarray, numpy.ndarray]:
+    '''
+    (offsets, weights) of a 2:1 reduction. output i reads input 2i + offset
+    '''
+    if name not in _kernels:
+        if name == 'box':
+            offsets = numpy.array([0, 1])
+            weights = numpy.array([0.5, 0.5])
+        elif name == 'lanczos':
+            offsets = numpy.arange(-2 * LANCZOS_A + 1, 2 * LANCZOS_A + 1)
+            # distance from the output texel center, in output texels
+            x = (offsets - 0.5) / 2
+            weights = numpy.sinc(x) * numpy.sinc(x / LANCZOS_A)
+            weights /= weights.sum()
+        else:
+            raise ValueError(f'unknown filter: {name}')
+        _kernels[name] = (offsets, weights)
+    return _kernels[name]
+
+
+def _reduce_axis(image: numpy.ndarray, axis: int, kernel: str)->numpy.ndarray:
+    n = image.shape[axis]
+    if n == 1:
+        return image
+    m = n // 2
+    if kernel == 'box':
+        even = [slice(None)] * image.ndim
+        odd = [slice(None)] * image.ndim
+        even[axis] = slice(0, m * 2, 2)
+        odd[axis] = slice(1, m * 2, 2)
+        return (image[tuple(even)] + image[tuple(odd)]) * 0.5
+    offsets, weights = _kernel(kernel)
+    result = None
+    for offset, weight in zip(offsets.tolist(), weights.tolist()):
+        # clamp to edge
+        indices = numpy.clip(numpy.arange(m) * 2 + offset, 0, n - 1)
+        value = numpy.take(image, indices, axis=axis) * weight
+        result = value if result is None else result + value
+    return result
+
+
+def level_sizes(width: int, height: int, levels: int)->List[Tuple[int, int]]:
+    sizes = []
+    for _ in range(levels):
+        sizes.append((width, height))
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return sizes
+
+
+def clamp_size(width: int, height: int, max_size: Optional[int])->Tuple[int, int]:
+    '''
+    size of level 0 after build with max_size
+    '''
+    while max_size and max(width, height) > max_size:
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return width, height
+
+
+def level_count(width: int, height: int)->int:
+    return int(math.floor(math.log2(max(width, height, 1)))) + 1
+
+
+def reduce(image: numpy.ndarray, kernel='box')->numpy.ndarray:
+    '''
+    image: (h, w, 4) float32 premultiplied. half size
+    '''
+    return _reduce_axis(_reduce_axis(image, 0, kernel), 1, kernel)
+
+
+def _premultiplied(pixels, width: int, height: int)->numpy.ndarray:
+    image = numpy.frombuffer(pixels, numpy.uint8).reshape(height, width, 4).astype(numpy.float32)
+    image[..., :3] *= image[..., 3:] / 255.0
+    return image
+
+
+def _to_rgba8(image: numpy.ndarray)->numpy.ndarray:
+    alpha = image[..., 3:]
+    rgb = numpy.where(alpha > 0, image[..., :3] * 255.0 / numpy.maximum(alpha, 1e-6), 0)
+    return numpy.clip(numpy.rint(numpy.concatenate([rgb, alpha], axis=-1)),
+                      0, 255).astype(numpy.uint8)
+
+
+def build(width: int, height: int, pixels, max_size: Optional[int]=None,
+          mipmaps=True, kernel='box')->Tuple[int, int, bytes, int]:
+    '''
+    pixels: RGBA8 of level 0.
+    max_size: halve level 0 until it fits.
+    returns (width, height, chain, levels). chain is level 0 to the last level.
+    '''
+    if (not max_size or max(width, height) <= max_size) and not mipmaps:
+        return width, height, pixels, 1
+    image = _premultiplied(pixels, width, height)
+    while max_size and max(image.shape[0], image.shape[1]) > max_size:
+        image = reduce(image, kernel)
+    height, width = image.shape[:2]
+    chain = [_to_rgba8(image)]
+    levels = level_count(width, height) if mipmaps else 1
+    for _ in range(levels - 1):
+        image = reduce(image, kernel)
+        chain.append(_to_rgba8(image))
+    return width, height, b''.join(x.tobytes() for x in chain), levels
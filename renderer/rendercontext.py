@@ -7,6 +7,8 @@ class RenderContext:
         self._model = None
         self._mv = None
         self._mvp = None
+        # applied before the model matrix. ex. dequantize
+        self.local = None
         self.set_model(None)
         self.color = (1, 1, 1, 1)
 
@@ -16,6 +18,12 @@ class RenderContext:
         self._mvp = None
         self._model = None
 
+    def set_local(self, matrix):
+        self.local = matrix
+        self._mv = None
+        self._mvp = None
+        self._model = None
+
     def set_submesh(self, color):
         self.color = color
 
@@ -23,6 +31,8 @@ class RenderContext:
     def model(self):
         if not self._model:
             self._model = self.transform.mat4
+            if self.local:
+                self._model = self.local * self._model
         return self._model
 
     @property
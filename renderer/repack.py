@@ -0,0 +1,229 @@
+'''
+pmd.Vertex records to a tight interleaved buffer with only the attributes
+of a shader, optionally quantized
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy
+
+from pyvbo import pmd
+from .vertexbuffer import AttributeLayout, Semantics, INT_2_10_10_10_REV
+
+ALIGNMENT = 4
+
+PMD_FIELDS = {
+    Semantics.POSITION: 'pos',
+    Semantics.NORMAL: 'normal',
+    Semantics.TEXCOORD: 'uv',
+}
+
+DTYPES = {
+    'f': '<f4',
+    'e': '<f2',
+    'b': 'i1',
+    'B': 'u1',
+    'h': '<i2',
+    'H': '<u2',
+    'i': '<i4',
+    'I': '<u4',
+    INT_2_10_10_10_REV: '<u4',
+}
+
+
+class Quantization:
+    '''
+    position: None, 'half' or 'int16'.
+        int16 is normalized to the bounding cube and needs
+        PackedVertices.dequantize (uniform scale and offset) applied.
+    normal: 10_10_10_2 normalized. read as vec3 by the shaders as is.
+    texcoord: unorm16 if all uv are in [0, 1], else half float.
+    '''
+
+    def __init__(self, position: Optional[str]='int16',
+                 normal=True, texcoord=True)->None:
+        if position not in (None, 'half', 'int16'):
+            raise ValueError(f'unknown position quantization: {position}')
+        self.position = position
+        self.normal = normal
+        self.texcoord = texcoord
+
+    @property
+    def key(self)->str:
+        return f'{self.position}:{int(self.normal)}:{int(self.texcoord)}'
+
+
+class PackedVertices:
+    '''
+    data: bytes as uint8 array
+    dequantize: (scale, x, y, z). position = quantized * scale + (x, y, z)
+    errors: max abs error of each quantized attribute, by semantics name
+    '''
+
+    def __init__(self, data: numpy.ndarray, layout: List[AttributeLayout],
+                 stride: int,
+                 dequantize: Optional[Tuple[float, float, float, float]]=None,
+                 errors: Optional[Dict[str, float]]=None)->None:
+        self.data = data
+        self.layout = layout
+        self.stride = stride
+        self.dequantize = dequantize
+        self.errors = errors if errors else {}
+
+
+def _align(value: int)->int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def packed_layout(layout: Sequence[AttributeLayout])->Tuple[List[AttributeLayout], int]:
+    '''
+    offsets in layout order, each aligned to 4 bytes
+    '''
+    offset = 0
+    packed = []
+    for x in layout:
+        packed.append(AttributeLayout(x.semantics, x.value_type, x.value_elements,
+                                      offset, x.normalized))
+        offset = _align(offset + x.size)
+    return packed, offset
+
+
+def packed_dtype(layout: Sequence[AttributeLayout], stride: int)->numpy.dtype:
+    def get_format(x: AttributeLayout):
+        if x.value_type == INT_2_10_10_10_REV:
+            return DTYPES[x.value_type]
+        return (DTYPES[x.value_type], (x.value_elements,))
+    return numpy.dtype({
+        'names': [x.semantics.name for x in layout],
+        'formats': [get_format(x) for x in layout],
+        'offsets': [x.offset for x in layout],
+        'itemsize': stride,
+    })
+
+
+def encode_2_10_10_10(values: numpy.ndarray)->numpy.ndarray:
+    '''
+    signed normalized xyz. w is 0
+    '''
+    q = numpy.rint(numpy.clip(values[:, :3], -1.0, 1.0) * 511).astype(numpy.int32)
+    q &= 0x3ff
+    return (q[:, 0] | (q[:, 1] << 10) | (q[:, 2] << 20)).astype(numpy.uint32)
+
+
+def decode_2_10_10_10(values: numpy.ndarray)->numpy.ndarray:
+    v = values.astype(numpy.int32)
+    q = numpy.stack([(v >> shift) & 0x3ff for shift in (0, 10, 20)], axis=1)
+    q = numpy.where(q >= 512, q - 1024, q)
+    return numpy.maximum(q / 511.0, -1.0)
+
+
+def _quantize(name: str, values: numpy.ndarray, x: AttributeLayout,
+              quantization: Quantization, errors: Dict[str, float]):
+    '''
+    returns (layout, encoded, dequantize)
+    '''
+    if x.semantics == Semantics.POSITION and quantization.position == 'half':
+        encoded = values.astype(numpy.float16)
+        errors[name] = float(numpy.abs(encoded - values).max(initial=0))
+        return AttributeLayout(x.semantics, 'e', x.value_elements), encoded, None
+
+    if x.semantics == Semantics.POSITION and quantization.position == 'int16':
+        if len(values):
+            lo = values.min(axis=0)
+            hi = values.max(axis=0)
+        else:
+            lo = hi = numpy.zeros(x.value_elements, numpy.float32)
+        center = (lo + hi) * 0.5
+        scale = float((hi - lo).max() * 0.5) or 1.0
+        encoded = numpy.rint((values - center) / scale * 32767).astype(numpy.int16)
+        decoded = encoded / 32767 * scale + center
+        errors[name] = float(numpy.abs(decoded - values).max(initial=0))
+        dequantize = (scale, *(float(v) for v in center))
+        return AttributeLayout(x.semantics, 'h', x.value_elements, normalized=True),\
+            encoded, dequantize
+
+    if x.semantics == Semantics.NORMAL and quantization.normal and x.value_elements == 3:
+        encoded = encode_2_10_10_10(values)
+        errors[name] = float(numpy.abs(decode_2_10_10_10(encoded) - values).max(initial=0))
+        return AttributeLayout(x.semantics, INT_2_10_10_10_REV, 4, normalized=True),\
+            encoded, None
+
+    if x.semantics == Semantics.TEXCOORD and quantization.texcoord:
+        if len(values) == 0 or (values.min() >= 0 and values.max() <= 1):
+            encoded = numpy.rint(values * 65535).astype(numpy.uint16)
+            errors[name] = float(numpy.abs(encoded / 65535 - values).max(initial=0))
+            return AttributeLayout(x.semantics, 'H', x.value_elements, normalized=True),\
+                encoded, None
+        logger.debug('uv out of [0, 1]. half float')
+        encoded = values.astype(numpy.float16)
+        errors[name] = float(numpy.abs(encoded - values).max(initial=0))
+        return AttributeLayout(x.semantics, 'e', x.value_elements), encoded, None
+
+    return x, values, None
+
+
+def repack_records(src: numpy.ndarray, fields: Dict[Semantics, str],
+                   layout: Sequence[AttributeLayout],
+                   quantization: Optional[Quantization]=None)->PackedVertices:
+    '''
+    src: structured array. fields: semantics to the field name of src.
+    attributes that src does not have are zero.
+    '''
+    missing = [x.semantics.name for x in layout if x.semantics not in fields]
+    if missing:
+        logger.debug('no source for %s', missing)
+
+    if not quantization:
+        packed, stride = packed_layout(layout)
+        dst = numpy.zeros(len(src), packed_dtype(packed, stride))
+        names = [x.semantics.name for x in packed if x.semantics in fields]
+        if names:
+            # structured assignment is by position. one pass over the records
+            view = dst[names]
+            view[...] = src[[fields[Semantics[x]] for x in names]]
+        logger.debug('repack %d bytes -> %d bytes', src.nbytes, dst.nbytes)
+        return PackedVertices(dst.view(numpy.uint8), packed, stride)
+
+    errors: Dict[str, float] = {}
+    dequantize = None
+    quantized = []
+    values = []
+    for x in layout:
+        if x.semantics not in fields:
+            quantized.append(x)
+            values.append(None)
+            continue
+        name = x.semantics.name
+        attribute, encoded, d = _quantize(
+            name, src[fields[x.semantics]], x, quantization, errors)
+        if d:
+            dequantize = d
+        quantized.append(attribute)
+        values.append(encoded)
+
+    packed, stride = packed_layout(quantized)
+    dst = numpy.zeros(len(src), packed_dtype(packed, stride))
+    for x, v in zip(packed, values):
+        if v is not None:
+            dst[x.semantics.name] = v
+    logger.debug('quantize %d bytes -> %d bytes, max error %s',
+                 src.nbytes, dst.nbytes, errors)
+    return PackedVertices(dst.view(numpy.uint8), packed, stride, dequantize, errors)
+
+
+def repack(vertices, layout: Sequence[AttributeLayout],
+           quantization: Optional[Quantization]=None)->PackedVertices:
+    '''
+    vertices: pmd.Vertex records (ctypes array or numpy)
+    '''
+    return repack_records(numpy.frombuffer(vertices, pmd.VertexRecord.dtype),
+                          PMD_FIELDS, layout, quantization)
+
+
+def builder_records(data, layout: Sequence[AttributeLayout], stride: int)->numpy.ndarray:
+    '''
+    MeshBuilder bytes as a structured array, fields named by semantics
+    '''
+    return numpy.frombuffer(data, packed_dtype(layout, stride))
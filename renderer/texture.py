@@ -2,46 +2,173 @@
 from logging import getLogger
 logger = getLogger(__name__)
 
+import concurrent.futures
+import os
+from typing import Callable, Optional, Tuple
+
 from OpenGL.GL import *
 
+from .vbo import as_ctypes_buffer
+from .mipmap import level_sizes
+
+# (w, h, data, levels). data is the mip chain, level 0 first
+ImageData = Tuple[int, int, bytes, int]
+
+_prefetch_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def get_prefetch_executor()->concurrent.futures.ThreadPoolExecutor:
+    global _prefetch_executor  # pylint: disable=W0603
+    if not _prefetch_executor:
+        _prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=os.cpu_count(), thread_name_prefix='texture')
+    return _prefetch_executor
+
 
 class Texture:
-    def __init__(self):
+    '''
+    source: returns the pixels (w, h, data, levels) again, ex. decodes the file.
+    with a source, the host pixels are dropped after upload, and a texture
+    without pixels is decoded in the background on first bind. it is
+    white until the pixels arrive.
+    '''
+
+    def __init__(self, source: Optional[Callable[[], Optional[ImageData]]]=None):
         self.texture = None
         self.sampler = None
         self.image = None
+        # TextureCache key. None if not shared
+        self.key = None
+        self.source = source
+        # (w, h) of level 0 once the pixels are known
+        self.size: Optional[Tuple[int, int]] = None
+        self.levels = 1
+        self._pending: Optional[concurrent.futures.Future] = None
+        self._uploaded = False
+        self._placeholder = False
+
+    @property
+    def nbytes(self)->int:
+        if not self.size:
+            return 0
+        return sum(w * h * 4 for w, h in level_sizes(*self.size, self.levels))
 
-    def create_texture(self, w, h, data):
+    def create_texture(self, w, h, data, levels=1):
         size = len(data)
-        assert size == w * h * 4
-        self.image = (w, h, data)
+        assert size == sum(x * y * 4 for x, y in level_sizes(w, h, levels))
+        self.image = (w, h, data, levels)
+        self.size = (w, h)
+        self.levels = levels
+
+    def get_image(self)->Optional[ImageData]:
+        '''
+        the pixels. from the source if they were dropped or not decoded yet
+        '''
+        if self.image:
+            return self.image
+        if self.source:
+            return self.source()
+        return None
+
+    def prefetch(self)->None:
+        '''
+        decode in the background. bind uploads the result
+        '''
+        if self._uploaded or self.image or self._pending or not self.source:
+            return
+        self._pending = get_prefetch_executor().submit(self.source)
+
+    def _take_pending(self)->bool:
+        '''
+        false while decoding
+        '''
+        if not self._pending:
+            return True
+        if not self._pending.done():
+            return False
+        try:
+            image = self._pending.result()
+        except Exception as ex:  # pylint: disable=W0703
+            logger.error('decode texture %s: %s', self.key, ex)
+            image = None
+        self._pending = None
+        if image:
+            self.create_texture(*image)
+        else:
+            # nothing to decode. white
+            self.source = None
+        return True
+
+    def _upload(self):
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        if not self._take_pending():
+            if not self._placeholder:
+                self._upload_white()
+                self._placeholder = True
+            return
+        if self.image:
+            #logger.info('initialize texture')
+            w, h, data, levels = self.image
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, levels - 1)
+            view = memoryview(data).cast('B')
+            offset = 0
+            for level, (lw, lh) in enumerate(level_sizes(w, h, levels)):
+                size = lw * lh * 4
+                if isinstance(data, bytes):
+                    level_data = data if levels == 1 else data[offset:offset + size]
+                else:
+                    # ex. memoryview over a mapped cache file
+                    level_data = as_ctypes_buffer(view[offset:offset + size])
+                glTexImage2D(GL_TEXTURE_2D, level, GL_RGBA, lw, lh, 0,
+                             GL_RGBA, GL_UNSIGNED_BYTE, level_data)
+                offset += size
+            if self.source:
+                # on the GPU now. the source decodes again if needed
+                self.image = None
+        else:
+            self._upload_white()
+        self._uploaded = True
+
+    def _upload_white(self):
+        #logger.info('initialize texture. default white')
+        w = 4
+        h = 4
+        data = [255 for x in range(w * h * 4)]
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, 0)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0,
+                     GL_RGBA, GL_UNSIGNED_BYTE, data)
 
     def initialize(self):
         self.sampler = glGenSamplers(1)
         glSamplerParameteri(self.sampler, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glSamplerParameteri(self.sampler, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glSamplerParameteri(self.sampler, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        # trilinear. a texture without mipmaps has GL_TEXTURE_MAX_LEVEL 0
+        glSamplerParameteri(self.sampler, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
         glSamplerParameteri(self.sampler, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
 
         self.texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        if self.image:
-            #logger.info('initialize texture')
-            w, h, data = self.image
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0,
-                         GL_RGBA, GL_UNSIGNED_BYTE, data)
-        else:
-            #logger.info('initialize texture. default white')
-            # white
-            w = 4
-            h = 4
-            data = [255 for x in range(w * h * 4)]
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0,
-                         GL_RGBA, GL_UNSIGNED_BYTE, data)
+        self._upload()
+
+    def release(self):
+        '''
+        delete the GL objects. bind uploads again
+        '''
+        if self.texture:
+            glDeleteTextures([self.texture])
+            self.texture = None
+        if self.sampler:
+            glDeleteSamplers(1, [self.sampler])
+            self.sampler = None
+        self._uploaded = False
+        self._placeholder = False
 
     def bind(self):
-        if not self.texture:
-            self.initialize()
+        if not self._uploaded:
+            self.prefetch()
+            if not self.texture:
+                self.initialize()
+            else:
+                self._upload()
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, self.texture)
         glBindSampler(0, self.sampler)
@@ -0,0 +1,308 @@
+'''
+process-wide cache of decoded textures
+
+keyed by the resolved path, mtime and pixel format. models that share a
+file (toon, sphere maps) share one Texture, so its pixels are decoded once
+and uploaded once.
+
+acquire counts a reference, release drops it. textures without reference
+stay cached and are evicted least recently used first while the pixel
+bytes of the cache (on the host or the GPU) are over its budget. an evicted
+texture that was uploaded is deleted by collect on the GL thread.
+
+lazy textures are not decoded until they are bound. see Texture.source
+
+decoded textures are clamped to max_size and get a mip chain, on the
+loader threads. the chain is stored in .pyvbo cache files as is, so a
+cached model uploads its levels without decoding.
+'''
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+import concurrent.futures
+import functools
+import os
+import pathlib
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .texture import ImageData, Texture
+from . import mipmap
+from PIL import Image
+
+FORMAT = 'RGBA'
+
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+
+def decode_image(texture_file: pathlib.Path, format=FORMAT)->Optional[ImageData]:  # pylint: disable=W0622
+    if not texture_file.exists():
+        logger.warning("%s not exists", texture_file)
+        return None
+    logger.debug("%s exists", texture_file)
+    with texture_file.open('rb') as f:
+        image = Image.open(f)
+        image = image.convert(format)
+    return image.width, image.height, image.tobytes(), 1
+
+
+def image_size(texture_file: pathlib.Path)->Optional[Tuple[int, int]]:
+    '''
+    (w, h) from the header. the pixels are not decoded
+    '''
+    try:
+        with Image.open(texture_file) as image:
+            return image.size
+    except OSError:
+        # not exists or unknown format
+        return None
+
+
+def load_image(texture_file: pathlib.Path, max_size: Optional[int]=None,
+               mipmaps=False, kernel='box')->Optional[ImageData]:
+    '''
+    decode, clamp and build the mip chain
+    '''
+    image = decode_image(texture_file)
+    if not image:
+        return None
+    w, h, data, _ = image
+    return mipmap.build(w, h, data, max_size, mipmaps, kernel)
+
+
+def decode_images(texture_files: Iterable[pathlib.Path],
+                  executor: concurrent.futures.Executor=None,
+                  decode: Callable[[pathlib.Path], Optional[ImageData]]=decode_image
+                  )->Dict[pathlib.Path, Optional[ImageData]]:
+    '''
+    decode each resolved path once. Pillow releases the GIL while decoding,
+    so the default thread pool scales. a ProcessPoolExecutor works too.
+    results are joined before return.
+    '''
+    unique = list({x.resolve() for x in texture_files})
+    if not unique:
+        return {}
+    if len(unique) == 1:
+        return {unique[0]: decode(unique[0])}
+    if executor:
+        return dict(zip(unique, executor.map(decode, unique)))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(unique), os.cpu_count() or 1)) as pool:
+        return dict(zip(unique, pool.map(decode, unique)))
+
+
+def texture_key(texture_file: pathlib.Path, format: str)->Optional[str]:  # pylint: disable=W0622
+    '''
+    'format:mtime_ns:resolved path'. None if the file does not exist
+    '''
+    path = texture_file.resolve()
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    return f'{format}:{mtime}:{path}'
+
+
+class _Entry:
+    def __init__(self, texture: Texture)->None:
+        self.texture = texture
+        self.refcount = 0
+
+
+class TextureCache:
+    '''
+    thread safe. acquire and release run on loader threads, collect on the
+    GL thread.
+    max_size: clamp of the texture size. None for no clamp.
+    kernel: mipmap filter. 'box' or 'lanczos'
+    '''
+
+    def __init__(self, budget=DEFAULT_BUDGET, max_size: Optional[int]=None,
+                 mipmaps=True, kernel='box')->None:
+        if kernel not in mipmap.FILTERS:
+            raise ValueError(f'unknown filter: {kernel}')
+        self.budget = budget
+        self.max_size = max_size
+        self.mipmaps = mipmaps
+        self.kernel = kernel
+        self._entries: 'collections.OrderedDict[str, _Entry]' = collections.OrderedDict()
+        self._loading: Dict[str, concurrent.futures.Future] = {}
+        self._released: List[Texture] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def format(self)->str:
+        '''
+        pixel format and processing. a part of the texture keys
+        '''
+        return f'{FORMAT}/{self.kernel if self.mipmaps else "nomip"}/{self.max_size or 0}'
+
+    @property
+    def decode(self)->Callable[[pathlib.Path], Optional[ImageData]]:
+        '''
+        picklable for a ProcessPoolExecutor
+        '''
+        return functools.partial(load_image, max_size=self.max_size,
+                                 mipmaps=self.mipmaps, kernel=self.kernel)
+
+    @property
+    def used(self)->int:
+        '''
+        bytes of the pixels known so far. lazy textures count after decode
+        '''
+        return sum(x.texture.nbytes for x in self._entries.values())
+
+    def _hit(self, key: str)->Optional[Texture]:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        entry.refcount += 1
+        self._entries.move_to_end(key)
+        return entry.texture
+
+    def _insert(self, key: str, image: Optional[ImageData],
+                source: Optional[Callable[[], Optional[ImageData]]])->Texture:
+        texture = Texture(source)
+        if image:
+            texture.create_texture(*image)
+        texture.key = key
+        entry = _Entry(texture)
+        entry.refcount = 1
+        self._entries[key] = entry
+        self._evict()
+        return texture
+
+    def _evict(self, budget: Optional[int]=None)->None:
+        budget = self.budget if budget is None else budget
+        used = self.used
+        for key in list(self._entries):
+            if used <= budget:
+                break
+            entry = self._entries[key]
+            if entry.refcount:
+                continue
+            del self._entries[key]
+            used -= entry.texture.nbytes
+            if entry.texture.texture:
+                self._released.append(entry.texture)
+            logger.debug('evict %s', key)
+
+    def acquire(self, key: str, load: Callable[[], Optional[ImageData]],
+                source: Optional[Callable[[], Optional[ImageData]]]=None)->Texture:
+        '''
+        load is called on a miss. a concurrent acquire of the same key
+        waits for it instead of loading again.
+        source: Texture.source of a new texture
+        '''
+        with self._lock:
+            texture = self._hit(key)
+            if texture:
+                return texture
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._loading[key] = future
+        if not owner:
+            future.result()
+            with self._lock:
+                texture = self._hit(key)
+            # evicted already. load again
+            return texture if texture else self.acquire(key, load, source)
+
+        try:
+            image = load()
+        except BaseException as ex:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(ex)
+            raise
+        with self._lock:
+            del self._loading[key]
+            texture = self._insert(key, image, source)
+        future.set_result(None)
+        return texture
+
+    def acquire_files(self, texture_files: Iterable[pathlib.Path],
+                      executor: concurrent.futures.Executor=None, lazy=False
+                      )->Dict[pathlib.Path, Texture]:
+        '''
+        one reference per resolved path. misses are decoded in parallel,
+        or on first bind if lazy.
+        a file that does not exist gets an uncached white Texture.
+        '''
+        keys: Dict[pathlib.Path, str] = {}
+        textures: Dict[pathlib.Path, Texture] = {}
+        for texture_file in texture_files:
+            path = texture_file.resolve()
+            if path in keys or path in textures:
+                continue
+            key = texture_key(path, self.format)
+            if key:
+                keys[path] = key
+            else:
+                logger.warning("%s not exists", path)
+                textures[path] = Texture()
+
+        decode = self.decode
+        if lazy:
+            for path, key in keys.items():
+                textures[path] = self.acquire(
+                    key, lambda: None, functools.partial(decode, path))
+            return textures
+
+        with self._lock:
+            missing = [x for x, key in keys.items()
+                       if key not in self._entries and key not in self._loading]
+        # decode outside of acquire, in parallel. acquire picks them up
+        images = decode_images(missing, executor, decode)
+        for path, key in keys.items():
+            textures[path] = self.acquire(
+                key, lambda path=path: images[path] if path in images else decode(path),
+                functools.partial(decode, path))
+        return textures
+
+    def acquire_pixels(self, key: str, width: int, height: int, pixels,
+                       levels=1)->Texture:
+        '''
+        pixels decoded already. ex. a texture of a .pyvbo cache file
+        '''
+        def source():
+            return width, height, pixels, levels
+        return self.acquire(key, source, source)
+
+    def release(self, texture: Texture)->None:
+        if not texture.key:
+            return
+        with self._lock:
+            entry = self._entries.get(texture.key)
+            if not entry or entry.texture is not texture:
+                return
+            entry.refcount -= 1
+            if entry.refcount <= 0:
+                entry.refcount = 0
+                self._evict()
+
+    def collect(self)->None:
+        '''
+        delete the GL objects of evicted textures. on the GL thread
+        '''
+        with self._lock:
+            released = self._released
+            self._released = []
+        for texture in released:
+            texture.release()
+
+    def clear(self)->None:
+        '''
+        drop the textures without reference
+        '''
+        with self._lock:
+            self._evict(-1)
+
+
+TEXTURE_CACHE = TextureCache()
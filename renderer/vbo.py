@@ -7,25 +7,53 @@ import ctypes
 import struct
 from typing import List
 
+import numpy
 from OpenGL.GL import *
 from OpenGL.GLU import *
 
-from .vertexbuffer import AttributeLayout
+from .vertexbuffer import AttributeLayout, INT_2_10_10_10_REV
 
 
 def to_gltype(code):
     if code == 'f':
         return GL_FLOAT
+    elif code == 'e':
+        return GL_HALF_FLOAT
+    elif code == 'b':
+        return GL_BYTE
     elif code == 'B':
         return GL_UNSIGNED_BYTE
+    elif code == 'h':
+        return GL_SHORT
     elif code == 'H':
         return GL_UNSIGNED_SHORT
+    elif code == 'i':
+        return GL_INT
     elif code == 'I':
         return GL_UNSIGNED_INT
+    elif code == INT_2_10_10_10_REV:
+        return GL_INT_2_10_10_10_REV
     else:
         raise RuntimeError('unknown code: %s' % code)
 
 
+def get_typecode(data)->str:
+    if isinstance(data, array.array):
+        return data.typecode
+    # numpy may give explicit byte order. ex. '<I'
+    return memoryview(data).format.lstrip('@=<')
+
+
+def as_ctypes_buffer(data):
+    '''
+    array.array or memoryview(ex. mmap backed) to a pointer without copy.
+    read only buffers too, ex. the bytes of pyvbo.load_bytes. GL only reads
+    them. data must live until the GL call returns
+    '''
+    view = memoryview(data).cast('B')
+    return ctypes.c_void_p(numpy.frombuffer(view, numpy.uint8).ctypes.data)
+
+
 class VBOBase:
     def __init__(self)->None:
         self.vbo = None
@@ -45,7 +73,7 @@ class VBOBase:
             glVertexAttribPointer(slot,
                                   layout.value_elements,
                                   to_gltype(layout.value_type),
-                                  False,
+                                  layout.normalized,
                                   stride,
                                   ctypes.c_void_p(layout.offset))
 
@@ -73,7 +101,7 @@ class CtypesVBO(VBOBase):
 
 
 class ArrayVBO(VBOBase):
-    def __init__(self, data: array.array)->None:
+    def __init__(self, data)->None:
         super().__init__()
         self.data = data
         self.stride = None
@@ -81,17 +109,16 @@ class ArrayVBO(VBOBase):
     def initialize(self):
         super().initialize()
 
-        addr, _ = self.data.buffer_info()
         glBufferData(GL_ARRAY_BUFFER,
                      self.data.itemsize * len(self.data),
-                     ctypes.c_void_p(addr), GL_STATIC_DRAW)
+                     as_ctypes_buffer(self.data), GL_STATIC_DRAW)
 
     @property
     def count(self):
         return (len(self.data) * self.data.itemsize) / self.stride
 
     def get(self, row: int, col: int):
-        assert self.data.typecode == 'B'
+        assert get_typecode(self.data) == 'B'
         layout = self.layouts[col]
         offset = self.stride * row + layout.offset
         data = bytes(self.data[offset:offset + layout.size])
@@ -99,9 +126,9 @@ class ArrayVBO(VBOBase):
 
 
 class ArrayVBOIndex(ArrayVBO):
-    def __init__(self, data: array.array)->None:
+    def __init__(self, data)->None:
         super().__init__(data)
-        self.gltype = to_gltype(data.typecode)
+        self.gltype = to_gltype(get_typecode(data))
 
     def setIndex(self):
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.vbo)
@@ -17,29 +17,45 @@ class Topology(Enum):
     Line = 1
 
 
+# x, y, z, w in one signed 32bit. 10, 10, 10, 2 bits
+INT_2_10_10_10_REV = 'P'
+
+
 def value_size(value_type):
     if value_type == 'f':
         return 4
-    if value_type == 'H':
+    if value_type in ('e', 'h', 'H'):
         return 2
-    if value_type == 'I':
+    if value_type in ('b', 'B'):
+        return 1
+    if value_type in ('i', 'I', INT_2_10_10_10_REV):
         return 4
     raise ValueError('unknown type: %s' % value_type)
 
 
 class AttributeLayout:
-    def __init__(self, semantics, value_type, value_elements, offset=None):
+    '''
+    normalized: integer values are mapped to [0, 1] (unsigned) or [-1, 1]
+    '''
+
+    def __init__(self, semantics, value_type, value_elements, offset=None,
+                 normalized=False):
         self.semantics = semantics
         self.value_type = value_type
         self.value_elements = value_elements
         self.offset = offset
+        self.normalized = normalized
 
     @property
     def size(self):
+        if self.value_type == INT_2_10_10_10_REV:
+            return value_size(self.value_type)
         return value_size(self.value_type) * self.value_elements
 
     @property
     def pack_format(self):
+        if self.value_type == INT_2_10_10_10_REV:
+            return 'I'
         return self.value_type * self.value_elements
 
 
@@ -125,6 +141,23 @@ class MeshBuilder:
         self.indices.append(i + 1)
         self.indices.append(i + 2)
 
+    def weld(self, epsilon=0.0):
+        '''
+        merge the duplicated vertices. ex. push_quad pushes 6 for 4.
+        returns pyvbo.weld.WeldReport
+        '''
+        from pyvbo import weld
+        from .repack import builder_records
+        records = builder_records(self.vertices, self.layout, self.stride)
+        keep, remap = weld.weld_keys(weld.vertex_keys(records, epsilon))
+        report = weld.WeldReport(len(records), len(keep), self.stride)
+        vertices = array.array('B')
+        vertices.frombytes(records[keep].tobytes())
+        self.vertices = vertices
+        self.indices = array.array('I', remap[self.indices].tolist())
+        self.vertex_count = len(keep)
+        return report
+
     def push_quad(self, v0, v1, v2, v3):
         self.push_triangle(v0, v1, v2)
         self.push_triangle(v2, v3, v0)
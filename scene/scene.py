@@ -6,7 +6,7 @@ from OpenGL.GL import *
 from OpenGL.GLU import *
 
 import lah
-from renderer import Drawer, MeshBuilder, Camera, RenderContext
+from renderer import Drawer, MeshBuilder, Camera, RenderContext, TEXTURE_CACHE
 import shaders
 from observable_property import Prop, ListProp, RGBAf
 
@@ -67,6 +67,11 @@ class Scene:
         self.nodes = ListProp[Node]()
 
     def add_mesh(self, name, mesh: Drawer):
+        # replaces the current model
+        for node in self.nodes.values:
+            for x in node.components:
+                if isinstance(x, MeshComponent):
+                    x.mesh.release()
         mesh_node = Node(name)
         mesh_node.components.append(MeshComponent(mesh))
         self.nodes.reset(mesh_node)
@@ -158,6 +163,9 @@ class Scene:
         #
         context = RenderContext(self.camera, self.lightDir)
 
+        # GL objects of the textures evicted since the last frame
+        TEXTURE_CACHE.collect()
+
         for x in self.gizmos.values:
             context.set_model(x.model)
             x.render(context)
@@ -21,6 +21,5 @@ MmdShader = ShaderProgram(
         AttributeLayout(Semantics.POSITION, 'f', 3),
         AttributeLayout(Semantics.NORMAL, 'f', 3),
         AttributeLayout(Semantics.TEXCOORD, 'f', 2)
-    ),
-    vertex_stride = 38
+    )
 )
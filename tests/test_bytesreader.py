@@ -0,0 +1,41 @@
+import numpy
+import pytest
+
+from pyvbo.bytesreader import gather
+
+DATA = bytes(range(100))
+DTYPE = numpy.dtype([('a', '<u2'), ('b', 'u1', 3)])
+
+
+def expected(offsets):
+    return b''.join(DATA[x:x + DTYPE.itemsize] for x in offsets)
+
+
+def test_gather_contiguous():
+    values = gather(DATA, DTYPE, [10, 15, 20])
+    assert values.tobytes() == expected([10, 15, 20])
+    # a copy, not a view of the data
+    values['a'] = 0
+
+
+def test_gather_scattered():
+    assert gather(DATA, DTYPE, [40, 3, 7]).tobytes() == expected([40, 3, 7])
+
+
+def test_gather_runs():
+    values = gather(DATA, DTYPE, [1, 60, 90], [3, 0, 2])
+    assert values.tobytes() == expected([1, 6, 11, 90, 95])
+    assert gather(DATA, '<u2', [], []).shape == (0,)
+
+
+def test_gather_subarray():
+    values = gather(DATA, ('<f4', (2, 2)), [0, 16])
+    assert values.shape == (2, 2, 2)
+    assert values.tobytes() == DATA[:32]
+
+
+def test_gather_out_of_buffer():
+    with pytest.raises(IndexError):
+        gather(DATA, DTYPE, [96], [2])
+    with pytest.raises(IndexError):
+        gather(DATA, DTYPE, [95, 100])
@@ -0,0 +1,99 @@
+import array
+import json
+import os
+
+import pytest
+
+from pyvbo import cache
+
+
+def write_table(path, table, size=None):
+    data = json.dumps(table).encode('utf-8')
+    path.write_bytes(cache.Header.struct.pack(cache.MAGIC, cache.FORMAT_VERSION,
+                                              size if size else len(data)) + data)
+
+
+@pytest.mark.parametrize('table', [
+    {'name': 'model'},
+    {'name': 'model', 'blobs': [[0]]},
+    {'name': 'model', 'blobs': None},
+    {'name': 'model', 'blobs': [], 'layout': []},
+    [],
+])
+def test_malformed_entry_is_a_miss(tmp_path, table):
+    store = cache.CacheStore(tmp_path)
+    write_table(store.path('key'), table)
+    assert store.get('key') is None
+
+
+def test_truncated_entry_is_a_miss(tmp_path):
+    store = cache.CacheStore(tmp_path)
+    store.path('key').write_bytes(cache.MAGIC)
+    assert store.get('key') is None
+    write_table(store.path('key'), {'name': 'model'}, 1000)
+    assert store.get('key') is None
+
+
+def entry():
+    vertices = bytes(range(256)) * 50
+    indices = array.array('H', [i % 400 for i in range(300)])
+    pixels = bytes(cache._chain_size(64, 64, 7))
+    return cache.CacheEntry(
+        'model', [cache.Attribute('POSITION', 'f', 3, 0)], 32, vertices, indices, 'H',
+        [cache.CacheSubMesh(150, (1, 1, 1, 1), 0), cache.CacheSubMesh(150, (1, 1, 1, 1), -1)],
+        [cache.CacheTexture('texture', 64, 64, pixels, 7)],
+        lods=[(0, [60, 60])])
+
+
+def blob_ranges(path):
+    data = path.read_bytes()
+    header = cache.Header.struct.unpack_from(data)
+    table = json.loads(data[cache.Header.size:cache.Header.size + header[2]])
+    return table['blobs']
+
+
+def test_entry_round_trip(tmp_path):
+    store = cache.CacheStore(tmp_path)
+    store.put('key', entry())
+    read = store.get('key')
+    assert len(read.indices) == 300
+    assert len(read.textures[0].pixels) == cache._chain_size(64, 64, 7)
+
+
+@pytest.mark.parametrize('blob', [0, 1, 2])
+def test_truncated_blob_is_a_miss(tmp_path, blob):
+    store = cache.CacheStore(tmp_path)
+    path = store.put('key', entry())
+    offset, size = blob_ranges(path)[blob]
+    data = path.read_bytes()
+    path.write_bytes(data[:offset + size // 2])
+    assert store.get('key') is None
+
+
+def test_table_over_the_blobs_is_a_miss(tmp_path):
+    store = cache.CacheStore(tmp_path)
+    broken = entry()
+    broken.lods = [(200, [60, 60])]
+    store.put('key', broken)
+    assert store.get('key') is None
+
+
+def test_changed_source_is_a_miss(tmp_path):
+    store = cache.CacheStore(tmp_path / 'cache')
+    texture = tmp_path / 'texture.png'
+    texture.write_bytes(b'png')
+    missing = tmp_path / 'missing.png'
+    stamped = entry()
+    stamped.sources = cache.file_stamps([texture, missing, None, texture])
+    assert len(stamped.sources) == 2
+    store.put('key', stamped)
+    assert store.get('key').sources == stamped.sources
+
+    mtime = texture.stat().st_mtime_ns
+    os.utime(texture, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    assert store.get('key') is None
+
+    store.put('key', stamped)
+    os.utime(texture, ns=(mtime, mtime))
+    missing.write_bytes(b'png')
+    assert store.get('key') is None
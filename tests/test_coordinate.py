@@ -0,0 +1,88 @@
+import array
+import pathlib
+
+import numpy
+
+from pyvbo import coordinate, model, pmd
+from pyvbo.metadata import Coordinate, Direction, MetaData
+
+POSITIONS = [(0, 0, 0), (1, 0, 0), (0, 1, 1)]
+INDICES = [0, 1, 2]
+
+
+def face_normal(positions):
+    normal = numpy.cross(positions[1] - positions[0], positions[2] - positions[0])
+    return normal / numpy.linalg.norm(normal)
+
+
+def build(coord: Coordinate, up: Direction, forward: Direction, right: Direction,
+          indices=None)->model.Model:
+    '''
+    one triangle. each vertex normal is the face normal
+    '''
+    vertices = (pmd.Vertex * len(POSITIONS))()
+    records = numpy.frombuffer(vertices, pmd.VertexRecord.dtype)
+    records['pos'] = POSITIONS
+    records['normal'] = face_normal(records['pos'].astype(numpy.float64))
+    metadata = MetaData(pathlib.Path('model.pmd'), 'model', '', coord, up, forward, right, 0.5)
+    return model.Model(metadata, vertices,
+                       array.array('H', INDICES) if indices is None else indices, [])
+
+
+def converted(m: model.Model):
+    '''
+    (positions of the triangle in index order, vertex normals)
+    '''
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    return (records['pos'][numpy.asarray(m.indices)].astype(numpy.float64),
+            records['normal'].astype(numpy.float64))
+
+
+def test_mirror():
+    m = build(Coordinate.YUP_ZFORWARD,
+              Direction.Y_POSITIVE, Direction.Z_NEGATIVE, Direction.X_NEGATIVE)
+    matrix = coordinate.get_matrix(Coordinate.YUP_ZFORWARD, Coordinate.YUP_ZBACKWARD)
+    assert numpy.linalg.det(matrix) < 0
+    coordinate.convert(m, Coordinate.YUP_ZBACKWARD)
+
+    assert numpy.asarray(m.indices).tolist() == [0, 2, 1]
+    positions, normals = converted(m)
+    assert numpy.allclose(positions, [(0, 0, 0), (0, 0.5, -0.5), (0.5, 0, 0)])
+    # the inverse transpose, not scaled
+    expected = numpy.linalg.inv(matrix).T @ face_normal(numpy.array(POSITIONS, numpy.float64))
+    assert numpy.allclose(normals, expected)
+    assert numpy.allclose(numpy.linalg.norm(normals, axis=1), 1.0)
+    # the flipped winding faces the normals again
+    assert numpy.allclose(face_normal(positions), expected)
+
+    metadata = m.metadata
+    assert metadata.coord == Coordinate.YUP_ZBACKWARD
+    assert metadata.up == Direction.Y_POSITIVE
+    assert metadata.forward == Direction.Z_POSITIVE
+    assert metadata.right == Direction.X_NEGATIVE
+    assert metadata.to_meter == 1.0
+
+
+def test_mirror_read_only_indices():
+    m = build(Coordinate.YUP_ZFORWARD,
+              Direction.Y_POSITIVE, Direction.Z_NEGATIVE, Direction.X_NEGATIVE,
+              memoryview(array.array('H', INDICES).tobytes()).cast('H'))
+    coordinate.convert(m, Coordinate.YUP_ZBACKWARD, to_meter=False)
+    assert numpy.asarray(m.indices).tolist() == [0, 2, 1]
+
+
+def test_rotation():
+    m = build(Coordinate.ZUP_YFORWARD,
+              Direction.Z_POSITIVE, Direction.Y_POSITIVE, Direction.X_POSITIVE)
+    coordinate.convert(m, Coordinate.YUP_ZBACKWARD, to_meter=False)
+    # no mirror, the winding stays
+    assert numpy.asarray(m.indices).tolist() == INDICES
+    positions, normals = converted(m)
+    assert numpy.allclose(positions, [(0, 0, 0), (1, 0, 0), (0, 1, -1)])
+    assert numpy.allclose(face_normal(positions), normals)
+
+    metadata = m.metadata
+    assert metadata.up == Direction.Y_POSITIVE
+    assert metadata.forward == Direction.Z_NEGATIVE
+    assert metadata.right == Direction.X_POSITIVE
+    assert metadata.to_meter == 0.5
@@ -0,0 +1,30 @@
+import pytest
+
+# the renderer needs PyOpenGL and Pillow. no GL call is made here
+pytest.importorskip('OpenGL.GL')
+pytest.importorskip('PIL')
+
+from renderer import Drawer  # pylint: disable=C0413
+import shaders  # pylint: disable=C0413
+
+from .test_gltf import build, load  # pylint: disable=C0413
+
+
+def test_gltf_buffer_view_upload():
+    m = load(build())
+    drawer = Drawer.from_gltf(m, shaders.MmdShader)
+    assert not m.is_merged
+    assert drawer.stride == 32
+    assert [x.offset for x in drawer.layout] == [0, 12, 24]
+    # the bufferView itself, not repacked
+    assert bytes(drawer.vertices.data) == bytes(m.document.buffer_view(0))
+
+
+def test_gltf_fallback_to_pmd():
+    # the normals are zeros, not in the bufferView
+    m = load(build([{'attributes': {'POSITION': 0, 'NORMAL': 5, 'TEXCOORD_0': 2},
+                     'indices': 3}]))
+    drawer = Drawer.from_gltf(m, shaders.MmdShader)
+    assert m.is_merged
+    # repacked with the zero normals
+    assert bytes(drawer.vertices.data) != bytes(m.document.buffer_view(0))
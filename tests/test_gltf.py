@@ -0,0 +1,86 @@
+import base64
+import json
+import pathlib
+import struct
+
+import numpy
+import pytest
+
+from pyvbo import gltf, pmd
+
+POSITIONS = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)]
+INDICES = [0, 1, 2, 2, 1, 3]
+# signed normalized uvs. -128 clamps to -1.0
+UVS = [(-128, 127), (0, -127), (64, 0), (127, -128)]
+
+
+def build(primitives=None, accessors=None)->bytes:
+    '''
+    an interleaved bufferView of position, normal and uv (stride 32),
+    an index bufferView and a normalized int8 uv bufferView in a data uri
+    '''
+    vertices = b''.join(struct.pack('<3f3f2f', *pos, 0, 0, 1, *pos[:2]) for pos in POSITIONS)
+    indices = struct.pack(f'<{len(INDICES)}H', *INDICES)
+    uvs = b''.join(struct.pack('<2b', *x) for x in UVS)
+    data = vertices + indices + uvs
+    uri = 'data:application/octet-stream;base64,' + base64.b64encode(data).decode('ascii')
+    document = {
+        'asset': {'version': '2.0'},
+        'buffers': [{'uri': uri, 'byteLength': len(data)}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': len(vertices), 'byteStride': 32},
+            {'buffer': 0, 'byteOffset': len(vertices), 'byteLength': len(indices)},
+            {'buffer': 0, 'byteOffset': len(vertices) + len(indices), 'byteLength': len(uvs)},
+        ],
+        'accessors': [
+            {'bufferView': 0, 'byteOffset': 0, 'componentType': 5126, 'count': 4, 'type': 'VEC3'},
+            {'bufferView': 0, 'byteOffset': 12, 'componentType': 5126, 'count': 4, 'type': 'VEC3'},
+            {'bufferView': 0, 'byteOffset': 24, 'componentType': 5126, 'count': 4, 'type': 'VEC2'},
+            {'bufferView': 1, 'componentType': 5123, 'count': 6, 'type': 'SCALAR'},
+            {'bufferView': 2, 'componentType': 5120, 'count': 4, 'type': 'VEC2',
+             'normalized': True},
+            # no bufferView. zeros
+            {'componentType': 5126, 'count': 4, 'type': 'VEC3'},
+        ] + (accessors or []),
+        'meshes': [{'primitives': primitives or [
+            {'attributes': {'POSITION': 0, 'NORMAL': 1, 'TEXCOORD_0': 2}, 'indices': 3},
+        ]}],
+    }
+    return json.dumps(document).encode('utf-8')
+
+
+def load(data: bytes):
+    return gltf.load_bytes(data, pathlib.Path('model.gltf'))
+
+
+def test_interleaved():
+    m = load(build())
+    attributes = m.primitives[0].attributes
+    assert attributes['POSITION'].byte_stride == 32
+    assert attributes['NORMAL'].array.tolist() == [[0, 0, 1]] * 4
+    assert attributes['TEXCOORD_0'].array.tolist() == [list(x[:2]) for x in POSITIONS]
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    assert records['pos'].tolist() == [list(x) for x in POSITIONS]
+    assert numpy.asarray(m.indices).tolist() == INDICES
+
+
+def test_normalized():
+    m = load(build([{'attributes': {'POSITION': 0, 'TEXCOORD_0': 4}, 'indices': 3}]))
+    uv = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)['uv']
+    assert uv.min() == -1.0
+    assert numpy.allclose(uv, numpy.maximum(numpy.array(UVS) / 127.0, -1.0))
+
+
+def test_accessor_without_buffer_view():
+    m = load(build([{'attributes': {'POSITION': 0, 'NORMAL': 5}, 'indices': 3}]))
+    normal = m.primitives[0].attributes['NORMAL']
+    assert normal.buffer_view == -1
+    assert normal.array.tolist() == [[0, 0, 0]] * 4
+
+
+def test_sparse_accessor():
+    sparse = {'componentType': 5126, 'count': 4, 'type': 'VEC3',
+              'sparse': {'count': 1, 'indices': {'bufferView': 1, 'componentType': 5123},
+                         'values': {'bufferView': 0}}}
+    with pytest.raises(NotImplementedError):
+        load(build([{'attributes': {'POSITION': 6}, 'indices': 3}], [sparse]))
@@ -0,0 +1,12 @@
+import numpy
+
+from pyvbo.meshlet import Meshlet, MeshletCuller
+
+
+def test_backfacing_cones_opt_in():
+    # facing +z, all normals the same. the camera looks at it from -z
+    culler = MeshletCuller([Meshlet(0, 3, 0, (0, 0, 0), 0.5, (0, 0, 1), 0.0)])
+    mvp = numpy.identity(4)
+    camera = numpy.array([0.0, 0.0, -5.0])
+    assert culler.visible(mvp, camera).tolist() == [True]
+    assert culler.visible(mvp, camera, backfacing_cones=True).tolist() == [False]
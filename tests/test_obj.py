@@ -0,0 +1,45 @@
+import io
+import pathlib
+
+import numpy
+
+from pyvbo import obj, pmd
+
+
+def load(text: str):
+    return obj.load_bytes(text.encode('ascii'), pathlib.Path('model.obj'))
+
+
+def positions(m):
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    return records['pos'][numpy.asarray(m.indices)].tolist()
+
+
+TRIANGLE = [[0, 0, 0], [1, 0, 0], [0, 1, 0]]
+
+
+def test_comments():
+    m = load('# header\n'
+             'v 0 0 0 # origin\n'
+             'v 1 0 0\n'
+             'v 0 1 0#no space\n'
+             'f 1 2 3 # face\n')
+    assert positions(m) == TRIANGLE
+
+
+def test_leading_whitespace():
+    m = load('  v 0 0 0\n'
+             '\tv 1 0 0\n'
+             'v 0 1 0\r\n'
+             '   \n'
+             '  usemtl red\n'
+             '  f 1 2 3\n')
+    assert positions(m) == TRIANGLE
+    assert [x.name for x in m.materials] == ['red']
+
+
+def test_small_chunks():
+    text = 'v 0 0 0 # a\n  v 1 0 0\nv 0 1 0\n f 1 2 3\n'
+    m = obj.load_stream(io.BytesIO(text.encode('ascii')),
+                        pathlib.Path('model.obj'), 7)
+    assert positions(m) == TRIANGLE
@@ -0,0 +1,57 @@
+import pathlib
+
+import numpy
+
+from pyvbo import pmd
+from pyvbo.optimize import optimize
+from pyvbo.pipeline import Pipeline
+from pyvbo.simplify import build_lods
+
+from .test_pmd import build
+
+SIZE = 16
+
+
+def grid():
+    positions = [(x, y, 0) for y in range(SIZE) for x in range(SIZE)]
+    indices = []
+    for y in range(SIZE - 1):
+        for x in range(SIZE - 1):
+            i = y * SIZE + x
+            indices += [i, i + 1, i + SIZE, i + 1, i + SIZE + 1, i + SIZE]
+    return pmd.load_bytes(build(positions, indices, []), pathlib.Path('grid.pmd'))
+
+
+def meshlet_triangles(m):
+    '''
+    sorted triangle positions of each meshlet
+    '''
+    positions = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)['pos']
+    indices = numpy.asarray(m.indices)
+    return [sorted(tuple(map(tuple, positions[indices[x.offset:x.offset + x.count]]
+                             .reshape(-1, 3, 3).tolist())))
+            for x in m.meshlets]
+
+
+def test_optimize_keeps_meshlets():
+    m = grid()
+    Pipeline(meshlets=True)(m)
+    optimized = grid()
+    Pipeline(optimize=True, meshlets=True)(optimized)
+    assert len(m.meshlets) > 1
+    assert [(x.offset, x.count) for x in optimized.meshlets] ==\
+        [(x.offset, x.count) for x in m.meshlets]
+    assert meshlet_triangles(optimized) == meshlet_triangles(m)
+
+
+def lod_triangles(m):
+    positions = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)['pos']
+    return [positions[numpy.asarray(x.indices)].tolist() for x in m.lods]
+
+
+def test_optimize_after_lods():
+    m = grid()
+    build_lods(m, (0.5, 0.25))
+    before = lod_triangles(m)
+    optimize(m)
+    assert lod_triangles(m) == before
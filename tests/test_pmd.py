@@ -0,0 +1,120 @@
+import pathlib
+import struct
+
+import numpy
+
+from pyvbo import optimize, pmd
+
+
+def build(positions, indices, morphs, bones=())->bytes:
+    '''
+    one material.
+    morphs: (name, type, [(index, (x, y, z))]). type 0 is the base
+    bones: (name, (x, y, z))
+    '''
+    data = b'Pmd' + struct.pack('<f', 1.0) + b'model'.ljust(20, b'\0') + b''.ljust(256, b'\0')
+    data += struct.pack('<I', len(positions))
+    for pos in positions:
+        data += struct.pack('<3f3f2fhhbb', *pos, 0, 1, 0, 0, 0, 0, 0, 100, 0)
+    data += struct.pack('<I', len(indices)) + struct.pack(f'<{len(indices)}H', *indices)
+    data += struct.pack('<I', 1) + struct.pack('<4ff3f3fbbI', 1, 1, 1, 1, 5, 0, 0, 0,
+                                              0.5, 0.5, 0.5, -1, 0, len(indices)) \
+        + b''.ljust(20, b'\0')
+    data += struct.pack('<H', len(bones))
+    for name, pos in bones:
+        data += name.encode('ascii').ljust(20, b'\0') + struct.pack('<hhBh3f', -1, -1, 0, 0, *pos)
+    data += struct.pack('<H', 0)
+    data += struct.pack('<H', len(morphs))
+    for name, morph_type, entries in morphs:
+        data += name.encode('ascii').ljust(20, b'\0') + struct.pack('<IB', len(entries), morph_type)
+        for index, pos in entries:
+            data += struct.pack('<I3f', index, *pos)
+    return data
+
+
+POSITIONS = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0), (2, 0, 0)]
+# vertex 4 is not used
+INDICES = [2, 3, 1, 2, 1, 0]
+MORPHS = [
+    ('base', 0, [(3, (1, 1, 0)), (1, (1, 0, 0)), (4, (2, 0, 0))]),
+    ('up', 1, [(0, (0, 0, 1)), (1, (0, 0, 2))]),
+    ('unused', 1, [(2, (0, 0, 3))]),
+]
+
+
+def load():
+    return pmd.load_bytes(build(POSITIONS, INDICES, MORPHS), pathlib.Path('model.pmd'))
+
+
+def morph_targets(m, name: str):
+    '''
+    {position of the moved vertex: offset}
+    '''
+    morphs = m.sections.morphs
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    _, base_values = morphs[0]
+    _, values = morphs[m.sections.morph_names.index(name)]
+    return sorted((tuple(records['pos'][base_values['index'][x['index']]].tolist()),
+                   tuple(x['pos'].tolist()))
+                  for x in values)
+
+
+def test_morph_after_reorder():
+    m = load()
+    before = morph_targets(m, 'up')
+    optimize.optimize(m)
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    # reordered, the unused vertex last
+    assert records['pos'][0].tolist() == [0, 1, 0]
+    assert morph_targets(m, 'up') == before
+    assert len(m.sections.morphs[0][1]) == 3
+
+
+def test_morph_removed_vertex():
+    m = load()
+    m.select_vertices(numpy.array([0, 1, 2, 3]))
+    _, base_values = m.sections.morphs[0]
+    assert sorted(base_values['index'].tolist()) == [1, 3]
+    assert morph_targets(m, 'up') == [((1, 0, 0), (0, 0, 2)), ((1, 1, 0), (0, 0, 1))]
+    assert morph_targets(m, 'unused') == []
+
+
+def test_morph_duplicated_vertex():
+    m = load()
+    m.select_vertices(numpy.array([0, 1, 2, 3, 4, 3]))
+    _, base_values = m.sections.morphs[0]
+    assert sorted(base_values['index'].tolist()) == [1, 3, 4, 5]
+    _, values = m.sections.morphs[1]
+    assert len(values) == 3
+
+
+def test_morph_after_weld():
+    from pyvbo import weld
+    # vertex 5 duplicates vertex 0, vertex 6 duplicates vertex 1 of the base morph
+    positions = POSITIONS + [(0, 0, 0), (1, 0, 0)]
+    indices = INDICES + [5, 6, 3]
+    m = pmd.load_bytes(build(positions, indices, MORPHS), pathlib.Path('model.pmd'))
+    before = morph_targets(m, 'up')
+    report = weld.weld(m)
+    # 5 is merged into 0. 6 is kept, the morphs do not move it
+    assert report.vertices_after == 6
+    assert morph_targets(m, 'up') == before
+    indices = numpy.asarray(m.indices)
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    assert records['pos'][indices].tolist() == [list(positions[x]) for x in INDICES + [5, 6, 3]]
+
+
+def test_convert_sections():
+    from pyvbo import coordinate
+    from pyvbo.metadata import Coordinate
+    m = pmd.load_bytes(build(POSITIONS, INDICES, MORPHS, [('center', (1, 2, 3))]),
+                       pathlib.Path('model.pmd'))
+    coordinate.convert(m, Coordinate.YUP_ZBACKWARD)
+    scale = 1.58 / 20
+    assert numpy.allclose(m.sections.bones['pos'], [[scale, 2 * scale, -3 * scale]])
+    _, values = m.sections.morphs[1]
+    assert numpy.allclose(values['pos'], [[0, 0, -scale], [0, 0, -2 * scale]])
+    # base positions match the converted vertices
+    _, base_values = m.sections.morphs[0]
+    records = numpy.frombuffer(m.vertices, pmd.VertexRecord.dtype)
+    assert numpy.allclose(base_values['pos'], records['pos'][base_values['index']])
@@ -0,0 +1,67 @@
+import pathlib
+import struct
+
+import numpy
+
+from pyvbo import pmx
+
+
+def _text(value: str)->bytes:
+    data = value.encode('utf-8')
+    return struct.pack('<i', len(data)) + data
+
+
+def _bdef1(pos, bone: int)->bytes:
+    return struct.pack('<3f3f2f', *pos, 0, 1, 0, 0, 0) + struct.pack('<Bi', pmx.BDEF1, bone) \
+        + struct.pack('<f', 1.0)
+
+
+def _bdef2(pos, bone0: int, bone1: int, weight: float)->bytes:
+    return struct.pack('<3f3f2f', *pos, 0, 1, 0, 0, 0) \
+        + struct.pack('<Biif', pmx.BDEF2, bone0, bone1, weight) + struct.pack('<f', 1.0)
+
+
+def build(version: float, vertices, indices)->bytes:
+    '''
+    utf-8, no additional uv, 4 byte bone indices, no textures and materials
+    '''
+    data = b'PMX ' + struct.pack('<f', version) + bytes([8, 1, 0, 1, 1, 1, 4, 1, 1])
+    data += _text('model') + _text('') + _text('comment') + _text('')
+    data += struct.pack('<i', len(vertices)) + b''.join(vertices)
+    data += struct.pack('<i', len(indices)) + bytes(indices)
+    data += struct.pack('<i', 0) + struct.pack('<i', 0)
+    return data
+
+
+def test_version_2_1():
+    data = build(2.1, [_bdef1((0, 0, 0), 0), _bdef1((1, 0, 0), 0), _bdef1((0, 1, 0), 0)],
+                 [0, 1, 2])
+    m = pmx.load_bytes(data, pathlib.Path('model.pmx'))
+    assert m is not None
+    assert m.metadata.name == 'model'
+    assert list(numpy.asarray(m.indices)) == [0, 1, 2]
+
+
+def test_unknown_version():
+    data = build(3.0, [_bdef1((0, 0, 0), 0)], [])
+    assert pmx.load_bytes(data, pathlib.Path('model.pmx')) is None
+
+
+def test_mixed_deform():
+    data = build(2.0, [_bdef1((0, 0, 0), 3),
+                       _bdef2((1, 0, 0), 1, 2, 0.25),
+                       _bdef1((0, 1, 0), 5)], [0, 1, 2])
+    m = pmx.load_bytes(data, pathlib.Path('model.pmx'))
+    records = numpy.frombuffer(m.vertices, pmx.pmd.VertexRecord.dtype)
+    assert records['pos'].tolist() == [[0, 0, 0], [1, 0, 0], [0, 1, 0]]
+    assert records['bone0'].tolist() == [3, 1, 5]
+    assert records['bone1'].tolist() == [3, 2, 5]
+    assert m.skinning.bone_weights[1, :2].tolist() == [0.25, 0.75]
+
+
+def test_bone_index_clamp():
+    data = build(2.0, [_bdef2((0, 0, 0), 40000, 1, 0.5)], [])
+    m = pmx.load_bytes(data, pathlib.Path('model.pmx'))
+    records = numpy.frombuffer(m.vertices, pmx.pmd.VertexRecord.dtype)
+    assert records['bone0'].tolist() == [pmx.PMD_BONE_MAX]
+    assert m.skinning.bone_indices[0, 0] == 40000
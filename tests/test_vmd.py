@@ -0,0 +1,126 @@
+import math
+import pathlib
+import struct
+
+import numpy
+
+from pyvbo import vmd
+
+LINEAR = (20, 20, 107, 107)
+EASE = (127, 0, 0, 127)
+
+
+def build(bones, morphs=())->bytes:
+    '''
+    bones: (name, frame, (x, y, z), (x, y, z, w), curve of x1, y1, x2, y2)
+    morphs: (name, frame, weight)
+    '''
+    data = vmd.MAGIC.ljust(30, b'\0') + b'model'.ljust(20, b'\0')
+    data += struct.pack('<I', len(bones))
+    for name, frame, pos, rot, curve in bones:
+        interpolation = bytes(x for x in curve for _ in range(4)).ljust(64, b'\0')
+        data += name.encode('cp932').ljust(15, b'\0') \
+            + struct.pack('<I3f4f', frame, *pos, *rot) + interpolation
+    data += struct.pack('<I', len(morphs))
+    for name, frame, weight in morphs:
+        data += name.encode('cp932').ljust(15, b'\0') + struct.pack('<If', frame, weight)
+    return data
+
+
+def rotation_y(degree: float):
+    half = math.radians(degree) / 2
+    return (0.0, math.sin(half), 0.0, math.cos(half))
+
+
+# in file order, not sorted
+BONES = [
+    ('center', 10, (10, 0, 0), rotation_y(90), LINEAR),
+    ('arm', 5, (0, 1, 0), rotation_y(0), LINEAR),
+    ('center', 0, (0, 0, 0), rotation_y(0), LINEAR),
+    ('arm', 15, (0, 3, 0), rotation_y(0), EASE),
+]
+MORPHS = [('a', 0, 0.0), ('a', 10, 1.0)]
+
+
+def load():
+    return vmd.load_bytes(build(BONES, MORPHS), pathlib.Path('motion.vmd'))
+
+
+def sample(motion, frame: float):
+    '''
+    {name: (position, rotation)}
+    '''
+    positions, rotations = motion.bones.sample(frame)
+    return {name: (positions[i].tolist(), rotations[i].tolist())
+            for i, name in enumerate(motion.bones.names)}
+
+
+def reference_bezier(x: float, x1: float, y1: float, x2: float, y2: float)->float:
+    lo, hi = 0.0, 1.0
+    for _ in range(60):
+        s = (lo + hi) / 2
+        if 3 * (1 - s) ** 2 * s * x1 + 3 * (1 - s) * s * s * x2 + s ** 3 < x:
+            lo = s
+        else:
+            hi = s
+    s = (lo + hi) / 2
+    return 3 * (1 - s) ** 2 * s * y1 + 3 * (1 - s) * s * s * y2 + s ** 3
+
+
+def test_load():
+    motion = load()
+    assert sorted(motion.bones.names) == ['arm', 'center']
+    assert motion.frame_count == 16
+    assert motion.bones.key_count == 4
+
+
+def test_between_keys():
+    values = sample(load(), 5)
+    position, rotation = values['center']
+    assert numpy.allclose(position, (5, 0, 0), atol=1e-3)
+    # slerp, not lerp. half of the angle
+    assert numpy.allclose(rotation, rotation_y(45), atol=1e-3)
+
+
+def test_bezier_curve():
+    # the curve of the segment is the one of its end key
+    position, _ = sample(load(), 10)['arm']
+    y = reference_bezier(0.5, *(x / 127 for x in EASE))
+    assert abs(position[1] - (1 + 2 * y)) < 1e-3
+    assert numpy.allclose(vmd.bezier(numpy.array([0.25]), numpy.array([[0.2, 0.2, 0.8, 0.8]])),
+                          0.25, atol=1e-4)
+
+
+def test_on_key():
+    values = sample(load(), 10)
+    assert numpy.allclose(values['center'][0], (10, 0, 0))
+    assert numpy.allclose(values['center'][1], rotation_y(90), atol=1e-6)
+    assert numpy.allclose(sample(load(), 15)['arm'][0], (0, 3, 0))
+
+
+def test_before_and_after_keys():
+    motion = load()
+    before = sample(motion, 0)
+    assert numpy.allclose(before['arm'][0], (0, 1, 0))
+    assert numpy.allclose(sample(motion, -3)['center'][0], (0, 0, 0))
+    after = sample(motion, 100)
+    assert numpy.allclose(after['center'][0], (10, 0, 0))
+    assert numpy.allclose(after['arm'][0], (0, 3, 0))
+
+
+def test_backwards():
+    motion = load()
+    frames = [0, 3, 7.5, 12, 100, 12, 7.5, 3, 0, 9]
+    # the cursor of each track moves forward, then back
+    values = [sample(motion, x) for x in frames]
+    for frame, value in zip(frames, values):
+        expected = sample(load(), frame)
+        for name in expected:
+            assert numpy.allclose(value[name][0], expected[name][0])
+            assert numpy.allclose(value[name][1], expected[name][1])
+
+
+def test_morph():
+    motion = load()
+    assert numpy.allclose(motion.morphs.sample(2.5), [0.25])
+    assert numpy.allclose(motion.morphs.sample(20), [1.0])